@@ -0,0 +1,74 @@
+import argparse
+import random
+import time
+
+import copy_decoding
+import inflection_model
+from bench_morphology import read_rows
+from inference_scheduler import percentile
+
+
+# Checks copy-aware decoding (copy_decoding.py) against plain greedy model.generate() on the training csvs:
+# the outputs have to be identical, and it reports decoder passes per phrase (greedy needs one per output token) and latency.
+# Run with: python bench_copy_decoding.py --samples 300
+
+DATASETS = ['single_word.csv', 'two_to_three_words.csv', 'complex_phrases.csv']
+
+
+def encode(tokenizer, jobs):
+    return tokenizer([f"{directive}: {phrase}" for directive, phrase in jobs], return_tensors="pt", padding=True, truncation=True, max_length=64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy-aware decoding vs greedy generate(): parity, decoder passes, latency.")
+    parser.add_argument('--samples', type=int, default=300, help="phrases per dataset")
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    model, tokenizer = inflection_model.load_model()
+    rng = random.Random(args.seed)
+    print(f"{'dataset':<24} {'phrases':>8} {'identical':>10} {'tokens/phrase':>14} {'passes/phrase':>14} "
+          f"{'greedy p50 ms':>14} {'copy p50 ms':>12} {'speedup':>8}")
+    for path in DATASETS:
+        rows = read_rows(path)
+        rng.shuffle(rows)
+        jobs = [(directive, phrase) for directive, phrase, _ in rows[:args.samples]]
+
+        identical = 0
+        greedy_times, copy_times = [], []
+        before = dict(copy_decoding.counters)
+        for start in range(0, len(jobs), args.batch_size):
+            batch = jobs[start:start + args.batch_size]
+            inputs = encode(tokenizer, batch)
+            phrase_starts = [inflection_model.prefix_length(tokenizer, directive) for directive, _ in batch]
+
+            started = time.perf_counter()
+            greedy = model.generate(inputs['input_ids'], attention_mask=inputs['attention_mask'])
+            greedy_times.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            copied = copy_decoding.generate(model, inputs['input_ids'], inputs['attention_mask'], phrase_starts)
+            copy_times.append(time.perf_counter() - started)
+
+            greedy_text = tokenizer.batch_decode(greedy, skip_special_tokens=True)
+            copied_text = tokenizer.batch_decode(copied, skip_special_tokens=True)
+            for job, expected, got in zip(batch, greedy_text, copied_text):
+                if expected == got:
+                    identical += 1
+                else:
+                    print(f"    MISMATCH {job}: greedy {expected!r}, copy {got!r}")
+
+        sequences = copy_decoding.counters['sequences'] - before['sequences']
+        tokens = copy_decoding.counters['tokens'] - before['tokens']
+        passes = copy_decoding.counters['decoder_passes'] - before['decoder_passes']
+        greedy_p50, copy_p50 = percentile(greedy_times, 50), percentile(copy_times, 50)
+        print(
+            f"{path:<24} {len(jobs):>8} {identical / max(len(jobs), 1):>10.1%} {tokens / max(sequences, 1):>14.2f} "
+            f"{passes / max(sequences, 1):>14.2f} {greedy_p50 * 1000:>14.1f} {copy_p50 * 1000:>12.1f} "
+            f"{greedy_p50 / max(copy_p50, 1e-9):>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
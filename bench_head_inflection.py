@@ -0,0 +1,139 @@
+import argparse
+import random
+import sys
+
+import morphology
+from bench_morphology import MODEL_BATCH_SIZE, model_outputs, read_rows
+from inflection_cache import InflectionCache
+
+
+# What sending only the head noun to the model (morphology.decompose, INFLECTION_HEAD_ONLY in the bot) does to the phrases the rules
+# can't answer, per training csv:
+#   - split: how many of them go to the model as a head word, and how many still go whole
+#   - consistent: share of head word rows where the csv's answer really only changes the head, the most head-only can get right
+#   - input length: words per model input, whole phrases against head words (tokens too with --model)
+#   - model calls and cache hit rate replaying the csv in random order through an empty InflectionCache, whole against head-only
+#   - with --model: exact match against the csv, inflecting whole phrases against inflecting the head and putting the rest back
+# Exits 1 if head-only is less accurate than whole phrases (with --model) or the consistency is under --min-consistent.
+# Run with: python bench_head_inflection.py            (no torch needed)
+#           python bench_head_inflection.py --model
+
+DEFAULT_DATASETS = ['two_to_three_words.csv', 'complex_phrases.csv']
+
+
+def split_rows(rows):
+    """(rows the rules answer, [(row, (before, head, after))] for head-only, rows that go whole)"""
+    ruled, heads, whole = [], [], []
+    for row in rows:
+        directive, phrase, _ = row
+        if morphology.inflect(directive, phrase) is not None:
+            ruled.append(row)
+            continue
+        parts = morphology.decompose(phrase)
+        if parts is None or parts[1] == phrase or not morphology.inflects_by_head(parts):
+            whole.append(row)
+        else:
+            heads.append((row, parts))
+    return ruled, heads, whole
+
+
+def expected_head(parts, expected):
+    # the csv's answer for the head word alone, when the rest of the phrase comes back unchanged
+    before, _, after = parts
+    before_words, after_words, expected_words = before.split(), after.split(), expected.split()
+    if len(expected_words) != len(before_words) + 1 + len(after_words):
+        return None
+    if expected_words[:len(before_words)] != before_words or expected_words[len(before_words) + 1:] != after_words:
+        return None
+    return expected_words[len(before_words)]
+
+
+def replay_cache(rows, head_only, seed):
+    """Model calls and cache hit rate for every row the rules can't answer, in random order, starting from an empty cache."""
+    cache = InflectionCache(path=None, max_entries=1_000_000)
+    model_rows = [(row, parts) for row, parts in rows]
+    random.Random(seed).shuffle(model_rows)
+    lookups = calls = 0
+    for (directive, phrase, expected), parts in model_rows:
+        if head_only and parts is not None:
+            key, answer = parts[1], expected_head(parts, expected) or morphology.guess(directive, parts[1])
+            if morphology.inflect(directive, key) is not None:
+                continue  # the rules know the word by itself
+        else:
+            key, answer = phrase, expected
+        lookups += 1
+        if cache.get(directive, key) is None:
+            calls += 1
+            cache.put(directive, key, answer)
+    return calls, 1 - calls / lookups if lookups else 0.0
+
+
+def token_lengths(texts):
+    import inflection_model  # only with --model
+
+    _, tokenizer = inflection_model.load_model()
+    return [len(tokenizer(text)['input_ids']) for text in texts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Head noun only inflection against whole phrase inflection, on the training csvs.")
+    parser.add_argument('--datasets', default=','.join(DEFAULT_DATASETS))
+    parser.add_argument('--model', action='store_true', help="also compare accuracy and token counts with the fine tuned model")
+    parser.add_argument('--min-consistent', type=float, default=0.95, help="lowest acceptable consistency on head-only rows")
+    parser.add_argument('--show-mismatches', type=int, default=0, help="print this many head-only rows the csv disagrees with")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    morphology.lexicon()
+    failed = False
+    for path in args.datasets.split(','):
+        rows = read_rows(path)
+        ruled, heads, whole = split_rows(rows)
+        consistent = [(row, parts) for row, parts in heads if expected_head(parts, row[2]) is not None]
+        consistency = len(consistent) / len(heads) if heads else 1.0
+
+        # every input the model would see, whole phrase mode against head-only mode
+        whole_inputs = [phrase for _, phrase, _ in whole] + [row[1] for row, _ in heads]
+        head_inputs = [phrase for _, phrase, _ in whole] + [parts[1] for _, parts in heads]
+        mean_words = lambda texts: sum(len(text.split()) for text in texts) / max(len(texts), 1)
+
+        model_rows = [(row, None) for row in whole] + heads
+        whole_calls, whole_hit_rate = replay_cache(model_rows, False, args.seed)
+        head_calls, head_hit_rate = replay_cache(model_rows, True, args.seed)
+
+        print(f"\n{path}: {len(rows)} rows, {len(ruled)} answered by the rules, {len(heads)} head-only, {len(whole)} still whole")
+        print(f"    consistent: {consistency:.1%} of head-only rows only change the head in the csv")
+        print(f"    words per model input: whole {mean_words(whole_inputs):.2f}, head-only {mean_words(head_inputs):.2f}"
+              f" (head-only rows alone: {mean_words([row[1] for row, _ in heads]):.2f} -> 1.00)")
+        print(f"    model calls replaying the csv: whole {whole_calls} (cache hit rate {whole_hit_rate:.1%}), "
+              f"head-only {head_calls} (cache hit rate {head_hit_rate:.1%})")
+        if consistency < args.min_consistent:
+            failed = True
+
+        if args.model and heads:
+            whole_tokens, head_tokens = token_lengths([row[1] for row, _ in heads]), token_lengths([parts[1] for _, parts in heads])
+            print(f"    tokens per head-only row: whole {sum(whole_tokens) / len(heads):.2f}, head-only {sum(head_tokens) / len(heads):.2f}")
+            whole_outputs = model_outputs([(directive, phrase) for (directive, phrase, _), _ in heads])
+            head_outputs = model_outputs([(row[0], parts[1]) for row, parts in heads])
+            whole_correct = sum(output == row[2] for (row, _), output in zip(heads, whole_outputs))
+            head_correct = sum(
+                morphology.join(parts[0], output or parts[1], parts[2]) == row[2] for (row, parts), output in zip(heads, head_outputs)
+            )
+            print(f"    exact match on head-only rows: whole {whole_correct / len(heads):.1%}, head-only {head_correct / len(heads):.1%}")
+            if head_correct < whole_correct:
+                failed = True
+
+        shown = 0
+        for row, parts in heads:
+            if shown >= args.show_mismatches:
+                break
+            if expected_head(parts, row[2]) is None:
+                print(f"    {row[0]} {row[1]!r}: csv {row[2]!r}, head {parts[1]!r}")
+                shown += 1
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_morphology import DATASETS, read_rows
+from inference_scheduler import percentile
+from inference_server import InferenceClient
+
+
+# Scale-out check for inference_server.py: 1, 2, 4, 8... simulated bot processes hitting one server, each with a few
+# requests in flight like a busy channel. Per step it reports throughput, request latency, timeouts/errors, how big the
+# server's batches got, and the server's memory, which should stay put however many bots there are.
+# Starts its own server (add --rules-only to skip torch) unless --socket points at one that's already running.
+# Run with: python bench_inference_server.py --bots 1,2,4,8 --rules-only
+#           python inference_server.py --socket /tmp/inflection.sock & python bench_inference_server.py --socket /tmp/inflection.sock
+
+
+def load_jobs(seed):
+    rows = [(directive, phrase) for path in DATASETS for directive, phrase, _ in read_rows(path)]
+    random.Random(seed).shuffle(rows)
+    return rows
+
+
+def run_bot(socket_path, jobs, requests, concurrency, timeout_s, seed):
+    """One simulated bot process. Returns (latencies in seconds, timeouts, errors)."""
+    async def run():
+        rng = random.Random(seed)
+        client = InferenceClient(socket_path, timeout_s=timeout_s)
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies, failures = [], {'timeouts': 0, 'errors': 0}
+
+        async def one_request():
+            group = [rng.choice(jobs) for _ in range(rng.randint(1, 4))]  # a message with a few items in it
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await client.generate(group)
+                except asyncio.TimeoutError:
+                    failures['timeouts'] += 1
+                    return
+                except Exception:
+                    failures['errors'] += 1
+                    return
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one_request() for _ in range(requests)))
+        await client.close()
+        return latencies, failures['timeouts'], failures['errors']
+
+    return asyncio.run(run())
+
+
+async def server_health(socket_path, wait_s=600):
+    # polls until the server is up and has its model loaded
+    client = InferenceClient(socket_path)
+    deadline = time.perf_counter() + wait_s
+    try:
+        while True:
+            try:
+                health = await client.health()
+                if health['status'] != 'loading':
+                    return health
+            except (OSError, asyncio.TimeoutError):
+                pass
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"No ready inference server on {socket_path} after {wait_s}s")
+            await asyncio.sleep(0.2)
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput, latency and memory of one inference server shared by N bots.")
+    parser.add_argument('--bots', default='1,2,4,8', help="numbers of bot processes to try, one after another")
+    parser.add_argument('--requests', type=int, default=500, help="requests per bot per step")
+    parser.add_argument('--concurrency', type=int, default=8, help="requests each bot has in flight")
+    parser.add_argument('--timeout-s', type=float, default=5.0)
+    parser.add_argument('--socket', help="use the server already listening here instead of starting one")
+    parser.add_argument('--rules-only', action='store_true', help="start the server with --rules-only")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write the results here")
+    args = parser.parse_args()
+
+    server = None
+    socket_path = args.socket
+    if socket_path is None:
+        socket_path = os.path.join(tempfile.mkdtemp(prefix='inference_bench_'), 'inflection.sock')
+        command = [sys.executable, 'inference_server.py', '--socket', socket_path] + (['--rules-only'] if args.rules_only else [])
+        server = subprocess.Popen(command, env={**os.environ, 'INFERENCE_REPORT_EVERY': '0'})
+
+    try:
+        health = asyncio.run(server_health(socket_path))
+        if health['status'] != 'ready':
+            sys.exit(f"Inference server isn't ready: {health}")
+        print(f"Server {health['backend']} (pid {health['pid']}), {health['rss_mb']:.0f}MB before any requests")
+        jobs = load_jobs(args.seed)
+
+        print(f"{'bots':>5} {'req/s':>9} {'jobs/batch':>11} {'p50 ms':>8} {'p99 ms':>8} {'timeouts':>9} {'errors':>7} {'server MB':>10}")
+        results = []
+        context = multiprocessing.get_context('spawn')
+        for bots in [int(value) for value in args.bots.split(',')]:
+            before = asyncio.run(server_health(socket_path))['scheduler']
+            start = time.perf_counter()
+            with context.Pool(bots) as pool:
+                outcomes = pool.starmap(run_bot, [
+                    (socket_path, jobs, args.requests, args.concurrency, args.timeout_s, args.seed + index) for index in range(bots)
+                ])
+            elapsed = time.perf_counter() - start
+            health = asyncio.run(server_health(socket_path))
+            after = health['scheduler']
+
+            latencies = [latency for bot_latencies, _, _ in outcomes for latency in bot_latencies]
+            batches = after['batches'] - before['batches']
+            result = {
+                'bots': bots,
+                'requests_per_s': bots * args.requests / elapsed,
+                'jobs_per_batch': (after['jobs'] - before['jobs']) / batches if batches else 0.0,
+                'p50_ms': percentile(latencies, 50) * 1000,
+                'p99_ms': percentile(latencies, 99) * 1000,
+                'timeouts': sum(timeouts for _, timeouts, _ in outcomes),
+                'errors': sum(errors for _, _, errors in outcomes),
+                'server_rss_mb': health['rss_mb'],
+            }
+            results.append(result)
+            print(
+                f"{bots:>5} {result['requests_per_s']:>9.1f} {result['jobs_per_batch']:>11.2f} {result['p50_ms']:>8.1f} "
+                f"{result['p99_ms']:>8.1f} {result['timeouts']:>9} {result['errors']:>7} {result['server_rss_mb']:>10.0f}"
+            )
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'steps': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+    if any(result['timeouts'] or result['errors'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
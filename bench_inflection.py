@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import time
+
+from bench_morphology import DATASETS, read_rows
+from inference_scheduler import percentile
+
+
+# Accuracy and speed of an inflection checkpoint over every training csv, so a retrained model or a new backend can be
+# compared against the last one instead of eyeballing bot_checking.py.
+#   - accuracy: exact match against the csv's output, per csv and per direction (pluralize / singularize)
+#   - latency: p50/p99 of one phrase per generate_batch() call, the way a lone .add hits the model
+#   - throughput: phrases/s at each --batch-sizes, the way the scheduler runs a busy channel
+#   - peak RSS of this process
+# Results go to a json file. With --baseline it compares against an earlier results file and exits 1 on a regression.
+# Run with: python bench_inflection.py --output results_new.json --baseline results_old.json
+#           INFLECTION_BACKEND=onnx python bench_inflection.py --model fine_tuned_t5_complex_onnx
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on linux
+
+
+def load_jobs(per_category, seed):
+    # every csv, both directions, optionally capped at per_category rows per (csv, direction)
+    rng = random.Random(seed)
+    rows = []
+    for path in DATASETS:
+        by_direction = {'pluralize': [], 'singularize': []}
+        for directive, phrase, expected in read_rows(path):
+            by_direction[directive].append((path, directive, phrase, expected))
+        for directive_rows in by_direction.values():
+            if per_category and len(directive_rows) > per_category:
+                directive_rows = rng.sample(directive_rows, per_category)
+            rows.extend(directive_rows)
+    return rows
+
+
+def run_batches(jobs, batch_size):
+    import inflection_model
+
+    outputs = []
+    for start in range(0, len(jobs), batch_size):
+        outputs.extend(inflection_model.generate_batch(jobs[start:start + batch_size]))
+    return outputs
+
+
+def measure_accuracy(rows, batch_size):
+    from inflection_cache import normalize_phrase
+
+    outputs = run_batches([(directive, phrase) for _, directive, phrase, _ in rows], batch_size)
+    totals = {}
+    mistakes = []
+    for (path, directive, phrase, expected), output in zip(rows, outputs):
+        output = normalize_phrase(output)
+        category = totals.setdefault(path, {}).setdefault(directive, {'rows': 0, 'correct': 0})
+        category['rows'] += 1
+        if output == expected:
+            category['correct'] += 1
+        else:
+            mistakes.append({'dataset': path, 'directive': directive, 'input': phrase, 'expected': expected, 'output': output})
+
+    accuracy = {}
+    for path, directions in totals.items():
+        accuracy[path] = {directive: counts['correct'] / counts['rows'] for directive, counts in directions.items()}
+        accuracy[path]['both'] = sum(c['correct'] for c in directions.values()) / sum(c['rows'] for c in directions.values())
+    overall = sum(c['correct'] for d in totals.values() for c in d.values()) / max(len(rows), 1)
+    return overall, accuracy, mistakes
+
+
+def measure_latency(jobs):
+    import inflection_model
+
+    latencies = []
+    for job in jobs:
+        start = time.perf_counter()
+        inflection_model.generate_batch([job])
+        latencies.append(time.perf_counter() - start)
+    return {'p50_ms': percentile(latencies, 50) * 1000, 'p99_ms': percentile(latencies, 99) * 1000}
+
+
+def measure_throughput(jobs, batch_sizes):
+    throughput = {}
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        run_batches(jobs, batch_size)
+        throughput[str(batch_size)] = len(jobs) / (time.perf_counter() - start)
+    return throughput
+
+
+def find_regressions(results, baseline, max_accuracy_drop, max_slowdown):
+    """Differences from baseline worse than the allowed margins, as readable strings."""
+    regressions = []
+    for path, directions in results['accuracy'].items():
+        for directive, value in directions.items():
+            old = baseline.get('accuracy', {}).get(path, {}).get(directive)
+            if old is not None and old - value > max_accuracy_drop:
+                regressions.append(f"accuracy {path} {directive}: {old:.1%} -> {value:.1%}")
+    old_overall = baseline.get('overall_accuracy')
+    if old_overall is not None and old_overall - results['overall_accuracy'] > max_accuracy_drop:
+        regressions.append(f"overall accuracy: {old_overall:.1%} -> {results['overall_accuracy']:.1%}")
+
+    for name in ('p50_ms', 'p99_ms'):
+        old = baseline.get('latency', {}).get(name)
+        if old and results['latency'][name] > old * (1 + max_slowdown):
+            regressions.append(f"latency {name}: {old:.1f} -> {results['latency'][name]:.1f}")
+    for batch_size, value in results['throughput_per_s'].items():
+        old = baseline.get('throughput_per_s', {}).get(batch_size)
+        if old and value < old / (1 + max_slowdown):
+            regressions.append(f"throughput at batch {batch_size}: {old:.1f}/s -> {value:.1f}/s")
+    old_rss = baseline.get('peak_rss_mb')
+    if old_rss and results['peak_rss_mb'] > old_rss * (1 + max_slowdown):
+        regressions.append(f"peak RSS: {old_rss:.0f}MB -> {results['peak_rss_mb']:.0f}MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per category accuracy, latency, throughput and memory of an inflection checkpoint.")
+    parser.add_argument('--model', help="checkpoint folder, defaults to INFLECTION_MODEL_PATH (or INFLECTION_ONNX_PATH for onnx)")
+    parser.add_argument('--per-category', type=int, default=0, help="cap rows per csv and direction, 0 runs everything")
+    parser.add_argument('--accuracy-batch-size', type=int, default=16)
+    parser.add_argument('--batch-sizes', default='1,8,32', help="comma separated batch sizes for throughput")
+    parser.add_argument('--throughput-samples', type=int, default=256, help="phrases per throughput run")
+    parser.add_argument('--latency-samples', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='bench_inflection_results.json')
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.005, help="allowed accuracy drop per category, as a fraction")
+    parser.add_argument('--max-slowdown', type=float, default=0.15, help="allowed relative latency/throughput/RSS change")
+    parser.add_argument('--show-mistakes', type=int, default=0, help="print this many wrong answers")
+    args = parser.parse_args()
+
+    if args.model:
+        # inflection_model reads these when it loads, so setting them here points it at the checkpoint
+        os.environ['INFLECTION_ONNX_PATH' if os.getenv('INFLECTION_BACKEND') == 'onnx' else 'INFLECTION_MODEL_PATH'] = args.model
+    import inflection_model
+
+    rows = load_jobs(args.per_category, args.seed)
+    jobs = [(directive, phrase) for _, directive, phrase, _ in rows]
+    sample = random.Random(args.seed).sample(jobs, min(len(jobs), max(args.throughput_samples, args.latency_samples)))
+
+    start = time.perf_counter()
+    warm_up_s = inflection_model.warm_up()
+    load_s = time.perf_counter() - start
+    print(f"Loaded {inflection_model.backend()} model in {load_s:.2f}s (warm up {warm_up_s:.2f}s), {len(rows)} rows")
+
+    overall, accuracy, mistakes = measure_accuracy(rows, args.accuracy_batch_size)
+    latency = measure_latency(sample[:args.latency_samples])
+    throughput = measure_throughput(sample[:args.throughput_samples], [int(size) for size in args.batch_sizes.split(',')])
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'backend': inflection_model.backend(),
+        'model': inflection_model.onnx_model_path() if inflection_model.backend() == 'onnx' else inflection_model.model_path(),
+        'copy_decoding': inflection_model.copy_decoding_enabled(),
+        'machine': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'rows': len(rows),
+        'load_s': load_s,
+        'overall_accuracy': overall,
+        'accuracy': accuracy,
+        'latency': latency,
+        'throughput_per_s': throughput,
+        'peak_rss_mb': peak_rss_mb(),
+        'mistakes': mistakes,
+    }
+
+    print(f"\n{'dataset':<28} {'pluralize':>10} {'singularize':>12} {'both':>8}")
+    for path in DATASETS:
+        if path in accuracy:
+            row = accuracy[path]
+            print(f"{path:<28} {row.get('pluralize', 0):>10.1%} {row.get('singularize', 0):>12.1%} {row['both']:>8.1%}")
+    print(f"{'overall':<28} {'':>10} {'':>12} {overall:>8.1%}")
+    print(f"\nlatency p50 {latency['p50_ms']:.1f}ms, p99 {latency['p99_ms']:.1f}ms")
+    print("throughput " + ", ".join(f"batch {size}: {value:.1f}/s" for size, value in throughput.items()))
+    print(f"peak RSS {results['peak_rss_mb']:.0f}MB")
+    for mistake in mistakes[:args.show_mistakes]:
+        print(f"    {mistake['dataset']} {mistake['directive']} {mistake['input']!r}: expected {mistake['expected']!r}, got {mistake['output']!r}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.max_accuracy_drop, args.max_slowdown)
+        if regressions:
+            print(f"REGRESSIONS against {args.baseline}:")
+            for regression in regressions:
+                print(f"    {regression}")
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import random
+import re
+import sys
+import time
+
+from bench_morphology import read_rows
+from item_parser import parse_items
+
+
+# Checks item_parser.parse_items against the regex parse_natural_language used before it, and times both.
+#   1. regression corpus: hand written DM messages plus --random generated ones built from the training items,
+#      with quantities, a/an/the, comma and "and" lists, internal periods (S.T.A.R.S.), trailing clauses and odd spacing.
+#      Every message has to give exactly the same items as the regex, otherwise it's printed and the exit code is 1
+#   2. adversarial messages: long all caps text with no terminal, long digit runs, lots of periods. The regex gets slower
+#      with the square of the length on these, parse_items stays linear
+# Run with: python bench_item_parser.py --random 20000
+
+TERMINAL_PATTERN = r'(?:,\s*(?:and\s+)?|\.(?:\s*[a-z]|\s+[A-Z][a-z]|\s+[A-Z]\s+[a-z])|\s+and\s+|(?:\s+(?:for|as|but|though|although|while|when|if|because|since|after|before|during|from|with|by|to|at|in|on|of|that|which|who|whom|whose|where|how|why|what)\b)|$)'
+LEGACY_ITEM_PATTERN = re.compile(r'(?:(\d+)\s+)?([A-Z][A-Z\s\.]*?(?=' + TERMINAL_PATTERN + '))')
+
+CORPUS = [
+    "A SWORD",
+    "a SWORD and 2 POTIONS OF HEALING.",
+    "3 HEALING POTIONS, a ROPE and the S.T.A.R.S. BADGE. you feel lighter",
+    "12 ARROWS, 1 BOW, and A QUIVER",
+    "THE AMULET OF YENDOR from the dragon's hoard",
+    "2 GOLD COINS for their trouble",
+    "a BAG OF HOLDING which hums quietly",
+    "an ORB. It glows.",
+    "an ORB. I think it glows.",
+    "5 TORCHES,3 RATIONS,and 1 TENT",
+    "the   KEY   to the city",
+    "MR. SNUGGLES",
+    "10 FT. POLE and 50 FT. OF ROPE",
+    "nothing at all",
+    "",
+    "4 OXEN pulling 2 CARTS",
+    "a VIAL OF ACID. careful",
+    "1 DOZEN EGGS\n",
+    "the CROWN while the king sleeps",
+    "7  THROWING  KNIVES , 2 SMOKE BOMBS",
+    "9 LIVES",
+    "A B C D",
+    "100 GP, 20 SP and 5 CP because they sold the cart",
+    "a MAP OF THE UNDERDARK. You study it",
+    "the E.X.P. SHARE. then leaves",
+    "12a SWORDS",
+    "3 SWORDS4 SHIELDS",
+    "a POTION. A GREAT ONE.",
+    "ÉPÉE and 2 NAÏVE SWORDS",
+    "a RING forged in fire",
+    "2 BOOTS OF SPEED, and an ORB",
+]
+
+ITEM_FILES = ['single_word.csv', 'two_to_three_words.csv', 'complex_phrases.csv', 'special_edge_cases.csv']
+FILLER = ['a', 'an', 'the', 'some', 'their', 'mysterious']
+SEPARATORS = [', ', ',', ', and ', ' and ', ',  and  ', ' , ', '. ', ' ']
+ENDINGS = ['', '.', '!', '. you feel richer', '. It hums.', '. I think', ' from the chest', ' for now', ' because why not', '\n']
+
+
+def legacy_parse_items(text):
+    return [(int(match.group(1) or 1), match.group(2).strip()) for match in LEGACY_ITEM_PATTERN.finditer(text)]
+
+
+def load_item_names():
+    names = set()
+    for path in ITEM_FILES:
+        for _, phrase, output in read_rows(path):
+            names.add(phrase.upper())
+            names.add(output.upper())
+    return sorted(name for name in names if len(name) <= 60)  # special_edge_cases.csv has a malformed row or two
+
+
+def random_message(rng, names):
+    parts = []
+    for index in range(rng.randint(1, 5)):
+        if index:
+            parts.append(rng.choice(SEPARATORS))
+        roll = rng.random()
+        if roll < 0.4:
+            parts.append(f"{rng.randint(1, 200)}{rng.choice([' ', '  ', chr(9)])}")
+        elif roll < 0.7:
+            parts.append(f"{rng.choice(FILLER)} ")
+        name = rng.choice(names)
+        if rng.random() < 0.1:
+            name = '.'.join(name.replace(' ', '')[:4]) + '. ' + name  # S.T.A.R.S. style abbreviation
+        if rng.random() < 0.1:
+            name = name.lower() if rng.random() < 0.5 else name.title()
+        parts.append(name)
+    parts.append(rng.choice(ENDINGS))
+    return ''.join(parts)
+
+
+def adversarial_messages(length):
+    # shapes that make the regex retry its lookahead from every start position
+    return {
+        'all caps, no terminal': 'A' * (length - 1) + '1',
+        'caps words, no terminal': ('SPAM ' * length)[:length - 1] + '!',
+        'periods, no terminal': ('A. ' * length)[:length - 1] + '1',
+        'digit run': '1' * (length - 1) + ' ',
+        'many items': ('1 A, ' * length)[:length],
+        'caps narration': ('THE DRAGON ROARS AND BREATHES FIRE. ' * length)[:length],
+    }
+
+
+def time_call(fn, text, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(text)
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Regression and timing of item_parser.parse_items against the old regex.")
+    parser.add_argument('--random', type=int, default=10000, help="random messages on top of the hand written corpus")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lengths', default='500,1000,2000,4000', help="adversarial message lengths")
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = load_item_names()
+    messages = CORPUS + [random_message(rng, names) for _ in range(args.random)]
+    mismatches = 0
+    for message in messages:
+        expected, got = legacy_parse_items(message), parse_items(message)
+        if expected != got:
+            mismatches += 1
+            if mismatches <= 20:
+                print(f"MISMATCH {message[:200]!r}\n    regex  {expected}\n    parser {got}")
+    print(f"{len(messages) - mismatches}/{len(messages)} messages parse the same as the regex")
+
+    legacy_time = sum(time_call(legacy_parse_items, message, 1) for message in messages)
+    parser_time = sum(time_call(parse_items, message, 1) for message in messages)
+    print(f"corpus: regex {legacy_time / len(messages) * 1e6:.1f}us/message, parser {parser_time / len(messages) * 1e6:.1f}us/message")
+
+    print(f"\n{'adversarial message':<26} {'length':>7} {'regex ms':>10} {'parser ms':>10} {'same':>5}")
+    for length in [int(value) for value in args.lengths.split(',')]:
+        for name, message in adversarial_messages(length).items():
+            same = legacy_parse_items(message) == parse_items(message)
+            mismatches += not same
+            print(
+                f"{name:<26} {length:>7} {time_call(legacy_parse_items, message, args.repeat) * 1000:>10.2f} "
+                f"{time_call(parse_items, message, args.repeat) * 1000:>10.2f} {'yes' if same else 'NO':>5}"
+            )
+
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import csv
+import sys
+import time
+from collections import defaultdict
+
+import morphology
+from inflection_cache import normalize_phrase
+
+
+# How much traffic the rule based fast path takes off the model, and how often it agrees with the model.
+# For every row of the training csvs it reports coverage (share of phrases the rules answer at all, i.e. never touch torch),
+# agreement with the csv's expected output on the covered rows, how many covered rows disagree (those skip the model and
+# become inventory keys, so this is the number to watch, not coverage), and the time per call.
+# With --model the covered rows also go through T5, for agreement with what the bot would have answered before.
+# Exits 1 if agreement on the covered rows (with the model when --model, the csv otherwise) is under --min-agreement.
+# Run with: python bench_morphology.py            (rules only, no torch needed)
+#           python bench_morphology.py --model    (also compare against the fine tuned model)
+
+DATASETS = [
+    'single_word.csv',
+    'single_word_irregular.csv',
+    'two_to_three_words.csv',
+    'complex_phrases.csv',
+    'special_edge_cases.csv',
+]
+MODEL_BATCH_SIZE = 32
+
+
+def read_rows(path):
+    rows = []
+    with open(path, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            directive = (row.get('directive') or '').strip()
+            if directive not in ('pluralize', 'singularize') or not row.get('input_text') or not row.get('output_text'):
+                continue
+            rows.append((directive, normalize_phrase(row['input_text']), normalize_phrase(row['output_text'])))
+    return rows
+
+
+def model_outputs(jobs):
+    import inflection_model  # only with --model, so the plain benchmark runs without torch installed
+    outputs = []
+    for start in range(0, len(jobs), MODEL_BATCH_SIZE):
+        outputs.extend(normalize_phrase(text) for text in inflection_model.generate_batch(jobs[start:start + MODEL_BATCH_SIZE]))
+    return outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coverage and agreement of the rule based inflection fast path.")
+    parser.add_argument('--model', action='store_true', help="also run the covered rows through the model and compare")
+    parser.add_argument('--show-mismatches', type=int, default=0, help="print this many disagreements per dataset")
+    parser.add_argument('--min-agreement', type=float, default=0.98, help="lowest acceptable agreement on covered rows")
+    args = parser.parse_args()
+
+    morphology.lexicon()  # load it outside the timings
+    print(f"{'dataset':<28} {'rows':>6} {'covered':>8} {'agree csv':>10} {'wrong':>6} {'agree model':>12} {'us/call':>8}")
+    totals = defaultdict(int)
+    for path in DATASETS:
+        rows = read_rows(path)
+        start = time.perf_counter()
+        answers = [morphology.inflect(directive, phrase) for directive, phrase, _ in rows]
+        elapsed = time.perf_counter() - start
+
+        covered = [(row, answer) for row, answer in zip(rows, answers) if answer is not None]
+        agree_csv = sum(1 for (_, _, expected), answer in covered if answer == expected)
+        model_agreement = '-'
+        if args.model and covered:
+            generated = model_outputs([(directive, phrase) for (directive, phrase, _), _ in covered])
+            agree_model = sum(1 for (_, answer), output in zip(covered, generated) if answer == output)
+            totals['agree_model'] += agree_model
+            model_agreement = f"{agree_model / len(covered):.1%}"
+
+        totals['rows'] += len(rows)
+        totals['covered'] += len(covered)
+        totals['agree_csv'] += agree_csv
+        totals['time'] += elapsed
+        print(
+            f"{path:<28} {len(rows):>6} {len(covered) / max(len(rows), 1):>8.1%} {agree_csv / max(len(covered), 1):>10.1%} "
+            f"{len(covered) - agree_csv:>6} {model_agreement:>12} {elapsed / max(len(rows), 1) * 1e6:>8.1f}"
+        )
+        shown = 0
+        for (directive, phrase, expected), answer in covered:
+            if shown >= args.show_mismatches:
+                break
+            if answer != expected:
+                print(f"    {directive} {phrase!r}: rules {answer!r}, csv {expected!r}")
+                shown += 1
+
+    agreement = totals['agree_model' if args.model else 'agree_csv'] / max(totals['covered'], 1)
+    model_total = f"{agreement:.1%}" if args.model else '-'
+    print(
+        f"{'total':<28} {totals['rows']:>6} {totals['covered'] / totals['rows']:>8.1%} "
+        f"{totals['agree_csv'] / max(totals['covered'], 1):>10.1%} {totals['covered'] - totals['agree_csv']:>6} "
+        f"{model_total:>12} {totals['time'] / totals['rows'] * 1e6:>8.1f}"
+    )
+    if agreement < args.min_agreement:
+        print(f"Agreement {agreement:.1%} is under {args.min_agreement:.1%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
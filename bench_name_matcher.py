@@ -0,0 +1,81 @@
+import random
+import re
+import string
+import time
+
+from name_matcher import NameMatcher
+
+
+# Microbenchmark for the DM GAINS/LOSES name detection.
+# Compares what on_message used to do per message (build and compile the big name alternation regex three times)
+# against one pass of the prebuilt NameMatcher, for 10 to 10,000 registered display names.
+# Run with: python bench_name_matcher.py
+
+NAME_COUNTS = [10, 100, 1000, 10000]
+MESSAGES_PER_RUN = 200
+OLD_WAY_MESSAGES = 20  # the old way takes ~0.5s a message at 10k names, a sample is plenty
+
+
+def random_name(rng):
+    words = rng.randint(1, 2)
+    return " ".join("".join(rng.choice(string.ascii_uppercase) for _ in range(rng.randint(3, 9))) for _ in range(words))
+
+
+def make_messages(rng, names):
+    messages = []
+    for _ in range(MESSAGES_PER_RUN):
+        kind = rng.random()
+        if kind < 0.4:
+            messages.append(f"{rng.choice(names)} GAINS 3 ROPE, 2 TORCHES and a LANTERN from the chest.")
+        elif kind < 0.6:
+            messages.append(f"After the fight {rng.choice(names)} LOSES a SHIELD but keeps the SWORD.")
+        else:
+            # regular chatter, most messages in a channel aren't DM commands
+            messages.append("ok so what does everybody want to do about the dragon, we could go around it I guess")
+    return messages
+
+
+def old_way(message, display_names):
+    # what on_message and parse_natural_language used to do for every message
+    gains = re.search(r"\b(" + "|".join(re.escape(name) for name in display_names.keys()) + r")\sGAINS|gains", message)
+    loses = re.search(r"\b(" + "|".join(re.escape(name) for name in display_names.keys()) + r")\sLOSES|loses", message)
+    if gains is None and loses is None:
+        return None
+    display_pattern = r"\b(" + "|".join(re.escape(name) for name in display_names) + r")\s+(?:gains|GAINS|loses|LOSES)"
+    return re.search(display_pattern, message)
+
+
+def time_per_message(fn, messages):
+    start = time.perf_counter()
+    for message in messages:
+        fn(message)
+    return (time.perf_counter() - start) / len(messages)
+
+
+def main():
+    rng = random.Random(0)
+    print(f"{'names':>7} {'build ms':>10} {'old us/msg':>12} {'matcher us/msg':>15} {'speedup':>8}")
+    for count in NAME_COUNTS:
+        display_names = {}
+        while len(display_names) < count:
+            display_names[random_name(rng)] = str(len(display_names))
+        names = list(display_names)
+        messages = make_messages(rng, names)
+
+        start = time.perf_counter()
+        matcher = NameMatcher(display_names)
+        build_time = time.perf_counter() - start
+
+        # re has its own compile cache, purge it so the old way pays what it paid in the bot once the names outgrow it
+        re.purge()
+        old_time = time_per_message(lambda message: (re.purge(), old_way(message, display_names)), messages[:OLD_WAY_MESSAGES])
+        new_time = time_per_message(matcher.search, messages)
+
+        print(
+            f"{count:>7} {build_time * 1000:>10.2f} {old_time * 1e6:>12.1f} {new_time * 1e6:>15.1f} "
+            f"{old_time / new_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
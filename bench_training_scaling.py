@@ -0,0 +1,81 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from executor_pools import cpu_count
+
+
+# Training throughput of bot_training.py at different numbers of data parallel processes (torchrun + gloo, CPU only).
+# Each run trains for --steps steps with nothing saved and reports examples/s over all processes, so the speedup column is
+# how well adding processes pays off on this machine. Every process trains TRAIN_BATCH_SIZE examples per step,
+# so more processes also means a bigger global batch.
+# Run with: python bench_training_scaling.py --workers 1,2,4,8 --steps 60
+
+
+def run(workers, args, metrics_path):
+    command = [
+        sys.executable, '-m', 'torch.distributed.run', '--standalone', f'--nproc_per_node={workers}', 'bot_training.py',
+    ]
+    env = {
+        **os.environ,
+        'TRAIN_MAX_STEPS': str(args.steps),
+        'TRAIN_SAVE': '0',
+        'TRAIN_METRICS_PATH': metrics_path,
+        'TRAIN_BATCH_SIZE': str(args.batch_size),
+    }
+    with open(os.devnull, 'w') as devnull:
+        completed = subprocess.run(command, env=env, stdout=None if args.verbose else devnull)
+    if completed.returncode != 0:
+        print(f"{workers} workers: failed with exit code {completed.returncode}")
+        return None
+    with open(metrics_path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="examples/s of bot_training.py at 1, 2, 4, 8... CPU training processes.")
+    parser.add_argument('--workers', default='1,2,4,8')
+    parser.add_argument('--steps', type=int, default=60)
+    parser.add_argument('--batch-size', type=int, default=8, help="per process")
+    parser.add_argument('--json', help="also write the results here")
+    parser.add_argument('--verbose', action='store_true', help="show the training output")
+    args = parser.parse_args()
+
+    print(f"{cpu_count()} cores available")
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for workers in [int(count) for count in args.workers.split(',')]:
+            if workers > cpu_count():
+                print(f"{workers} workers: skipped, only {cpu_count()} cores")
+                continue
+            metrics = run(workers, args, os.path.join(work_dir, f'metrics_{workers}.json'))
+            if metrics is not None:
+                results.append({
+                    'workers': workers,
+                    'threads_per_worker': metrics['threads_per_process'],
+                    'examples_per_s': metrics['train_samples_per_second'],
+                    'steps_per_s': metrics['train_steps_per_second'],
+                    'runtime_s': metrics['train_runtime'],
+                })
+
+    if not results:
+        return
+    baseline = results[0]['examples_per_s'] / results[0]['workers']
+    print(f"\n{'workers':>8} {'threads':>8} {'examples/s':>11} {'steps/s':>8} {'speedup':>8} {'efficiency':>11}")
+    for result in results:
+        result['speedup'] = result['examples_per_s'] / baseline
+        print(
+            f"{result['workers']:>8} {result['threads_per_worker']:>8} {result['examples_per_s']:>11.1f} "
+            f"{result['steps_per_s']:>8.2f} {result['speedup']:>7.2f}x {result['speedup'] / result['workers']:>11.0%}"
+        )
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'cores': cpu_count(), 'steps': args.steps, 'batch_size': args.batch_size, 'runs': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
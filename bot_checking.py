@@ -1,8 +1,20 @@
-from transformers import T5ForConditionalGeneration, T5Tokenizer
+import os
 
-# Load the fine-tuned model and tokenizer
-model = T5ForConditionalGeneration.from_pretrained('./fine_tuned_t5_complex')
-tokenizer = T5Tokenizer.from_pretrained('./fine_tuned_t5_complex')
+import inflection_model
+
+# Load the fine-tuned model and tokenizer. INFLECTION_BACKEND=onnx checks the quantized export instead, same as the bot.
+# With INFLECTION_SERVER set it asks the running inference_server.py instead of loading another copy
+if os.getenv('INFLECTION_SERVER'):
+    from inference_server import generate_remote
+
+    def generate_batch(jobs):
+        return generate_remote(os.getenv('INFLECTION_SERVER'), jobs)
+
+    print(f"Server: {os.getenv('INFLECTION_SERVER')}")
+else:
+    inflection_model.load_model()
+    generate_batch = inflection_model.generate_batch
+    print(f"Backend: {inflection_model.backend()}")
 
 
 
@@ -12,10 +24,7 @@ test_cases = [
 
 
 for input_text, directive in test_cases:
-    input_string = f"{directive}: {input_text}"
-    inputs = tokenizer(input_string, return_tensors="pt", padding=True, truncation=True, max_length=64)
-    outputs = model.generate(inputs['input_ids'])
-    generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
+    generated_text = generate_batch([(directive, input_text)])[0]
     print(f"Input: {input_text}")
     print(f"Directive: {directive}")
     print(f"Generated Output: {generated_text}\n")
@@ -0,0 +1,193 @@
+import atexit
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+
+# Logging for the bot. Lines go onto a queue and a QueueListener thread writes them to discord.log (and the console),
+# so a slow disk never holds up the event loop. discord.py's own logs take the same route.
+#   log = get_logger(__name__)
+#   log.info("Added %s %s", quantity, name, user_id=user_id)      keyword arguments become key=value fields on the line
+#   log.debug("Inventory now %s", lazy(lambda: inventory.items))  a lazy value is only worked out if the line gets written
+# Formatting happens when a line is written, never when its level is off, so debug lines cost next to nothing normally.
+#
+# LOG_LEVEL sets the bot's level (INFO by default, discord.py stays at INFO). Debug lines are also written for traced
+# messages, whatever the level, to look into something in production without turning debug on for everyone:
+#   LOG_TRACE_USERS / LOG_TRACE_CHANNELS   comma separated ids whose messages are always traced
+#   LOG_TRACE_SAMPLE                       fraction of every other message to trace, e.g. 0.01
+# Every line logged while a message is being handled carries its user, channel and command (see message_context).
+
+LOG_FORMAT = '[{asctime}] [{levelname:<8}] {name}: {message}'  # same as discord.py's
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_context = contextvars.ContextVar('log_context', default=None)  # (fields, traced) of the message being handled
+
+
+class Lazy:
+    """A log argument that only gets computed if the line is actually written."""
+
+    __slots__ = ('fn', 'args')
+
+    def __init__(self, fn, *args):
+        self.fn = fn
+        self.args = args
+
+    def __str__(self):
+        return str(self.fn(*self.args))
+
+    def __repr__(self):
+        return repr(self.fn(*self.args))
+
+
+def lazy(fn, *args):
+    return Lazy(fn, *args)
+
+
+def _ids(text):
+    return {value.strip() for value in (text or '').split(',') if value.strip()}
+
+
+class TraceSampler:
+    """
+    Decides which messages get debug tracing.
+
+    Args:
+        users, channels: ids (as strings) whose messages are always traced
+        sample_rate: fraction of the remaining messages to trace
+    """
+
+    def __init__(self, users=(), channels=(), sample_rate=0.0, rng=None):
+        self.users = set(users)
+        self.channels = set(channels)
+        self.sample_rate = sample_rate
+        self._random = (rng or random.Random()).random
+
+    @classmethod
+    def from_env(cls):
+        return cls(_ids(os.getenv('LOG_TRACE_USERS')), _ids(os.getenv('LOG_TRACE_CHANNELS')), float(os.getenv('LOG_TRACE_SAMPLE', '0')))
+
+    def should_trace(self, user_id, channel_id):
+        if str(user_id) in self.users or str(channel_id) in self.channels:
+            return True
+        return self.sample_rate > 0 and self._random() < self.sample_rate
+
+
+trace_sampler = TraceSampler.from_env()
+
+
+@contextlib.contextmanager
+def message_context(user_id, channel_id, **fields):
+    """Everything logged inside gets these fields, plus debug lines if trace_sampler picks this message."""
+    traced = trace_sampler.should_trace(user_id, channel_id)
+    token = _context.set(({'user_id': user_id, 'channel_id': channel_id, **fields}, traced))
+    try:
+        yield traced
+    finally:
+        _context.reset(token)
+
+
+def add_context(**fields):
+    """Adds fields to the current message's context, e.g. the command once it's known."""
+    context = _context.get()
+    if context is not None:
+        context[0].update(fields)
+
+
+class BotLogger:
+    """A logging.Logger with key=value fields, the message context and traced debug lines. Same call signatures otherwise."""
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def debug(self, msg, *args, **fields):
+        self._log(logging.DEBUG, msg, args, fields)
+
+    def info(self, msg, *args, **fields):
+        self._log(logging.INFO, msg, args, fields)
+
+    def warning(self, msg, *args, **fields):
+        self._log(logging.WARNING, msg, args, fields)
+
+    def error(self, msg, *args, **fields):
+        self._log(logging.ERROR, msg, args, fields)
+
+    def exception(self, msg, *args, **fields):
+        self._log(logging.ERROR, msg, args, fields, exc_info=sys.exc_info())
+
+    def debug_enabled(self):
+        """For debug lines whose arguments are expensive even to set up."""
+        return self.logger.isEnabledFor(logging.DEBUG) or self._traced()
+
+    def _traced(self):
+        context = _context.get()
+        return context is not None and context[1]
+
+    def _log(self, level, msg, args, fields, exc_info=None):
+        if not self.logger.isEnabledFor(level) and not (level == logging.DEBUG and self._traced()):
+            return
+        context = _context.get()
+        if context is not None:
+            fields = {**context[0], **fields}
+        fields = {key: str(value) for key, value in fields.items() if value is not None}
+        filename, line, function, _ = self.logger.findCaller(False, stacklevel=3)  # whoever called debug/info/...
+        record = self.logger.makeRecord(
+            self.logger.name, level, filename, line, msg, args, exc_info, function, extra={'fields': fields}
+        )
+        # handle() rather than log(), the level check is already done above and has to let traced debug lines through
+        self.logger.handle(record)
+
+
+def get_logger(name):
+    """Logger under 'bot', so LOG_LEVEL covers every module of the bot."""
+    return BotLogger(logging.getLogger(name if name == 'bot' or name.startswith('bot.') else f'bot.{name}'))
+
+
+class FieldsFormatter(logging.Formatter):
+    """
+    The message followed by the record's fields as key=value, quoted when they have spaces in them.
+    Runs in the QueueHandler, so lazy arguments are worked out in the thread that logged them, and the fields end up
+    before any traceback.
+    """
+
+    def __init__(self):
+        super().__init__('{message}', style='{')
+
+    def formatMessage(self, record):
+        line = super().formatMessage(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f"{key}={json.dumps(value) if ' ' in value or not value else value}" for key, value in fields.items())
+        return line
+
+
+def setup_logging(path='discord.log', level=None, console=True):
+    """
+    Sends the bot's and discord.py's logs through a queue to path (truncated, like discord.py does) and the console.
+    Returns the started QueueListener, which is also stopped at exit so the last lines get written.
+    """
+    handlers = []
+    if path:
+        handlers.append(logging.FileHandler(filename=path, encoding='utf-8', mode='w'))
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT, DATE_FORMAT, style='{'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.setFormatter(FieldsFormatter())
+    root = logging.getLogger()
+    root.addHandler(queue_handler)
+    root.setLevel(logging.INFO)
+    logging.getLogger('bot').setLevel(level or os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
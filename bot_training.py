@@ -1,27 +1,68 @@
-from transformers import T5ForConditionalGeneration, T5Tokenizer, Trainer, TrainingArguments
-from datasets import load_dataset,Dataset, DatasetDict
+import hashlib
+import json
+import os
+
+from transformers import T5ForConditionalGeneration, T5Tokenizer, Seq2SeqTrainer, Seq2SeqTrainingArguments, DataCollatorForSeq2Seq, EarlyStoppingCallback
+from datasets import load_dataset,Dataset, DatasetDict, load_from_disk
 import pandas as pd
 import sentencepiece
-import evaluate
 from sklearn.model_selection import train_test_split
+from torch.utils.data import SequentialSampler
+
+from data_manip import WORD_COUNT_SPLITS
+from executor_pools import pin_worker_cores
+
+
+# Data parallel training on CPU: launch with torchrun and every process trains on its own shard of each epoch, gradients
+# get averaged over gloo after every backward pass (Trainer wraps the model in DistributedDataParallel when it sees torchrun's env).
+#   torchrun --standalone --nproc_per_node=4 bot_training.py
+# Plain `python bot_training.py` still trains in one process like before.
+# Each process gets its own slice of the cores, checkpoints and logs only come from rank 0.
+# per_device_train_batch_size is per process, so 4 processes train on batches of 4 x TRAIN_BATCH_SIZE.
+RANK = int(os.getenv('RANK', '0'))
+LOCAL_RANK = int(os.getenv('LOCAL_RANK', '0'))
+WORLD_SIZE = int(os.getenv('WORLD_SIZE', '1'))
+LOCAL_WORLD_SIZE = int(os.getenv('LOCAL_WORLD_SIZE', str(WORLD_SIZE)))
+IS_MAIN_PROCESS = RANK == 0
+
+TRAIN_BATCH_SIZE = int(os.getenv('TRAIN_BATCH_SIZE', '8'))  # Can be much higher with shorter sequences
+TRAIN_MAX_STEPS = int(os.getenv('TRAIN_MAX_STEPS', '-1'))  # -1 trains for num_train_epochs, bench_training_scaling.py caps it
+TRAIN_SAVE = os.getenv('TRAIN_SAVE', '1') == '1'  # 0 skips checkpoints and the final save, for benchmarks
+TRAIN_METRICS_PATH = os.getenv('TRAIN_METRICS_PATH')  # rank 0 writes trainer.train()'s metrics here as json
+TRAIN_OUTPUT_MODEL = os.getenv('TRAIN_OUTPUT_MODEL', './fine_tuned_t5_complex_test')
+
+# before the model loads, so torch sizes its thread pool for this process' cores only
+threads = pin_worker_cores(LOCAL_RANK, LOCAL_WORLD_SIZE)
+
+
+def log(text):
+    # the same line from every worker is just noise
+    if IS_MAIN_PROCESS:
+        print(text)
 
 
-print(sentencepiece.__version__)
+log(sentencepiece.__version__)
+log(f"{WORLD_SIZE} training process(es), {threads} threads each")
 
 
 
 # Load pre-trained T5-small model and tokenizer
 model = T5ForConditionalGeneration.from_pretrained('fine_tuned_t5_complex')
 tokenizer = T5Tokenizer.from_pretrained('fine_tuned_t5_complex')
-# Step 1: Load CSV into a pandas DataFrame and drop unnecessary column
-df = pd.read_csv('special_edge_cases.csv')    
-df = df.drop(columns=['__index_level_0__'], errors='ignore')
-# df is type: pandas.DataFrame
-    
-metric = evaluate.load("accuracy")
 
+TRAINING_CSV = 'special_edge_cases.csv'
+MAX_LENGTH = 64
+SPLIT_SEED = 42  # fixed so the cached train/eval split is the same split every run
+# Tokenized datasets get saved here, one folder per tokenizer + csv + settings, so reruns skip the csv and tokenizing entirely
+TOKENIZED_CACHE_DIR = os.getenv('TOKENIZED_CACHE_DIR', 'tokenized_cache')
+TOKENIZED_CACHE_VERSION = 2  # bump when tokenize_function changes
 
-print(f"DataFrame columns before processing: {df.columns}")
+# Evaluation generates greedily on a fixed subset of the eval split, EVAL_PER_CATEGORY examples from each
+# (directive, word count split) category, and scores exact matches. The subset is what keeps eval_steps cheap:
+# 6 categories x 32 takes a few seconds on CPU however big the eval split is.
+EVAL_STEPS = int(os.getenv('EVAL_STEPS', '100'))
+EVAL_PER_CATEGORY = int(os.getenv('EVAL_PER_CATEGORY', '32'))
+EVAL_PATIENCE = int(os.getenv('EVAL_PATIENCE', '5'))  # evaluations without a better exact match before training stops
 
 
 def prepare_datasets(df):
@@ -36,20 +77,13 @@ def prepare_datasets(df):
     # Remove any empty strings
     df = df[df['output_text'].str.len() > 0]
     
-    train_df, eval_df = train_test_split(df, test_size=0.1)
+    train_df, eval_df = train_test_split(df, test_size=0.1, random_state=SPLIT_SEED)
     
     return DatasetDict({
         'train': Dataset.from_pandas(train_df),
         'eval': Dataset.from_pandas(eval_df)
     })
-# datasets becomes type: datasets.DatasetDict
-datasets = prepare_datasets(df)
-# Usage would look like:
 
-# Access the train dataset from your DatasetDict
-# train_dataset becomes type: datasets.Dataset
-train_dataset = datasets['train']
-eval_dataset = datasets['eval']
 
 # Tokenization function
 def tokenize_function(examples):
@@ -58,63 +92,188 @@ def tokenize_function(examples):
     
     inputs = [f"{d}: {i}" for d, i in zip(examples['directive'], examples['input_text'])]
     
-    model_inputs = tokenizer(inputs, padding="max_length", truncation=True, max_length=64)
-    labels = tokenizer(examples['output_text'], padding="max_length", truncation=True, max_length=64)
+    # No padding here. Most phrases are a handful of tokens, padding everything to 64 meant nearly every step was spent on pad tokens.
+    # The collator pads each batch to its own longest example instead, and pads the labels with -100 so the loss ignores them
+    model_inputs = tokenizer(inputs, truncation=True, max_length=MAX_LENGTH)
+    labels = tokenizer(examples['output_text'], truncation=True, max_length=MAX_LENGTH)
     
     model_inputs['labels'] = labels['input_ids']
+    model_inputs['length'] = [len(ids) for ids in model_inputs['input_ids']]  # for group_by_length, saves the sampler measuring every example
+    model_inputs['category'] = [f"{d}/{word_count_split(i)}" for d, i in zip(examples['directive'], examples['input_text'])]
     return model_inputs
 
-# This line transforms the Dataset
-# Apply tokenization to the datasets
-train_dataset = datasets['train'].map(tokenize_function, batched=True, remove_columns=['directive', 'input_text', 'output_text', '__index_level_0__'])
-eval_dataset = datasets['eval'].map(tokenize_function, batched=True, remove_columns=['directive', 'input_text', 'output_text', '__index_level_0__'])
-# train_dataset is still type: datasets.Dataset but now contains tokenized data
 
-# Debugging: Print the dataset columns after tokenization
-print(f"Train dataset columns after tokenization: {train_dataset.column_names}")
-print(f"Eval dataset columns after tokenization: {eval_dataset.column_names}")
+def word_count_split(text):
+    # same buckets data_manip.py splits the csvs into
+    words = len(text.split())
+    for name, smallest, largest in WORD_COUNT_SPLITS:
+        if words >= smallest and (largest is None or words <= largest):
+            return os.path.splitext(name)[0]
+    return os.path.splitext(WORD_COUNT_SPLITS[0][0])[0]  # empty input, counts as a single word
+
+
+def stratified_eval_subset(dataset, per_category):
+    """
+    Up to per_category examples of every category, the same ones every evaluation. Sorted by length so the generate()
+    batches pad as little as possible (EvalInOrderTrainer keeps that order).
+    """
+    picked = {}
+    shuffled = dataset.shuffle(seed=SPLIT_SEED)
+    for index, category in enumerate(shuffled['category']):
+        picked.setdefault(category, [])
+        if len(picked[category]) < per_category:
+            picked[category].append(index)
+    lengths = shuffled['length']
+    subset = shuffled.select(sorted((i for indices in picked.values() for i in indices), key=lambda i: lengths[i]))
+    log("Eval subset: " + ", ".join(f"{category} {len(indices)}" for category, indices in sorted(picked.items())))
+    return subset
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def tokenizer_hash(tokenizer):
+    # the sentencepiece model decides the token ids, the rest covers special tokens and the class
+    digest = hashlib.sha256(f"{type(tokenizer).__name__}|{len(tokenizer)}|{tokenizer.all_special_tokens}".encode())
+    if getattr(tokenizer, 'vocab_file', None) and os.path.exists(tokenizer.vocab_file):
+        digest.update(file_hash(tokenizer.vocab_file).encode())
+    return digest.hexdigest()
+
+
+def load_tokenized_datasets(csv_path, tokenizer):
+    """
+    Tokenized train/eval datasets for csv_path. Cached on disk keyed by the tokenizer, the csv's contents and the
+    tokenization settings, so a rerun on the same data loads in a second and any change to them makes a fresh cache.
+    """
+    key = hashlib.sha256(
+        f"{tokenizer_hash(tokenizer)}|{file_hash(csv_path)}|{MAX_LENGTH}|{SPLIT_SEED}|{TOKENIZED_CACHE_VERSION}".encode()
+    ).hexdigest()[:16]
+    cache_path = os.path.join(TOKENIZED_CACHE_DIR, f"{os.path.splitext(os.path.basename(csv_path))[0]}-{key}")
+    if os.path.exists(cache_path):
+        log(f"Loading tokenized datasets from {cache_path}")
+        return load_from_disk(cache_path)
+
+    # Step 1: Load CSV into a pandas DataFrame and drop unnecessary column
+    df = pd.read_csv(csv_path)
+    df = df.drop(columns=['__index_level_0__'], errors='ignore')
+    log(f"DataFrame columns before processing: {df.columns}")
+
+    # datasets becomes type: datasets.DatasetDict
+    datasets = prepare_datasets(df)
+    # This line transforms the Dataset
+    tokenized = datasets.map(tokenize_function, batched=True, remove_columns=datasets['train'].column_names)
+    tokenized.save_to_disk(cache_path)
+    log(f"Tokenized datasets saved to {cache_path}")
+    return tokenized
+
+
+# Pads input_ids/attention_mask with the pad token and labels with -100, per batch. With the model passed in it also builds
+# decoder_input_ids from the labels, same as T5 would itself
+data_collator = DataCollatorForSeq2Seq(tokenizer, model=model, label_pad_token_id=-100)
 
 
 def compute_metrics(pred):
+    # predictions are generated ids (predict_with_generate), padded with -100 where batches got stitched together
     predictions, references = pred.predictions, pred.label_ids
+    predictions = [[token if token != -100 else tokenizer.pad_token_id for token in row] for row in predictions]
+    references = [[token if token != -100 else tokenizer.pad_token_id for token in ref] for ref in references]  # -100 can't be decoded
     decoded_preds = tokenizer.batch_decode(predictions, skip_special_tokens=True)
     decoded_refs = tokenizer.batch_decode(references, skip_special_tokens=True)
-    results = metric.compute(predictions=decoded_preds, references=decoded_refs)
-    print(f"Evaluation Results: {results}")
+
+    totals = {}
+    # predictions come back in eval_dataset's order, see EvalInOrderTrainer
+    for category, predicted, expected in zip(eval_dataset['category'], decoded_preds, decoded_refs):
+        counts = totals.setdefault(category, [0, 0])
+        counts[0] += predicted.strip().lower() == expected.strip().lower()
+        counts[1] += 1
+    results = {'exact_match': sum(c[0] for c in totals.values()) / max(sum(c[1] for c in totals.values()), 1)}
+    for category, (correct, count) in sorted(totals.items()):
+        results[f"exact_match_{category.replace('/', '_')}"] = correct / count
+    log(f"Evaluation Results: {results}")
 
     return results
 
 # Set up the training arguments
-training_args = TrainingArguments(
+training_args = Seq2SeqTrainingArguments(
     output_dir='./results',
     learning_rate = 1e-5, 
-    per_device_train_batch_size=8,  # Can be much higher with shorter sequences
+    per_device_train_batch_size=TRAIN_BATCH_SIZE,
+    max_steps=TRAIN_MAX_STEPS,
     num_train_epochs=2,  # Might converge faster
     warmup_steps=10,
     lr_scheduler_type='cosine',
     gradient_accumulation_steps=1,
-    eval_steps=100,  # More frequent evaluation
-    remove_unused_columns=False,  # Add this line
+    eval_strategy='steps',
+    eval_steps=EVAL_STEPS,  # More frequent evaluation
+    per_device_eval_batch_size=64,
+    predict_with_generate=True,  # score what the model actually says, not the logits
+    generation_max_length=MAX_LENGTH,
+    generation_num_beams=1,  # greedy, same as the bot
+    metric_for_best_model='exact_match',
+    greater_is_better=True,
+    load_best_model_at_end=TRAIN_SAVE,  # needs the checkpoints, so only when saving
+    group_by_length=True,  # batches of similar lengths, so dynamic padding has little left to pad
+    length_column_name='length',
+    remove_unused_columns=True,  # drops 'length' before batches reach the model, the sampler still reads it from the dataset
     logging_dir='./logs',  # Save logs here
     logging_steps=50,      # Log every 50 steps
-    save_steps=100,  
-    save_strategy='steps',  # Save after every 'save_steps' steps
+    save_steps=EVAL_STEPS,  # has to line up with eval_steps for the best checkpoint to be kept
+    save_total_limit=2,  # the best one and the latest one
+    save_strategy='steps' if TRAIN_SAVE else 'no',  # Save after every 'save_steps' steps
+    use_cpu=True,
+    ddp_backend='gloo',  # only used under torchrun. gloo is the CPU backend, nccl needs GPUs
+    ddp_find_unused_parameters=False,  # every T5 parameter gets a gradient, skips a graph walk each step
+    # no dataloader_drop_last: accelerate's even_batches already keeps every worker on the same number of training steps,
+    # and drop_last would apply to evaluation too, dropping the last eval rows (or all of them on a small eval set)
 
 )
 
+# rank 0 tokenizes (or loads the cache) first, the others wait and then load what it saved
+with training_args.main_process_first(local=False, desc="tokenizing"):
+    datasets = load_tokenized_datasets(TRAINING_CSV, tokenizer)
+train_dataset = datasets['train']
+eval_dataset = stratified_eval_subset(datasets['eval'], EVAL_PER_CATEGORY)
+
+# Debugging: Print the dataset columns after tokenization
+log(f"Train dataset columns after tokenization: {train_dataset.column_names}")
+log(f"Eval dataset columns after tokenization: {eval_dataset.column_names}")
+
+class EvalInOrderTrainer(Seq2SeqTrainer):
+    # group_by_length gives evaluation a LengthGroupedSampler too, which shuffles the eval set, and compute_metrics needs
+    # predictions in dataset order to know each one's category. Under torchrun None lets accelerate shard it in order,
+    # gather_for_metrics puts it back together the same way
+    def _get_eval_sampler(self, eval_dataset):
+        return SequentialSampler(eval_dataset) if self.args.world_size <= 1 else None
+
+
 # Initialize the Trainer., Trainer will both train and evaluate
-trainer = Trainer(
+trainer = EvalInOrderTrainer(
     model=model,
     args=training_args,
     train_dataset=train_dataset,  # Pass the tokenized train dataset
     eval_dataset=eval_dataset,    # Pass the tokenized eval dataset
+    data_collator=data_collator,
     compute_metrics=compute_metrics,  # Make sure this line is included
+    # early stopping goes by the best checkpoint, so like load_best_model_at_end it's only on when checkpoints are saved
+    callbacks=[EarlyStoppingCallback(early_stopping_patience=EVAL_PATIENCE)] if TRAIN_SAVE else [],
 
 )
 
 # Start training
-trainer.train()
+train_result = trainer.train()
 
-# Save the fine-tuned model and tokenizer
-model.save_pretrained('./fine_tuned_t5_complex_test')
-tokenizer.save_pretrained('./fine_tuned_t5_complex_test')
\ No newline at end of file
+if trainer.is_world_process_zero():
+    metrics = {**train_result.metrics, 'world_size': WORLD_SIZE, 'threads_per_process': threads}
+    log(f"Training metrics: {metrics}")
+    if TRAIN_METRICS_PATH:
+        with open(TRAIN_METRICS_PATH, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f)
+    if TRAIN_SAVE:
+        # Save the fine-tuned model and tokenizer. With load_best_model_at_end that's the checkpoint with the best exact match
+        model.save_pretrained(TRAIN_OUTPUT_MODEL)
+        tokenizer.save_pretrained(TRAIN_OUTPUT_MODEL)
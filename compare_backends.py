@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+from bench_morphology import DATASETS, read_rows
+from inference_scheduler import percentile
+
+
+# Parity, latency and memory of the inflection backends (INFLECTION_BACKEND=torch vs onnx) on the training csvs.
+# Each backend runs in its own subprocess so its peak RSS and load time are its own.
+#   - accuracy: exact match against the csv's expected output, per dataset
+#   - parity: share of phrases where the backend says exactly what torch says
+#   - latency: one phrase per generate() call, the way a lone .add hits the model
+#   - throughput: batches of --batch-size, the way the scheduler runs a busy channel
+# Run with: python compare_backends.py --per-dataset 200 --json backend_report.json
+
+BACKENDS = ('torch', 'onnx')
+
+
+def sample_rows(per_dataset, seed):
+    rng = random.Random(seed)
+    rows = []
+    for path in DATASETS:
+        dataset_rows = read_rows(path)
+        rng.shuffle(dataset_rows)
+        rows.extend((path, *row) for row in dataset_rows[:per_dataset])
+    return rows
+
+
+def run_worker(args):
+    # runs inside the subprocess, INFLECTION_BACKEND is already set in its environment
+    import inflection_model
+    from inflection_cache import normalize_phrase
+
+    rows = sample_rows(args.per_dataset, args.seed)
+    jobs = [(directive, phrase) for _, directive, phrase, _ in rows]
+
+    start = time.perf_counter()
+    inflection_model.load_model()
+    load_time = time.perf_counter() - start
+    rss_after_load = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on linux
+    inflection_model.generate_batch(jobs[:4])  # warm up
+
+    latencies = []
+    for job in jobs[:args.latency_samples]:
+        start = time.perf_counter()
+        inflection_model.generate_batch([job])
+        latencies.append(time.perf_counter() - start)
+
+    outputs = []
+    start = time.perf_counter()
+    for batch_start in range(0, len(jobs), args.batch_size):
+        outputs.extend(inflection_model.generate_batch(jobs[batch_start:batch_start + args.batch_size]))
+    batch_time = time.perf_counter() - start
+
+    result = {
+        'backend': inflection_model.backend(),
+        'load_s': load_time,
+        'rss_after_load_mb': rss_after_load,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'latency_p50_ms': percentile(latencies, 50) * 1000,
+        'latency_p95_ms': percentile(latencies, 95) * 1000,
+        'throughput_per_s': len(jobs) / batch_time,
+        'outputs': [normalize_phrase(output) for output in outputs],
+    }
+    with open(args.worker_output, 'w', encoding='utf-8') as f:
+        json.dump(result, f)
+
+
+def run_backend(backend, args):
+    with open(os.devnull, 'w') as devnull:
+        output_path = f".compare_backends_{backend}.json"
+        command = [
+            sys.executable, __file__, '--worker', '--worker-output', output_path,
+            '--per-dataset', str(args.per_dataset), '--seed', str(args.seed),
+            '--batch-size', str(args.batch_size), '--latency-samples', str(args.latency_samples),
+        ]
+        completed = subprocess.run(command, env={**os.environ, 'INFLECTION_BACKEND': backend}, stdout=devnull)
+    if completed.returncode != 0:
+        print(f"{backend}: failed with exit code {completed.returncode}")
+        return None
+    with open(output_path, encoding='utf-8') as f:
+        result = json.load(f)
+    os.remove(output_path)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy parity, latency and RSS of the torch and ONNX inflection backends.")
+    parser.add_argument('--backends', default=','.join(BACKENDS))
+    parser.add_argument('--per-dataset', type=int, default=200, help="phrases sampled from each csv")
+    parser.add_argument('--batch-size', type=int, default=16)
+    parser.add_argument('--latency-samples', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write the report here")
+    parser.add_argument('--show-diffs', type=int, default=10, help="print up to this many phrases where a backend disagrees with torch")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--worker-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    rows = sample_rows(args.per_dataset, args.seed)
+    results = {}
+    for backend in args.backends.split(','):
+        print(f"Running {backend}...")
+        result = run_backend(backend, args)
+        if result is not None:
+            results[backend] = result
+
+    outputs = {backend: result.pop('outputs') for backend, result in results.items()}
+    reference = outputs.get('torch')
+    print(f"\n{'backend':<8} {'load s':>7} {'rss MB':>7} {'peak MB':>8} {'p50 ms':>7} {'p95 ms':>7} {'phrases/s':>10} {'accuracy':>9} {'parity':>7}")
+    for backend, result in results.items():
+        matches = [output == row[3] for row, output in zip(rows, outputs[backend])]
+        result['accuracy'] = sum(matches) / max(len(rows), 1)
+        result['accuracy_per_dataset'] = {
+            path: sum(match for row, match in zip(rows, matches) if row[0] == path) / max(sum(1 for row in rows if row[0] == path), 1)
+            for path in DATASETS
+        }
+        parity = '-'
+        if reference is not None:
+            result['parity_with_torch'] = sum(1 for a, b in zip(outputs[backend], reference) if a == b) / max(len(rows), 1)
+            parity = f"{result['parity_with_torch']:.1%}"
+        print(
+            f"{backend:<8} {result['load_s']:>7.2f} {result['rss_after_load_mb']:>7.0f} {result['peak_rss_mb']:>8.0f} "
+            f"{result['latency_p50_ms']:>7.1f} {result['latency_p95_ms']:>7.1f} {result['throughput_per_s']:>10.1f} "
+            f"{result['accuracy']:>9.1%} {parity:>7}"
+        )
+        if reference is not None and backend != 'torch':
+            for row, output, expected in zip(rows, outputs[backend], reference):
+                if output != expected and args.show_diffs > 0:
+                    print(f"    {row[1]} {row[2]!r}: {backend} {output!r}, torch {expected!r}")
+                    args.show_diffs -= 1
+
+    print("\naccuracy per dataset")
+    for path in DATASETS:
+        print(f"  {path:<28} " + "  ".join(f"{backend} {results[backend]['accuracy_per_dataset'][path]:.1%}" for backend in results))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'rows': len(rows), 'batch_size': args.batch_size, 'backends': results}, f, indent=2)
+        print(f"Report written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+import argparse
+import os
+import time
+
+
+# Re-saves the fine tuned model as model.safetensors next to (or instead of) pytorch_model.bin.
+# inflection_model.py picks safetensors up automatically: the weights get memory mapped instead of unpickled,
+# so the bot's model is ready noticeably sooner and loading doesn't hold a second copy of the weights in memory.
+# Run with: python convert_safetensors.py   (add --remove-bin once you've checked the bot loads it)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the inflection model's weights to safetensors.")
+    parser.add_argument('--model', default=os.getenv('INFLECTION_MODEL_PATH', 'fine_tuned_t5_complex'))
+    parser.add_argument('--remove-bin', action='store_true', help="delete pytorch_model.bin afterwards")
+    args = parser.parse_args()
+
+    from transformers import T5ForConditionalGeneration
+
+    model = T5ForConditionalGeneration.from_pretrained(args.model)
+    model.save_pretrained(args.model, safe_serialization=True)
+    print(f"Wrote {os.path.join(args.model, 'model.safetensors')}")
+
+    start = time.perf_counter()
+    T5ForConditionalGeneration.from_pretrained(args.model, use_safetensors=True, low_cpu_mem_usage=True)
+    print(f"Loads from safetensors in {time.perf_counter() - start:.2f}s")
+
+    bin_path = os.path.join(args.model, 'pytorch_model.bin')
+    if args.remove_bin and os.path.exists(bin_path):
+        os.remove(bin_path)
+        print(f"Removed {bin_path}")
+
+
+if __name__ == "__main__":
+    main()
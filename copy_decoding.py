@@ -0,0 +1,117 @@
+import threading
+
+import torch
+from transformers.modeling_outputs import BaseModelOutput
+
+
+# Copy-aware greedy decoding for the inflection model (prompt lookup decoding, speculative style).
+# A plural or singular is nearly always the input phrase with a token or two changed around the head noun, so the input
+# itself makes a very good guess at the rest of the output. Instead of one decoder step per token:
+#   1. draft: find where the last generated tokens appear in the input and propose the input tokens that follow them
+#      (at the very start, the whole phrase after "pluralize:"; right after a new token, wherever the draft left off)
+#   2. verify: one decoder forward pass over output + draft gives the model's greedy choice at every draft position
+#   3. keep the draft up to the first token the model disagrees with, plus the model's own token there
+# Every kept token is exactly the token greedy decoding would have picked at that position, so the output is the same as
+# model.generate()'s. "potion of healing" -> "potions of healing" typically takes 2-3 passes instead of ~8.
+# The decoder runs without a KV cache, each pass re-reads the prefix. Outputs are a few dozen tokens at most, so that's
+# cheaper than keeping and cropping a cache, and a pass costs about the same as a cached step on a tiny batch anyway.
+
+_counter_lock = threading.Lock()
+counters = {'sequences': 0, 'decoder_passes': 0, 'tokens': 0, 'draft_tokens': 0, 'accepted_draft_tokens': 0}
+
+
+def _count(**amounts):
+    with _counter_lock:
+        for name, amount in amounts.items():
+            counters[name] += amount
+
+
+def propose_draft(source, output, phrase_start, cursor, max_ngram=3, max_draft=16):
+    """
+    Draft tokens copied from source, the input ids.
+
+    Args:
+        source: input token ids (no padding), ending in </s>
+        output: tokens generated so far, without the decoder start token
+        phrase_start: index in source where the phrase starts, i.e. after the "pluralize:" prefix
+        cursor: where in source the output is believed to be, used when the output's last tokens aren't in the
+            input at all (right after the model added an ending or swapped a word)
+
+    Returns:
+        (index in source the draft starts at, draft tokens)
+    """
+    if not output:
+        return phrase_start, source[phrase_start:phrase_start + max_draft]
+    for ngram in range(min(max_ngram, len(output)), 0, -1):
+        tail = output[-ngram:]
+        # the latest spot in the phrase where the output's last tokens show up. The output runs through the phrase left to
+        # right, so the last occurrence is usually the right one for a repeated word ("box of boxes" style phrases)
+        for start in range(len(source) - ngram, phrase_start - 1, -1):
+            if source[start:start + ngram] == tail:
+                return start + ngram, source[start + ngram:start + ngram + max_draft]
+    return cursor, source[cursor:cursor + max_draft]
+
+
+@torch.no_grad()
+def generate(model, input_ids, attention_mask, phrase_starts, max_length=None, max_ngram=3, max_draft=16):
+    """
+    Greedy decoding with drafts copied from the input. Same result as model.generate(input_ids, attention_mask=...)
+    with the model's default (greedy) generation config.
+
+    Args:
+        phrase_starts: per row, the index of the first phrase token in input_ids (where the directive prefix ends)
+        max_length: output length cap including the decoder start token, defaults to the generation config's
+
+    Returns:
+        A list of token id lists, one per row, each starting with the decoder start token like generate() returns.
+    """
+    config = model.generation_config
+    max_length = max_length or config.max_length
+    start_token = model.config.decoder_start_token_id
+    eos_token = config.eos_token_id if config.eos_token_id is not None else model.config.eos_token_id
+
+    # the encoder runs once for the whole batch, only the decoding is per row
+    encoder_states = model.get_encoder()(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state
+    results = []
+    for row in range(input_ids.shape[0]):
+        length = int(attention_mask[row].sum())  # T5's tokenizer pads on the right
+        source = input_ids[row, :length].tolist()
+        encoder_outputs = BaseModelOutput(last_hidden_state=encoder_states[row:row + 1, :length])
+        mask = attention_mask[row:row + 1, :length]
+
+        output = []
+        cursor = phrase_starts[row]
+        passes = drafted = accepted_total = 0
+        while len(output) + 1 < max_length:
+            draft_start, draft = propose_draft(source, output, phrase_starts[row], cursor, max_ngram, max_draft)
+            draft = draft[:max(0, max_length - 2 - len(output))]  # room for the model's own token after the draft
+            decoder_input_ids = torch.tensor([[start_token] + output + draft], device=input_ids.device)
+            logits = model(
+                encoder_outputs=encoder_outputs,
+                attention_mask=mask,
+                decoder_input_ids=decoder_input_ids,
+                use_cache=False,
+            ).logits[0]
+            passes += 1
+
+            # greedy choices for the position after the output so far, and after each draft token
+            predicted = logits[len(output):].argmax(-1).tolist()
+            accepted = 0
+            while accepted < len(draft) and draft[accepted] == predicted[accepted]:
+                accepted += 1
+            drafted += len(draft)
+            accepted_total += accepted
+
+            new_tokens = draft[:accepted] + [predicted[accepted]]
+            # if the model's token isn't in the input, the next draft picks up from the source token it went against. That's
+            # right for an inserted ending ("sword" -> "sword" + "s", the usual plural) and one pass off for a swapped word
+            cursor = draft_start + accepted
+            if eos_token in new_tokens:
+                output.extend(new_tokens[:new_tokens.index(eos_token) + 1])
+                break
+            output.extend(new_tokens)
+
+        output = output[:max_length - 1]
+        _count(sequences=1, decoder_passes=passes, tokens=len(output), draft_tokens=drafted, accepted_draft_tokens=accepted_total)
+        results.append([start_token] + output)
+    return results
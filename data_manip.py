@@ -1,21 +1,165 @@
+import argparse
+import csv
+import hashlib
+import os
+
 import pandas as pd
 
-# Load dataset
-df = pd.read_csv("combined_dataset.csv")
 
-# Function to count words in input_text
-def word_count(text):
-    return len(str(text).split())
+# Builds every training csv from the source data in one run:
+#   single_word.csv / two_to_three_words.csv / complex_phrases.csv   split by how many words the input has
+#   pluralization_with_directive.csv / singularization_with_directive.csv   each direction on its own
+# Sources are read in chunks, so memory stays flat however big they get. Along the way:
+#   - rows are cleaned (whitespace stripped, empty rows and unknown directives dropped)
+#   - (directive, input) pairs are deduplicated, the first one seen wins
+#   - every example also gives the reverse one (pluralize cat -> cats means singularize cats -> cat), so the two directions
+#     can't drift apart anymore. Rows actually in the sources win over derived ones, that's why there are two passes.
+# A source without a directive column needs it given: pluralization_dataset.csv=pluralize
+# Run with: python data_manip.py
+#           python data_manip.py --source combined_dataset.csv --source more_items.csv=pluralize --output-dir new_data
+
+DEFAULT_SOURCES = ['combined_dataset.csv']
+REVERSE = {'pluralize': 'singularize', 'singularize': 'pluralize'}
+COLUMNS = ['directive', 'input_text', 'output_text']
+# (file name, smallest word count, largest word count or None)
+WORD_COUNT_SPLITS = [
+    ('single_word.csv', 1, 1),
+    ('two_to_three_words.csv', 2, 3),
+    ('complex_phrases.csv', 4, None),
+]
+DIRECTION_FILES = {
+    'pluralize': 'pluralization_with_directive.csv',
+    'singularize': 'singularization_with_directive.csv',
+}
+
+
+def parse_source(spec):
+    # "path" or "path=directive"
+    path, _, directive = spec.partition('=')
+    if directive and directive not in REVERSE:
+        raise argparse.ArgumentTypeError(f"Unknown directive {directive!r} in {spec!r}")
+    return path, directive or None
+
+
+def read_chunks(path, directive, chunk_size):
+    """Cleaned (directive, input_text, output_text) DataFrame chunks of one source csv."""
+    for chunk in pd.read_csv(path, chunksize=chunk_size, dtype=str, keep_default_na=False, skipinitialspace=True):
+        if directive is not None:
+            chunk['directive'] = directive
+        elif 'directive' not in chunk.columns:
+            raise ValueError(f"{path} has no directive column, give it one like {path}=pluralize")
+        chunk = chunk[COLUMNS]
+        for column in COLUMNS:
+            chunk[column] = chunk[column].str.strip()
+        chunk = chunk[chunk['directive'].isin(REVERSE.keys()) & (chunk['input_text'] != '') & (chunk['output_text'] != '')]
+        yield chunk
+
+
+def pair_keys(directives, inputs):
+    # 8 byte digests instead of the strings themselves, a few hundred MB covers tens of millions of pairs
+    return [
+        hashlib.blake2b(f"{directive}\t{text.lower()}".encode(), digest_size=8).digest()
+        for directive, text in zip(directives, inputs)
+    ]
+
+
+def drop_seen(chunk, seen):
+    """Rows of chunk whose (directive, input) hasn't been seen yet, in this chunk or before. Adds them to seen."""
+    keep = []
+    for key in pair_keys(chunk['directive'], chunk['input_text']):
+        keep.append(key not in seen)
+        seen.add(key)
+    return chunk[keep]
+
+
+def reverse_examples(chunk):
+    return pd.DataFrame({
+        'directive': chunk['directive'].map(REVERSE),
+        'input_text': chunk['output_text'],
+        'output_text': chunk['input_text'],
+    })
+
+
+class SplitWriter:
+    """Appends chunks to every output csv, writing each header once."""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.counts = {}
+        os.makedirs(output_dir, exist_ok=True)
+        for name in [name for name, _, _ in WORD_COUNT_SPLITS] + list(DIRECTION_FILES.values()):
+            self._write(name, pd.DataFrame(columns=COLUMNS), header=True)
+            self.counts[name] = 0
+
+    def _write(self, name, frame, header=False):
+        # the directive files have always been fully quoted, the split files haven't
+        quoting = csv.QUOTE_ALL if name in DIRECTION_FILES.values() else csv.QUOTE_MINIMAL
+        frame.to_csv(os.path.join(self.output_dir, name), mode='w' if header else 'a', header=header, index=False, quoting=quoting)
+
+    def write(self, chunk):
+        if chunk.empty:
+            return
+        # one vectorized pass for the word counts, then every split is a mask over it
+        word_counts = chunk['input_text'].str.count(r'\S+')
+        for name, smallest, largest in WORD_COUNT_SPLITS:
+            mask = word_counts >= smallest
+            if largest is not None:
+                mask &= word_counts <= largest
+            self._append(name, chunk[mask])
+        for directive, name in DIRECTION_FILES.items():
+            self._append(name, chunk[chunk['directive'] == directive])
+
+    def _append(self, name, frame):
+        if not frame.empty:
+            self._write(name, frame)
+            self.counts[name] += len(frame)
+
+
+def build(sources, output_dir, chunk_size=100_000, derive_reverse=True):
+    """Streams the sources into the output csvs. Returns a dict of counts for the summary."""
+    writer = SplitWriter(output_dir)
+    seen = set()
+    totals = {'source_rows': 0, 'duplicates': 0, 'derived': 0, 'derived_skipped': 0}
+
+    # pass 1: the rows that are actually in the sources
+    for path, directive in sources:
+        for chunk in read_chunks(path, directive, chunk_size):
+            unique = drop_seen(chunk, seen)
+            totals['source_rows'] += len(chunk)
+            totals['duplicates'] += len(chunk) - len(unique)
+            writer.write(unique)
+
+    # pass 2: reverse direction examples, for every pair no source had already
+    if derive_reverse:
+        for path, directive in sources:
+            for chunk in read_chunks(path, directive, chunk_size):
+                reversed_chunk = reverse_examples(chunk)
+                unique = drop_seen(reversed_chunk, seen)
+                totals['derived'] += len(unique)
+                totals['derived_skipped'] += len(reversed_chunk) - len(unique)
+                writer.write(unique)
+
+    return {**totals, 'files': writer.counts}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the word count splits and per direction csvs from the source data.")
+    parser.add_argument('--source', action='append', type=parse_source,
+                        help="source csv, or path=pluralize / path=singularize for one without a directive column. Repeatable")
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--chunk-size', type=int, default=100_000, help="rows read at a time")
+    parser.add_argument('--no-reverse', action='store_true', help="don't derive the opposite direction examples")
+    args = parser.parse_args()
+
+    sources = args.source or [parse_source(spec) for spec in DEFAULT_SOURCES]
+    summary = build(sources, args.output_dir, args.chunk_size, derive_reverse=not args.no_reverse)
 
-# Categorize data based on word count
-single_word_df = df[df["input_text"].apply(word_count) == 1]
-two_to_three_df = df[df["input_text"].apply(word_count).between(2, 3)]
-complex_phrases_df = df[df["input_text"].apply(word_count) > 3]
+    print(f"{summary['source_rows']} source rows, {summary['duplicates']} duplicates dropped, "
+          f"{summary['derived']} reverse examples added ({summary['derived_skipped']} already there)")
+    for name, count in summary['files'].items():
+        print(f"    {os.path.join(args.output_dir, name)}: {count} rows")
+    print("Datasets saved successfully!")
 
-# Save to separate CSV files
-single_word_df.to_csv("single_word.csv", index=False)
-two_to_three_df.to_csv("two_to_three_words.csv", index=False)
-complex_phrases_df.to_csv("complex_phrases.csv", index=False)
 
-print("Datasets saved successfully!")
-    
\ No newline at end of file
+if __name__ == "__main__":
+    main()
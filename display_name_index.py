@@ -0,0 +1,117 @@
+import threading
+
+from bot_logging import get_logger
+
+
+# on_message used to download the whole users tree (inventories and all) on every single message just to get the display names.
+# This keeps display_name -> user_id in memory instead. It loads once at startup (for firebase a shallow query plus one small
+# read per user, see storage.py), and can optionally follow changes made outside the bot with a realtime listener.
+
+log = get_logger(__name__)
+
+
+class DisplayNameIndex:
+    """
+    In-memory display_name -> user_id index for the users node.
+
+    Args:
+        storage: the Storage users live in, see storage.py
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.loaded = False
+        self.version = 0  # bumps every time the set of names changes, so matchers built from it know when to rebuild
+        self._lock = threading.Lock()
+        self._by_user = {}  # user_id -> display_name, needed to drop the old name when somebody re-inits
+        self._by_name = {}
+        self._listener = None
+
+    def names(self):
+        """
+        Current display_name -> user_id dict. Don't mutate it: it gets swapped out whole on every change,
+        so readers can hold on to it without copying or locking.
+        """
+        return self._by_name
+
+    def load(self):
+        """Blocking initial load. Only pulls the user ids and each user's display_name, never the inventories."""
+        by_user = self.storage.display_names()
+        self._replace_all(by_user)
+        self.loaded = True
+        log.info("Loaded %d display names", len(by_user))
+
+    def set_user(self, user_id, display_name):
+        """Local update, used by .initme so the new name works right away without waiting on the listener."""
+        with self._lock:
+            by_user = dict(self._by_user)
+            if display_name:
+                by_user[str(user_id)] = display_name
+            else:
+                by_user.pop(str(user_id), None)
+            self._publish(by_user)
+
+    def start_listener(self):
+        """
+        Follows users/ for changes made outside this process. Runs on firebase_admin's own background thread.
+        Realtime database can't listen on a wildcard path like users/*/display_name, so inventory events come through too
+        and just get ignored. The first event is a one-time snapshot of the whole node, after that only changes come through.
+        Set DISPLAY_NAME_LISTENER=0 to skip it if the bot is the only thing writing users.
+        Backends without change notifications (sqlite) don't start anything.
+        """
+        if self._listener is None:
+            self._listener = self.storage.listen_users(self._on_event)
+
+    def stop_listener(self):
+        if self._listener is not None:
+            self._listener.close()
+            self._listener = None
+
+    def _on_event(self, event):
+        try:
+            if event.event_type == 'patch':
+                # patch data is keyed by child paths relative to event.path, each one is effectively a put
+                base = event.path.rstrip('/')
+                for child_path, value in (event.data or {}).items():
+                    self._apply_put(f"{base}/{child_path}", value)
+            else:
+                self._apply_put(event.path, event.data)
+        except Exception as e:
+            log.exception("Error handling display name event at %s", event.path)
+
+    def _apply_put(self, path, data):
+        parts = [part for part in path.split('/') if part]
+
+        if not parts:
+            # the whole users node was written, this is also the first event the listener gets
+            by_user = {}
+            for user_id, user_data in (data or {}).items():
+                if isinstance(user_data, dict) and user_data.get('display_name'):
+                    by_user[str(user_id)] = user_data['display_name']
+            self._replace_all(by_user)
+            return
+
+        user_id = parts[0]
+        if len(parts) == 1:
+            # a whole user node was written or deleted
+            display_name = data.get('display_name') if isinstance(data, dict) else None
+        elif len(parts) == 2 and parts[1] == 'display_name':
+            display_name = data
+        else:
+            return  # inventory changes and such, nothing to do with names
+
+        with self._lock:
+            if self._by_user.get(user_id) == display_name:
+                return
+        self.set_user(user_id, display_name)
+
+    def _replace_all(self, by_user):
+        with self._lock:
+            if by_user != self._by_user:
+                self._publish(by_user)
+
+    def _publish(self, by_user):
+        # caller holds the lock
+        self._by_user = by_user
+        self._by_name = {display_name: user_id for user_id, display_name in by_user.items()}
+        self.version += 1
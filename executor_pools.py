@@ -0,0 +1,106 @@
+import asyncio
+import functools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+# Anything that blocks (torch, firebase_admin's http calls) has to stay off the discord event loop,
+# otherwise the gateway heartbeat stalls and discord makes us RESUME the session.
+# A BlockingPool is an executor plus an async wrapper with its own concurrency limit.
+
+
+def cpu_count():
+    # respects taskset/cgroup pinning where the os supports it, which os.cpu_count() doesn't
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def torch_thread_budget(concurrent_workers, override=None):
+    """
+    Intra-op threads each inference worker gets, so workers x threads doesn't oversubscribe the cores.
+    Every worker running torch at the same time spins up its own set of threads, hence the division.
+    """
+    if override:
+        return max(1, int(override))
+    return max(1, cpu_count() // max(1, concurrent_workers))
+
+
+def set_torch_threads(num_threads):
+    import torch  # only the inference workers need torch, the db pool shouldn't drag it in
+
+    torch.set_num_threads(num_threads)
+
+
+def pin_worker_cores(rank, workers):
+    """
+    Gives worker number rank (of workers on this machine) its own slice of the cores and that many torch threads,
+    so data parallel training processes don't fight over the same cores. Returns the number of threads it got.
+    """
+    if not hasattr(os, 'sched_setaffinity'):
+        threads = torch_thread_budget(workers)
+    else:
+        cores = sorted(os.sched_getaffinity(0))
+        per_worker = max(1, len(cores) // max(1, workers))
+        mine = cores[rank * per_worker:(rank + 1) * per_worker] or cores[rank % len(cores):rank % len(cores) + 1]
+        os.sched_setaffinity(0, mine)
+        threads = len(mine)
+    set_torch_threads(threads)
+    return threads
+
+
+class BlockingPool:
+    """
+    Runs blocking functions in a thread or process pool and awaits them from the event loop.
+
+    Args:
+        name: used for thread names and log lines
+        kind: 'thread' or 'process'. Process workers need everything they run to be importable and picklable.
+        workers: executor size
+        max_concurrency: how many calls can be in flight at once, defaults to the number of workers.
+            Extra callers wait on the event loop instead of piling up in the executor queue.
+        initializer, initargs: run once in every worker, same as the concurrent.futures executors
+    """
+
+    def __init__(self, name, kind='thread', workers=1, max_concurrency=None, initializer=None, initargs=()):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown pool kind {kind!r}, expected 'thread' or 'process'")
+        self.name = name
+        self.kind = kind
+        self.workers = workers
+        self.max_concurrency = max_concurrency or workers
+
+        if kind == 'thread':
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix=name, initializer=initializer, initargs=initargs
+            )
+        else:
+            # spawn, not fork: forking a process that already has torch and the discord client running is asking for deadlocks
+            self._executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=initializer,
+                initargs=initargs,
+            )
+
+        self._semaphore = None
+        self.in_flight = 0
+        self.calls = 0
+
+    async def run(self, fn, *args, **kwargs):
+        if self._semaphore is None:
+            # created on first use so it belongs to the loop that's actually running
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async with self._semaphore:
+            self.in_flight += 1
+            self.calls += 1
+            try:
+                loop = asyncio.get_running_loop()
+                return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+            finally:
+                self.in_flight -= 1
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
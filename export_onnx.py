@@ -0,0 +1,70 @@
+import argparse
+import glob
+import os
+import shutil
+import tempfile
+
+from transformers import T5Tokenizer
+
+
+# Converts fine_tuned_t5_complex into the int8 ONNX model the bot runs with INFLECTION_BACKEND=onnx.
+#   1. export to ONNX as encoder_model / decoder_model / decoder_with_past_model graphs (the with-past one is what makes
+#      generation cheap: after the first token the decoder only processes the newest token against the cached keys/values)
+#   2. run onnxruntime's graph optimizations (fused attention/layernorm/gelu where they apply)
+#   3. dynamic int8 quantization of the weights of every graph. Activations stay fp32 and get quantized on the fly,
+#      so no calibration data is needed
+# Needs: pip install optimum[onnxruntime]
+# Run with: python export_onnx.py   then check it with   python compare_backends.py
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the inflection model to a quantized ONNX encoder/decoder-with-past.")
+    parser.add_argument('--model', default=os.getenv('INFLECTION_MODEL_PATH', 'fine_tuned_t5_complex'))
+    parser.add_argument('--output', default=os.getenv('INFLECTION_ONNX_PATH', 'fine_tuned_t5_complex_onnx'))
+    parser.add_argument('--arm64', action='store_true', help="quantize for ARM (e.g. a Raspberry Pi or Graviton box) instead of AVX2")
+    parser.add_argument('--no-optimize', action='store_true', help="skip the graph optimization step")
+    args = parser.parse_args()
+
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM, ORTOptimizer, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig, OptimizationConfig
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        exported_dir = os.path.join(work_dir, 'exported')
+        print(f"Exporting {args.model} to ONNX...")
+        model = ORTModelForSeq2SeqLM.from_pretrained(args.model, export=True, use_cache=True, use_merged=False)
+        model.save_pretrained(exported_dir)
+
+        if not args.no_optimize:
+            print("Optimizing graphs...")
+            optimized_dir = os.path.join(work_dir, 'optimized')
+            optimizer = ORTOptimizer.from_pretrained(model)
+            # level 1 is the portable set of fusions, the higher levels bake in hardware specific kernels
+            optimizer.optimize(save_dir=optimized_dir, optimization_config=OptimizationConfig(optimization_level=1))
+            exported_dir = optimized_dir
+
+        print("Quantizing to int8...")
+        if args.arm64:
+            quantization_config = AutoQuantizationConfig.arm64(is_static=False, per_channel=False)
+        else:
+            quantization_config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        os.makedirs(args.output, exist_ok=True)
+        for onnx_file in sorted(glob.glob(os.path.join(exported_dir, '*.onnx'))):
+            file_name = os.path.basename(onnx_file)
+            quantizer = ORTQuantizer.from_pretrained(exported_dir, file_name=file_name)
+            quantizer.quantize(save_dir=args.output, quantization_config=quantization_config)
+            # the quantizer writes <name>_quantized.onnx, give it back the default name so from_pretrained finds it
+            quantized = os.path.join(args.output, file_name.replace('.onnx', '_quantized.onnx'))
+            os.replace(quantized, os.path.join(args.output, file_name))
+            print(f"    {file_name}: {os.path.getsize(onnx_file) / 1e6:.1f}MB -> {os.path.getsize(os.path.join(args.output, file_name)) / 1e6:.1f}MB")
+
+        # config, generation config and tokenizer go along so the folder loads on its own
+        for extra in ('config.json', 'generation_config.json'):
+            if os.path.exists(os.path.join(exported_dir, extra)):
+                shutil.copy(os.path.join(exported_dir, extra), args.output)
+        T5Tokenizer.from_pretrained(args.model).save_pretrained(args.output)
+
+    print(f"Saved to {args.output}. Run the bot with INFLECTION_BACKEND=onnx to use it.")
+
+
+if __name__ == "__main__":
+    main()
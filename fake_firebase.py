@@ -0,0 +1,155 @@
+import copy
+import hashlib
+import json
+import threading
+import time
+
+
+# In-memory stand-in for the bits of firebase_admin.db the bot uses, for stress tests and load tests that shouldn't touch
+# the real database. Same call shapes as db.Reference: get(etag=, shallow=), set, update (multi-path, None deletes),
+# delete, set_if_unchanged and child. ETags are a hash of the node's JSON, like the real ones they change whenever the
+# data does. latency_ms makes every call sleep a bit, so races actually get a chance to happen.
+#
+#     root = FakeDatabase(latency_ms=5).reference()
+#     root.child('users').child('123').child('inventory').get(etag=True)
+
+
+def _etag(value):
+    return hashlib.md5(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _split(path):
+    return [part for part in path.strip('/').split('/') if part]
+
+
+class FakeEvent:
+    def __init__(self, event_type, path, data):
+        self.event_type = event_type
+        self.path = path
+        self.data = data
+
+
+class FakeListenerRegistration:
+    def __init__(self, database, entry):
+        self.database = database
+        self.entry = entry
+
+    def close(self):
+        with self.database.lock:
+            if self.entry in self.database.listeners:
+                self.database.listeners.remove(self.entry)
+
+
+class FakeDatabase:
+    def __init__(self, data=None, latency_ms=0):
+        self.data = copy.deepcopy(data) if data is not None else {}
+        self.latency = latency_ms / 1000
+        self.lock = threading.RLock()
+        self.listeners = []  # (path parts, callback)
+        self.calls = 0
+
+    def reference(self, path='/'):
+        return FakeReference(self, _split(path))
+
+    def _call(self):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _read(self, parts):
+        node = self.data
+        for part in parts:
+            if not isinstance(node, dict) or part not in node:
+                return None
+            node = node[part]
+        return node
+
+    def _write(self, parts, value):
+        if not parts:
+            self.data = copy.deepcopy(value) if value is not None else {}
+            return
+        node = self.data
+        trail = []
+        for part in parts[:-1]:
+            if not isinstance(node.get(part), dict):
+                if value is None:
+                    return
+                node[part] = {}
+            trail.append((node, part))
+            node = node[part]
+        if value is None or value == {}:
+            node.pop(parts[-1], None)
+            # firebase doesn't keep empty nodes around
+            for parent, part in reversed(trail):
+                if parent[part]:
+                    break
+                del parent[part]
+        else:
+            node[parts[-1]] = copy.deepcopy(value)
+
+    def _notify(self, parts, event_type, data):
+        for listen_parts, callback in list(self.listeners):
+            if parts[:len(listen_parts)] == listen_parts:
+                relative = '/' + '/'.join(parts[len(listen_parts):])
+                callback(FakeEvent(event_type, relative, copy.deepcopy(data)))
+
+
+class FakeReference:
+    def __init__(self, database, parts):
+        self.database = database
+        self.parts = parts
+
+    @property
+    def key(self):
+        return self.parts[-1] if self.parts else None
+
+    @property
+    def path(self):
+        return '/' + '/'.join(self.parts)
+
+    def child(self, path):
+        return FakeReference(self.database, self.parts + _split(str(path)))
+
+    def get(self, etag=False, shallow=False):
+        self.database._call()
+        with self.database.lock:
+            value = copy.deepcopy(self.database._read(self.parts))
+            tag = _etag(value)
+        if shallow and isinstance(value, dict):
+            value = {key: True for key in value}
+        return (value, tag) if etag else value
+
+    def set(self, value):
+        self.database._call()
+        with self.database.lock:
+            self.database._write(self.parts, value)
+            self.database._notify(self.parts, 'put', value)
+
+    def update(self, value):
+        self.database._call()
+        with self.database.lock:
+            for path, child_value in value.items():
+                self.database._write(self.parts + _split(path), child_value)
+            self.database._notify(self.parts, 'patch', value)
+
+    def delete(self):
+        self.set(None)
+
+    def set_if_unchanged(self, expected_etag, value):
+        self.database._call()
+        with self.database.lock:
+            current = copy.deepcopy(self.database._read(self.parts))
+            if _etag(current) != expected_etag:
+                return False, current, _etag(current)
+            self.database._write(self.parts, value)
+            self.database._notify(self.parts, 'put', value)
+            written = copy.deepcopy(self.database._read(self.parts))
+            return True, written, _etag(written)
+
+    def listen(self, callback):
+        with self.database.lock:
+            entry = (self.parts, callback)
+            self.database.listeners.append(entry)
+            callback(FakeEvent('put', '/', copy.deepcopy(self.database._read(self.parts))))
+        return FakeListenerRegistration(self.database, entry)
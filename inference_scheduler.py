@@ -0,0 +1,165 @@
+import asyncio
+import time
+from collections import Counter, deque
+
+from bot_logging import get_logger, lazy
+
+
+# When a bunch of people post at once, every inflection used to be its own model.generate call on a batch of one.
+# The scheduler holds jobs for a few milliseconds (or until the batch is full) and runs them through the model together,
+# which costs barely more than a single call since the model is tiny and padding is cheap.
+# Jobs submitted together with submit_many always land in the same batch, so one message costs one forward pass.
+
+log = get_logger(__name__)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers, q in [0, 100]. Returns 0.0 for an empty list."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class InferenceScheduler:
+    """
+    Collects (directive, phrase) jobs from any number of coroutines and runs them as padded batches.
+
+    Args:
+        generate_batch: function taking a list of (directive, phrase) tuples and returning a list of outputs in the same order
+        executor: optional BlockingPool to run generate_batch in, so the event loop isn't blocked while the model runs.
+            Up to its max_concurrency batches run at once.
+        max_wait_ms: how long the first job in a batch waits for company before the batch runs anyway
+        max_batch_size: batch runs right away once it has this many jobs. A group from submit_many is never split,
+            so a single big group can go over this.
+        history: how many recent jobs/batches to keep for the wait time percentiles
+        report_every: print a stats line every this many batches, 0 to turn it off
+    """
+
+    def __init__(self, generate_batch, executor=None, max_wait_ms=5, max_batch_size=16, history=1000, report_every=0):
+        self.generate_batch = generate_batch
+        self.executor = executor
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.report_every = report_every
+
+        self._queue = None
+        self._worker = None
+        self._slots = None
+        self._carry = None  # group that didn't fit in the last batch, goes first in the next one
+        self._running = set()  # keeps in-flight batch tasks from being garbage collected
+
+        self.jobs = 0
+        self.batches = 0
+        self.max_queue_depth = 0
+        self.batch_sizes = Counter()
+        self._waits = deque(maxlen=history)      # time from submit until the job's batch started running
+        self._latencies = deque(maxlen=history)  # time from submit until the result was ready
+
+    async def submit(self, directive, phrase):
+        """Queues one job and waits for the model's answer."""
+        outputs = await self.submit_many([(directive, phrase)])
+        return outputs[0]
+
+    async def submit_many(self, jobs):
+        """Queues a group of jobs that has to run in the same batch, and waits for all their answers in order."""
+        if not jobs:
+            return []
+        self._ensure_worker()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((list(jobs), future, time.perf_counter()))
+        self.max_queue_depth = max(self.max_queue_depth, self._queue.qsize())
+        return await future
+
+    def stats(self):
+        waits = list(self._waits)
+        latencies = list(self._latencies)
+        return {
+            'queue_depth': (self._queue.qsize() if self._queue is not None else 0) + (self._carry is not None),
+            'max_queue_depth': self.max_queue_depth,
+            'jobs': self.jobs,
+            'batches': self.batches,
+            'batches_in_flight': len(self._running),
+            'mean_batch_size': self.jobs / self.batches if self.batches else 0.0,
+            'batch_sizes': dict(sorted(self.batch_sizes.items())),
+            'wait_ms': {f'p{q}': percentile(waits, q) * 1000 for q in (50, 95, 99)},
+            'latency_ms': {f'p{q}': percentile(latencies, q) * 1000 for q in (50, 95, 99)},
+        }
+
+    def _ensure_worker(self):
+        # the queue and worker have to be created inside the running loop, so this happens on first use
+        if self._worker is None or self._worker.done():
+            self._queue = self._queue or asyncio.Queue()
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _collect_batch(self):
+        if self._carry is not None:
+            batch, self._carry = [self._carry], None
+        else:
+            batch = [await self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+
+        while size < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                group = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if size + len(group[0]) > self.max_batch_size:
+                self._carry = group
+                break
+            batch.append(group)
+            size += len(group[0])
+        return batch
+
+    async def _run(self):
+        concurrency = self.executor.max_concurrency if self.executor is not None else 1
+        self._slots = asyncio.Semaphore(concurrency)
+        while True:
+            # wait for a free worker before collecting, so jobs keep piling into the next batch while the model is busy
+            await self._slots.acquire()
+            batch = await self._collect_batch()
+            task = asyncio.get_running_loop().create_task(self._run_batch(batch))
+            self._running.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task):
+        self._running.discard(task)
+        self._slots.release()
+
+    async def _run_batch(self, batch):
+        started = time.perf_counter()
+
+        # two players asking for the same item in the same window only need one row in the batch
+        unique_jobs = list(dict.fromkeys(job for jobs, _, _ in batch for job in jobs))
+        try:
+            outputs = await self._execute(unique_jobs)
+            results = dict(zip(unique_jobs, outputs))
+        except Exception as e:
+            log.error("Inference batch of %d failed: %s", len(unique_jobs), e)
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        finished = time.perf_counter()
+        for jobs, future, submitted in batch:
+            self._waits.append(started - submitted)
+            self._latencies.append(finished - submitted)
+            if not future.done():  # the caller may have given up on it
+                future.set_result([results[job] for job in jobs])
+            self.jobs += len(jobs)
+
+        self.batches += 1
+        self.batch_sizes[len(unique_jobs)] += 1
+        if self.report_every and self.batches % self.report_every == 0:
+            log.info("Inference scheduler stats: %s", lazy(self.stats))
+
+    async def _execute(self, jobs):
+        if self.executor is None:
+            return self.generate_batch(jobs)
+        return await self.executor.run(self.generate_batch, jobs)
@@ -0,0 +1,390 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import signal
+import socket
+import struct
+import sys
+import time
+
+from bot_logging import get_logger, setup_logging
+from executor_pools import BlockingPool, torch_thread_budget
+from inference_scheduler import InferenceScheduler
+import inflection_model
+import morphology
+
+
+# One inflection model shared by every bot process on the machine. Without it each bot (or shard) loads its own copy of
+# the T5 model, so memory grows with the number of bots while each copy sits idle most of the time.
+#   python inference_server.py --socket /tmp/inflection.sock
+#   INFLECTION_SERVER=/tmp/inflection.sock python inventory_with_llm.py     (as many of these as you like)
+# The server holds the model in an inference pool, same settings as the bot's (INFERENCE_POOL_KIND, INFERENCE_WORKERS,
+# TORCH_THREADS_PER_WORKER, INFERENCE_BATCH_WINDOW_MS, INFERENCE_MAX_BATCH_SIZE), and jobs from every connected bot go
+# through one InferenceScheduler, so a busy server batches across bots too. --rules-only answers with morphology.guess()
+# instead of loading the model, for trying the whole setup out on a machine without torch. Logs go to the console and
+# INFERENCE_SERVER_LOG (inference_server.log).
+#
+# Protocol, over a unix socket: every message is a 4 byte big endian length and that many bytes of utf-8 json.
+#   {"id": 1, "op": "generate", "jobs": [["pluralize", "sword"], ...]}  ->  {"id": 1, "outputs": ["swords", ...]}
+#   {"id": 2, "op": "health"}                                          ->  {"id": 2, "status": "ready", ...}
+#   anything that goes wrong                                           ->  {"id": n, "error": "..."}
+# A connection can have any number of requests in flight, answers come back by id in whatever order they finish.
+# Generate requests that arrive while the model is still loading wait for it, the client's timeout decides for how long.
+
+HEADER = struct.Struct('>I')
+MAX_MESSAGE_BYTES = 1 << 20
+DIRECTIVES = ('pluralize', 'singularize')
+
+log = get_logger('inference_server')  # not __name__, that's __main__ when it runs as the server
+
+
+class InferenceServerError(Exception):
+    """The server answered with an error (bad request, model failed to load, generate raised)."""
+
+
+async def read_message(reader):
+    """Next message on the stream. Raises asyncio.IncompleteReadError when the other side hangs up."""
+    length, = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_MESSAGE_BYTES:
+        raise ValueError(f"{length} byte message is over the {MAX_MESSAGE_BYTES} byte limit")
+    return json.loads(await reader.readexactly(length))
+
+
+def encode_message(message):
+    data = json.dumps(message).encode('utf-8')
+    return HEADER.pack(len(data)) + data
+
+
+def parse_jobs(jobs):
+    # what comes off the socket is just json, check it before it gets anywhere near a batch with other bots' jobs in it
+    if not isinstance(jobs, list):
+        raise ValueError("jobs has to be a list of [directive, phrase] pairs")
+    parsed = []
+    for job in jobs:
+        if not isinstance(job, list) or len(job) != 2 or job[0] not in DIRECTIVES or not isinstance(job[1], str):
+            raise ValueError(f"Bad job {job!r}, expected [directive, phrase] with directive one of {DIRECTIVES}")
+        parsed.append((job[0], job[1]))
+    return parsed
+
+
+def guess_batch(jobs):
+    return [morphology.guess(directive, phrase) for directive, phrase in jobs]
+
+
+def rss_mb():
+    # resident memory of the server plus its process pool workers, from /proc. Elsewhere just the server's peak
+    try:
+        total = 0
+        for pid in [os.getpid()] + _child_pids():
+            with open(f'/proc/{pid}/status') as f:
+                total += next(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+        return total / 1024
+    except (OSError, StopIteration):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _child_pids():
+    pids = []
+    for task in os.listdir(f'/proc/{os.getpid()}/task'):
+        with open(f'/proc/{os.getpid()}/task/{task}/children') as f:
+            pids.extend(int(pid) for pid in f.read().split())
+    return pids
+
+
+class InferenceServer:
+    """
+    Serves one InferenceScheduler to every client on a unix socket.
+
+    Args:
+        path: socket path. A stale socket file left by a crashed server is replaced, a live server's isn't.
+        scheduler: the InferenceScheduler generate requests go through
+        load: coroutine function that loads and warms up the model, run in the background once the socket is up
+        description: what's answering, shown in health checks
+    """
+
+    def __init__(self, path, scheduler, load=None, description=None):
+        self.path = path
+        self.scheduler = scheduler
+        self._load = load
+        self.description = description or inflection_model.backend()
+        self.status = 'loading' if load is not None else 'ready'
+        self.error = None
+        self.started = time.time()
+        self.clients = 0
+        self.requests = 0
+        self.failed_requests = 0
+        self._ready = None
+        self._server = None
+        self._loader = None
+        self._connections = {}  # handler task -> its writer
+
+    async def start(self):
+        self._ready = asyncio.Event()
+        if self.status == 'ready':
+            self._ready.set()
+        self._remove_stale_socket()
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o660)  # bots running as the same user (or group) only
+        if self._load is not None:
+            self._loader = asyncio.create_task(self._load_model())
+
+    async def close(self):
+        if self._server is None:
+            return  # never got the socket, so it isn't ours to remove
+        self._server.close()
+        # hang up on every bot, their handlers see the connection end and finish on their own
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _remove_stale_socket(self):
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            os.unlink(self.path)  # nobody listening, left over from a crash
+            return
+        finally:
+            probe.close()
+        raise RuntimeError(f"Another inference server is already listening on {self.path}")
+
+    async def _load_model(self):
+        start = time.perf_counter()
+        try:
+            await self._load()
+        except Exception as e:
+            log.error("Failed to load the inflection model: %s", e)
+            self.status, self.error = 'failed', str(e)
+        else:
+            log.info("Inflection model (%s) ready after %.1fs", self.description, time.perf_counter() - start)
+            self.status = 'ready'
+        self._ready.set()
+
+    def health(self):
+        return {
+            'status': self.status,
+            'load_error': self.error,
+            'backend': self.description,
+            'pid': os.getpid(),
+            'uptime_s': time.time() - self.started,
+            'clients': self.clients,
+            'requests': self.requests,
+            'failed_requests': self.failed_requests,
+            'rss_mb': rss_mb(),
+            'scheduler': self.scheduler.stats(),
+        }
+
+    async def _handle(self, reader, writer):
+        self.clients += 1
+        self._connections[asyncio.current_task()] = writer
+        write_lock = asyncio.Lock()
+        pending = set()
+        try:
+            while True:
+                try:
+                    request = await read_message(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except ValueError as e:
+                    # can't trust where the next message starts anymore, so this connection is done
+                    log.warning("Dropping inference client: %s", e)
+                    break
+                # every request is its own task, so one client's pipelined requests can share a batch
+                task = asyncio.create_task(self._respond(request, writer, write_lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        finally:
+            self.clients -= 1
+            self._connections.pop(asyncio.current_task(), None)
+            for task in pending:
+                task.cancel()
+            writer.close()
+
+    async def _respond(self, request, writer, write_lock):
+        request_id = request.get('id') if isinstance(request, dict) else None
+        try:
+            response = {'id': request_id, **await self._answer(request)}
+        except Exception as e:
+            self.failed_requests += 1
+            response = {'id': request_id, 'error': f"{type(e).__name__}: {e}"}
+        async with write_lock:  # one message at a time, or two answers could interleave on the stream
+            try:
+                writer.write(encode_message(response))
+                await writer.drain()
+            except ConnectionError:
+                pass  # the client left, nobody to answer
+
+    async def _answer(self, request):
+        op = request.get('op') if isinstance(request, dict) else None
+        if op == 'health':
+            return self.health()
+        if op != 'generate':
+            raise ValueError(f"Unknown op {op!r}")
+        self.requests += 1
+        jobs = parse_jobs(request.get('jobs'))
+        await self._ready.wait()
+        if self.status == 'failed':
+            raise RuntimeError(f"model failed to load: {self.error}")
+        return {'outputs': await self.scheduler.submit_many(jobs)}
+
+
+class InferenceClient:
+    """
+    A bot's connection to the inference server. Connects on first use and again after the server goes away,
+    and multiplexes any number of concurrent requests over the one socket.
+
+    Args:
+        path: the server's socket path
+        timeout_s: how long a request waits for its answer before raising asyncio.TimeoutError
+        connect_timeout_s: how long connecting may take
+    """
+
+    def __init__(self, path, timeout_s=5.0, connect_timeout_s=1.0):
+        self.path = path
+        self.timeout_s = timeout_s
+        self.connect_timeout_s = connect_timeout_s
+        self._ids = itertools.count(1)
+        self._writer = None
+        self._pending = {}  # request id -> future, for the current connection
+        self._reader_task = None
+        self._connect_lock = None
+
+    async def generate(self, jobs):
+        """Outputs for a list of (directive, phrase) jobs, in order. They always run in the same batch on the server."""
+        if not jobs:
+            return []
+        response = await self._request({'op': 'generate', 'jobs': [list(job) for job in jobs]})
+        return response['outputs']
+
+    async def health(self, timeout_s=None):
+        """The server's health dict (status is 'loading', 'ready' or 'failed'). Raises if it can't be reached."""
+        return await self._request({'op': 'health'}, timeout_s)
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()  # the reader task sees the connection end and fails whatever is still pending
+            self._writer = None
+
+    async def _request(self, message, timeout_s=None):
+        writer, pending = await self._connect()
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        pending[request_id] = future
+        try:
+            writer.write(encode_message({'id': request_id, **message}))
+            await writer.drain()
+            response = await asyncio.wait_for(future, timeout_s or self.timeout_s)
+        finally:
+            pending.pop(request_id, None)  # a late answer to a timed out request just gets dropped
+        if 'error' in response:
+            raise InferenceServerError(response['error'])
+        return response
+
+    async def _connect(self):
+        if self._connect_lock is None:
+            # created on first use so it belongs to the loop that's actually running
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.connect_timeout_s)
+                # every connection gets its own pending dict, so an old one dying can't fail requests sent on its replacement
+                self._writer, self._pending = writer, {}
+                self._reader_task = asyncio.create_task(self._read_responses(reader, writer, self._pending))
+            return self._writer, self._pending
+
+    async def _read_responses(self, reader, writer, pending):
+        error = ConnectionError("inference server closed the connection")
+        try:
+            while True:
+                response = await read_message(reader)
+                future = pending.get(response.get('id'))
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            if not isinstance(e, asyncio.IncompleteReadError):
+                error = ConnectionError(f"inference server connection broke: {e}")
+        finally:
+            # whatever was still waiting will never get an answer on this connection
+            writer.close()
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+
+
+def generate_remote(path, jobs, timeout_s=30.0):
+    """Blocking one-off generate against the server at path, for scripts like bot_checking.py."""
+    async def run():
+        client = InferenceClient(path, timeout_s=timeout_s)
+        try:
+            return await client.generate(jobs)
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+
+def build_server(path, rules_only=False):
+    """The server the command line asks for: the real model in an inference pool, or morphology.guess() with --rules-only."""
+    scheduler_options = dict(
+        max_wait_ms=float(os.getenv('INFERENCE_BATCH_WINDOW_MS', '5')),
+        max_batch_size=int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '16')),
+        report_every=int(os.getenv('INFERENCE_REPORT_EVERY', '100')),
+    )
+    if rules_only:
+        return InferenceServer(path, InferenceScheduler(guess_batch, **scheduler_options), description='rules only')
+
+    workers = int(os.getenv('INFERENCE_WORKERS', '1'))
+    max_concurrency = int(os.getenv('INFERENCE_MAX_CONCURRENCY', str(workers)))
+    pool = BlockingPool(
+        'inference',
+        kind=os.getenv('INFERENCE_POOL_KIND', 'thread'),
+        workers=workers,
+        max_concurrency=max_concurrency,
+        initializer=inflection_model.init_worker,
+        initargs=(torch_thread_budget(max_concurrency, os.getenv('TORCH_THREADS_PER_WORKER')),),
+    )
+
+    async def load():
+        # one warm up per worker, so process workers each load their copy before the first bot asks for anything
+        await asyncio.gather(*(pool.run(inflection_model.warm_up) for _ in range(workers)))
+
+    scheduler = InferenceScheduler(inflection_model.generate_batch, executor=pool, **scheduler_options)
+    return InferenceServer(path, scheduler, load=load)
+
+
+async def serve(args):
+    server = build_server(args.socket, args.rules_only)
+    stop = asyncio.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        asyncio.get_running_loop().add_signal_handler(signal_number, stop.set)  # so the socket file gets cleaned up
+    try:
+        await server.start()
+        log.info("Inference server (%s) listening on %s", server.description, args.socket)
+        await stop.wait()
+    finally:
+        await server.close()
+    log.info("Inference server stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared inflection model server for bot processes on this machine.")
+    parser.add_argument('--socket', default=os.getenv('INFLECTION_SERVER') or 'inflection.sock', help="unix socket to listen on")
+    parser.add_argument('--rules-only', action='store_true', help="answer with morphology.guess() instead of loading the model")
+    args = parser.parse_args()
+    setup_logging(os.getenv('INFERENCE_SERVER_LOG', 'inference_server.log'))
+    try:
+        asyncio.run(serve(args))
+    except RuntimeError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
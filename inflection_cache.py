@@ -0,0 +1,233 @@
+import csv
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from bot_logging import get_logger
+
+
+# The same few hundred item names come up over and over in a campaign, so there's no reason to
+# run the model more than once for each of them. This is a two tier cache: a small LRU in memory
+# and a sqlite file on disk so the answers survive restarts.
+# Keys are (directive, normalized phrase). Phrases are normalized the same way pluralize_phrase does it (lowercase).
+
+log = get_logger(__name__)
+
+# Training csvs used to pre-seed the cache, with the directive to assume if the file has no directive column
+SEED_FILES = [
+    ('pluralization_dataset.csv', 'pluralize'),
+    ('singularization_dataset.csv', 'singularize'),
+    ('single_word_irregular.csv', None),
+    ('special_edge_cases.csv', None),
+]
+
+
+def normalize_phrase(phrase):
+    # lowercase and collapse whitespace, so "POTION  OF HEALING " and "potion of healing" share an entry
+    return " ".join(str(phrase).lower().split())
+
+
+class InflectionCache:
+    """
+    In-process LRU in front of an on-disk sqlite store.
+
+    Args:
+        path: sqlite file for the persistent tier. None keeps everything in memory only.
+        max_entries: size bound of the in-memory LRU
+        max_disk_entries: size bound of the on-disk store. Least recently used rows get evicted past this.
+    """
+
+    def __init__(self, path=None, max_entries=2048, max_disk_entries=50000):
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()  # inference can run off the event loop, so guard everything
+        self._clock = 0  # logical clock for disk LRU, cheaper and more stable than wall time
+        self._disk_writes = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS inflections ("
+                "directive TEXT NOT NULL, phrase TEXT NOT NULL, result TEXT NOT NULL, "
+                "last_used INTEGER NOT NULL, PRIMARY KEY (directive, phrase))"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS inflections_last_used ON inflections (last_used)")
+            self._db.execute("CREATE TABLE IF NOT EXISTS seeded_files (name TEXT PRIMARY KEY, mtime REAL NOT NULL)")
+            self._db.commit()
+            row = self._db.execute("SELECT MAX(last_used) FROM inflections").fetchone()
+            self._clock = row[0] or 0
+
+    def get(self, directive, phrase):
+        """Returns the cached inflection (normalized, lowercase) or None on a miss."""
+        key = (directive, normalize_phrase(phrase))
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT result FROM inflections WHERE directive = ? AND phrase = ?", key
+                ).fetchone()
+                if row is not None:
+                    self._clock += 1
+                    self._db.execute(
+                        "UPDATE inflections SET last_used = ? WHERE directive = ? AND phrase = ?",
+                        (self._clock, *key),
+                    )
+                    self._remember(key, row[0])
+                    self.disk_hits += 1
+                    return row[0]
+
+            self.misses += 1
+            return None
+
+    def put(self, directive, phrase, result):
+        """Stores one model answer and everything it implies about the other direction."""
+        phrase = normalize_phrase(phrase)
+        result = normalize_phrase(result)
+        # an unchanged phrase only says it was already in the target form (or never changes, like "fish"),
+        # it doesn't tell us anything about the other form, so only learn the pair when something changed
+        if directive == 'pluralize' and result != phrase:
+            self.learn_pair(phrase, result)
+        elif directive == 'singularize' and result != phrase:
+            self.learn_pair(result, phrase)
+        else:
+            self._store([((directive, phrase), result)])
+
+    def learn_pair(self, singular, plural):
+        """
+        One model call tells us both directions. If "torch" pluralizes to "torches" then
+        "torches" singularizes to "torch", and both words are already in their own form for the other directive.
+        """
+        singular = normalize_phrase(singular)
+        plural = normalize_phrase(plural)
+        self._store([
+            (('pluralize', singular), plural),
+            (('pluralize', plural), plural),
+            (('singularize', plural), singular),
+            (('singularize', singular), singular),
+        ])
+
+    def seed_from_csvs(self, seed_files=SEED_FILES):
+        """
+        Pre-seeds the disk store from the training csvs. Each file is only re-read when it changes,
+        so this is basically free on a normal restart.
+        """
+        for file_name, default_directive in seed_files:
+            if not os.path.exists(file_name):
+                log.warning("Skipping cache seed file %s, not found", file_name)
+                continue
+
+            mtime = os.path.getmtime(file_name)
+            if self._db is not None:
+                with self._lock:
+                    row = self._db.execute("SELECT mtime FROM seeded_files WHERE name = ?", (file_name,)).fetchone()
+                if row is not None and row[0] == mtime:
+                    continue
+
+            pairs = []
+            with open(file_name, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    directive = (row.get('directive') or default_directive or '').strip()
+                    input_text = (row.get('input_text') or '').strip()
+                    output_text = (row.get('output_text') or '').strip()
+                    if not input_text or not output_text:
+                        continue  # the edge case file has blank spacer lines
+                    if directive == 'pluralize':
+                        pairs.append((input_text, output_text))
+                    elif directive == 'singularize':
+                        pairs.append((output_text, input_text))
+
+            entries = []
+            for singular, plural in pairs:
+                singular = normalize_phrase(singular)
+                plural = normalize_phrase(plural)
+                entries.append((('pluralize', singular), plural))
+                entries.append((('singularize', plural), singular))
+            # seeds only go to disk, the LRU fills up from real traffic. Without a disk tier they have nowhere else to go.
+            self._store(entries, memory=self._db is None, overwrite=False)
+
+            if self._db is not None:
+                with self._lock:
+                    self._db.execute("INSERT OR REPLACE INTO seeded_files (name, mtime) VALUES (?, ?)", (file_name, mtime))
+                    self._db.commit()
+            log.info("Seeded inflection cache with %s entries from %s", len(entries), file_name)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            disk_size = 0
+            if self._db is not None:
+                disk_size = self._db.execute("SELECT COUNT(*) FROM inflections").fetchone()[0]
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'memory_size': len(self._memory),
+                'disk_size': disk_size,
+                'evictions': self.evictions,
+                'disk_evictions': self.disk_evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def _remember(self, key, result):
+        # caller holds the lock
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _store(self, entries, memory=True, overwrite=True):
+        with self._lock:
+            if memory:
+                for key, result in entries:
+                    self._remember(key, result)
+
+            if self._db is None:
+                return
+            self._clock += 1
+            verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+            self._db.executemany(
+                f"{verb} INTO inflections (directive, phrase, result, last_used) VALUES (?, ?, ?, ?)",
+                [(directive, phrase, result, self._clock) for (directive, phrase), result in entries],
+            )
+            self._db.commit()
+
+            # checking the size on every write would be a full COUNT each time, so only do it now and then
+            self._disk_writes += len(entries)
+            if self._disk_writes >= 256:
+                self._disk_writes = 0
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # caller holds the lock
+        size = self._db.execute("SELECT COUNT(*) FROM inflections").fetchone()[0]
+        overflow = size - self.max_disk_entries
+        if overflow <= 0:
+            return
+        self._db.execute(
+            "DELETE FROM inflections WHERE rowid IN "
+            "(SELECT rowid FROM inflections ORDER BY last_used ASC LIMIT ?)",
+            (overflow,),
+        )
+        self._db.commit()
+        self.disk_evictions += overflow
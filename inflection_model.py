@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+
+from executor_pools import set_torch_threads
+
+
+# The model lives in its own module so process pool workers can import it without starting the whole bot.
+# Each process loads its own copy the first time it needs it.
+#
+# INFLECTION_BACKEND picks what runs it:
+#   torch - the fine tuned T5 in fp32 PyTorch, like always
+#   onnx  - the int8 quantized encoder / decoder-with-past graphs made by export_onnx.py, run by onnxruntime.
+#           About a quarter of the memory and noticeably faster per token on a small CPU box, see compare_backends.py.
+#
+# INFLECTION_COPY_DECODING=1 (torch only) decodes with copy_decoding.py: the input phrase is used as a draft and verified
+# several tokens per decoder pass. Same outputs as plain greedy generate(), far fewer decoder passes on long phrases.
+#
+# transformers (and so torch) is only imported when a model actually loads, so importing this module is cheap and the
+# bot can connect to Discord before any of it happens.
+
+_model = None
+_tokenizer = None
+_load_lock = threading.Lock()
+_threads = None  # intra-op threads for whichever backend gets loaded, set by init_worker
+_prefix_lengths = {}  # directive -> number of tokens "pluralize:" takes up in front of the phrase
+
+WARM_UP_JOBS = [('pluralize', 'torch'), ('singularize', 'potions of healing')]
+
+
+def model_path():
+    return os.getenv('INFLECTION_MODEL_PATH', 'fine_tuned_t5_complex')
+
+
+def onnx_model_path():
+    return os.getenv('INFLECTION_ONNX_PATH', 'fine_tuned_t5_complex_onnx')
+
+
+def backend():
+    return os.getenv('INFLECTION_BACKEND', 'torch')
+
+
+def copy_decoding_enabled():
+    return os.getenv('INFLECTION_COPY_DECODING', '0') == '1' and backend() == 'torch'
+
+
+def _load_torch():
+    from transformers import T5Tokenizer, T5ForConditionalGeneration
+
+    # Load pre-trained T5-small model and tokenizer.
+    # A model.safetensors file (see convert_safetensors.py) is memory mapped instead of unpickled, which loads a lot faster
+    # and doesn't briefly hold two copies of the weights
+    has_safetensors = os.path.exists(os.path.join(model_path(), 'model.safetensors'))
+    model = T5ForConditionalGeneration.from_pretrained(
+        model_path(),
+        use_safetensors=True if has_safetensors else None,
+        low_cpu_mem_usage=True,
+    )
+    tokenizer = T5Tokenizer.from_pretrained(model_path())
+    model.eval()
+    return model, tokenizer
+
+
+def _load_onnx():
+    # optimum and onnxruntime are only needed for this backend
+    import onnxruntime
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    from transformers import T5Tokenizer
+
+    options = onnxruntime.SessionOptions()
+    options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if _threads:
+        options.intra_op_num_threads = _threads
+        options.inter_op_num_threads = 1
+    model = ORTModelForSeq2SeqLM.from_pretrained(
+        onnx_model_path(),
+        use_cache=True,  # decoder-with-past, so each new token only runs the decoder on that token
+        session_options=options,
+        provider='CPUExecutionProvider',
+    )
+    tokenizer = T5Tokenizer.from_pretrained(onnx_model_path())
+    return model, tokenizer
+
+
+def load_model():
+    """Loads the model and tokenizer for the configured backend once per process and returns (model, tokenizer)."""
+    global _model, _tokenizer
+    with _load_lock:
+        if _model is None:
+            if backend() == 'onnx':
+                _model, _tokenizer = _load_onnx()
+            elif backend() == 'torch':
+                _model, _tokenizer = _load_torch()
+            else:
+                raise ValueError(f"Unknown INFLECTION_BACKEND {backend()!r}, expected 'torch' or 'onnx'")
+    return _model, _tokenizer
+
+
+def init_worker(torch_threads):
+    # initializer for inference pool workers: set the thread budget before torch spins up its pool, then load the model
+    global _threads
+    _threads = torch_threads
+    set_torch_threads(torch_threads)
+    warm_up()
+
+
+def warm_up():
+    """
+    Loads the model if needed and runs a couple of throwaway phrases through it, so the first real request doesn't pay
+    for lazy allocations and kernel selection. Returns the seconds it took.
+    """
+    start = time.perf_counter()
+    load_model()
+    generate_batch(WARM_UP_JOBS)
+    return time.perf_counter() - start
+
+
+def generate_batch(jobs):
+    """
+    Runs a list of (directive, normalized phrase) jobs through the model as one padded batch.
+    Returns the generated text for each job, in order.
+    """
+    model, tokenizer = load_model()
+    input_strings = [f"{directive}: {phrase}" for directive, phrase in jobs]
+    inputs = tokenizer(input_strings, return_tensors="pt", padding=True, truncation=True, max_length=64)
+
+    if copy_decoding_enabled() and _is_greedy(model):
+        import copy_decoding
+
+        phrase_starts = [prefix_length(tokenizer, directive) for directive, _ in jobs]
+        outputs = copy_decoding.generate(model, inputs['input_ids'], inputs['attention_mask'], phrase_starts)
+        return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+    # Generate output. The attention mask matters now, otherwise short phrases would attend to the padding.
+    # Same call for both backends, the ONNX model implements generate() on top of its sessions
+    outputs = model.generate(inputs['input_ids'], attention_mask=inputs['attention_mask'])
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+
+# generation config settings that change the search, add a logits processor or change when decoding stops.
+# copy decoding implements none of them, so any of these away from its default means plain generate()
+_GENERATE_ONLY_SETTINGS = (
+    'num_beams', 'num_beam_groups', 'do_sample', 'penalty_alpha', 'dola_layers', 'guidance_scale',
+    'repetition_penalty', 'encoder_repetition_penalty', 'no_repeat_ngram_size', 'encoder_no_repeat_ngram_size',
+    'min_length', 'min_new_tokens', 'max_new_tokens', 'forced_bos_token_id', 'forced_eos_token_id', 'forced_decoder_ids',
+    'bad_words_ids', 'force_words_ids', 'constraints', 'sequence_bias', 'suppress_tokens', 'begin_suppress_tokens',
+    'exponential_decay_length_penalty', 'stop_strings',
+)
+
+
+def _is_greedy(model):
+    # copy decoding only reproduces plain greedy search, anything fancier in the generation config goes through generate()
+    from transformers import GenerationConfig
+
+    config, defaults = model.generation_config, GenerationConfig()
+    return all(getattr(config, name, None) == getattr(defaults, name, None) for name in _GENERATE_ONLY_SETTINGS)
+
+
+def prefix_length(tokenizer, directive):
+    if directive not in _prefix_lengths:
+        _prefix_lengths[directive] = len(tokenizer(f"{directive}:", add_special_tokens=False)['input_ids'])
+    return _prefix_lengths[directive]
@@ -0,0 +1,231 @@
+import contextvars
+import json
+import threading
+import time
+from collections import defaultdict, deque
+
+from bot_logging import get_logger
+from inference_scheduler import percentile
+
+
+# Per-command and per-stage timings, so when a .add takes two seconds we can tell whether it was firebase, the model, parsing or discord.
+# Usage:
+#     with stats.command('add'):
+#         with stats.stage('db_read'):
+#             ...
+#         stats.count('db_round_trips')
+# Stages recorded inside a command are filed under that command. When disabled, command/stage hand back a shared no-op
+# context manager and count returns right away, so the calls can stay in the hot path.
+
+log = get_logger(__name__)
+
+STAGES = ('db_read', 'db_write', 'inference', 'parse', 'send')
+
+_current_command = contextvars.ContextVar('current_command', default=None)
+
+
+class RollingHistogram:
+    """Keeps the last `size` samples (in seconds) for percentiles, plus lifetime count and total."""
+
+    def __init__(self, size=1000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        samples = list(self.samples)
+        return {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+            'p50_ms': percentile(samples, 50) * 1000,
+            'p95_ms': percentile(samples, 95) * 1000,
+            'p99_ms': percentile(samples, 99) * 1000,
+        }
+
+
+class _Noop:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _Noop()
+
+
+class _CommandRecord:
+    __slots__ = ('name', 'started', 'stages', 'counters')
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.counters = defaultdict(int)
+
+
+class _CommandTimer:
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.record = _CommandRecord(name)
+        self.token = None
+
+    def __enter__(self):
+        self.token = _current_command.set(self.record)
+        return self.record
+
+    def __exit__(self, *exc):
+        _current_command.reset(self.token)
+        self.instrumentation._finish_command(self.record, time.perf_counter() - self.record.started)
+        return False
+
+
+class _StageTimer:
+    def __init__(self, instrumentation, stage):
+        self.instrumentation = instrumentation
+        self.stage = stage
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instrumentation._finish_stage(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+class Instrumentation:
+    """
+    Args:
+        enabled: turns everything on or off
+        history: samples kept per histogram for the percentiles
+        trace_path: if set, every finished command is appended to this file as one JSON line
+    """
+
+    def __init__(self, enabled=True, history=1000, trace_path=None):
+        self.enabled = enabled
+        self.history = history
+        self.trace_path = trace_path
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self._histograms = defaultdict(lambda: RollingHistogram(self.history))  # (command, stage) -> histogram
+        self._counters = defaultdict(lambda: defaultdict(int))  # command -> counter -> lifetime total
+
+    def command(self, name):
+        if not self.enabled:
+            return _NOOP
+        return _CommandTimer(self, name)
+
+    def stage(self, stage):
+        if not self.enabled:
+            return _NOOP
+        return _StageTimer(self, stage)
+
+    def label(self, name):
+        """Renames the command in progress, for handlers that only know what they are after looking at the message."""
+        if not self.enabled:
+            return
+        record = _current_command.get()
+        if record is not None:
+            record.name = name
+
+    def count(self, counter, amount=1):
+        if not self.enabled:
+            return
+        record = _current_command.get()
+        if record is not None:
+            record.counters[counter] += amount
+        else:
+            with self._lock:
+                self._counters['-'][counter] += amount
+
+    def _finish_stage(self, stage, elapsed):
+        record = _current_command.get()
+        if record is not None:
+            record.stages[stage] += elapsed
+        else:
+            # work done outside any command (startup, background tasks)
+            with self._lock:
+                self._histograms[('-', stage)].add(elapsed)
+
+    def _finish_command(self, record, elapsed):
+        with self._lock:
+            self._histograms[(record.name, 'total')].add(elapsed)
+            # a command can hit the same stage several times, the histogram gets the per-command total
+            for stage, stage_time in record.stages.items():
+                self._histograms[(record.name, stage)].add(stage_time)
+            self._counters[record.name]['calls'] += 1
+            for counter, amount in record.counters.items():
+                self._counters[record.name][counter] += amount
+
+        if self.trace_path:
+            line = {
+                'time': time.time(),
+                'command': record.name,
+                'total_ms': elapsed * 1000,
+                'stages_ms': {stage: stage_time * 1000 for stage, stage_time in record.stages.items()},
+                'counters': dict(record.counters),
+            }
+            try:
+                with open(self.trace_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(line) + '\n')
+            except OSError as e:
+                log.warning("Couldn't write stats trace: %s", e)
+
+    def snapshot(self):
+        """Everything recorded so far as {command: {'stages': {stage: summary}, 'counters': {...}}}."""
+        with self._lock:
+            commands = defaultdict(lambda: {'stages': {}, 'counters': {}})
+            for (command, stage), histogram in self._histograms.items():
+                commands[command]['stages'][stage] = histogram.summary()
+            for command, counters in self._counters.items():
+                commands[command]['counters'] = dict(counters)
+                calls = counters.get('calls')
+                if calls:
+                    for counter, amount in counters.items():
+                        if counter != 'calls':
+                            commands[command]['counters'][f'{counter}_per_call'] = amount / calls
+            return dict(commands)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self.started = time.time()
+
+    def dump_jsonl(self, path, extra=None):
+        """Appends one JSON line per (command, stage) histogram, plus one per entry in extra (e.g. cache stats)."""
+        now = time.time()
+        with open(path, 'a', encoding='utf-8') as f:
+            for command, data in self.snapshot().items():
+                for stage, summary in data['stages'].items():
+                    f.write(json.dumps({'time': now, 'command': command, 'stage': stage, **summary}) + '\n')
+                f.write(json.dumps({'time': now, 'command': command, 'counters': data['counters']}) + '\n')
+            for name, value in (extra or {}).items():
+                f.write(json.dumps({'time': now, 'component': name, 'stats': value}) + '\n')
+
+    def format_report(self):
+        """Short plain text table for the .stats command."""
+        if not self.enabled:
+            return "Stats are turned off (BOT_STATS=0)."
+        lines = [f"since {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started))}"]
+        for command, data in sorted(self.snapshot().items()):
+            counters = data['counters']
+            lines.append(
+                f"{command}: {counters.get('calls', 0)} calls, "
+                f"{counters.get('inference_calls_per_call', 0):.2f} inference/call, "
+                f"{counters.get('db_round_trips_per_call', 0):.2f} db trips/call"
+            )
+            for stage in ('total',) + STAGES:
+                summary = data['stages'].get(stage)
+                if summary:
+                    lines.append(
+                        f"  {stage:<9} p50 {summary['p50_ms']:8.1f}ms  p95 {summary['p95_ms']:8.1f}ms  p99 {summary['p99_ms']:8.1f}ms"
+                    )
+        return "\n".join(lines)
@@ -0,0 +1,222 @@
+import asyncio
+import copy
+import random
+
+from bot_logging import get_logger
+
+
+# Every item used to cost a get, maybe a delete, an update and another get just to print the result, all separate firebase round trips.
+# Now each user's inventory is read once and then lives in memory, and a message's edits go out as a single write.
+# With a flush window, rapid-fire edits from several messages get coalesced into that one write as well.
+#
+# Two things keep concurrent edits from losing updates:
+#   - a per-user asyncio lock, so messages for the same player take turns and unrelated players never wait on each other
+#   - the write itself is a compare-and-set on the inventory's ETag. If something outside this process (another bot
+#     instance, a script, the firebase console) changed the inventory since we last saw it, the write is refused and the
+#     message's operations get replayed on the fresh data and retried, up to max_retries times.
+# That's why edits are recorded as operations (apply_add / apply_remove from inventory_layout.py) and not as final values.
+
+log = get_logger(__name__)
+
+
+class TransactionAborted(Exception):
+    """The inventory kept changing under us and the write gave up after max_retries attempts."""
+
+
+class UserInventory:
+    """
+    One user's inventory.
+
+    items is what the bot shows and edits: the last written state (base) with the unwritten operations applied on top.
+    """
+
+    def __init__(self, user_id, items, etag):
+        self.user_id = user_id
+        self.base = items
+        self.etag = etag
+        self.items = copy.deepcopy(items)
+        self.ops = []
+
+    def get(self, key):
+        return self.items.get(key)
+
+    def apply(self, op, *args):
+        """Runs an operation on the in-memory items right away and queues it for the next write. Returns the op's result."""
+        result = op(self.items, *args)
+        self.ops.append((op, args, result))
+        return result
+
+    def checkpoint(self):
+        """Where the queued operations stand, for rollback(). Take it with the user's lock held."""
+        return len(self.ops)
+
+    def rollback(self, checkpoint):
+        """Drops the operations applied since checkpoint, e.g. a message whose write gave up. Needs the user's lock."""
+        del self.ops[checkpoint:]
+        self.rebase(self.base, self.etag)
+
+    def rebase(self, items, etag):
+        # new known database state, with whatever hasn't been written yet replayed on top of it
+        self.base = items
+        self.etag = etag
+        self.items = copy.deepcopy(items)
+        for op, args, _ in self.ops:
+            op(self.items, *args)
+
+
+class InventoryCache:
+    """
+    Args:
+        load: async function(user_id) returning (inventory dict, etag) from the database
+        write_if_unchanged: async function(user_id, etag, items) that writes the whole inventory only if its ETag still
+            matches. Returns (success, current items, current etag), same as firebase_admin's set_if_unchanged.
+        flush_window_ms: 0 writes at the end of every message. Anything higher waits that long after the first
+            unwritten edit so later edits can ride along in the same write.
+        max_retries: how many times a conflicting write gets replayed before giving up
+        retry_backoff_ms: base for the randomized exponential wait between retries, so two writers that keep colliding
+            drift apart instead of colliding again on the very next round trip
+    """
+
+    def __init__(self, load, write_if_unchanged, flush_window_ms=0, max_retries=5, retry_backoff_ms=5):
+        self.load = load
+        self.write_if_unchanged = write_if_unchanged
+        self.flush_window = flush_window_ms / 1000
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self._inventories = {}
+        self._locks = {}
+        self._loading = {}  # user_id -> future, so two messages for a new user only load it once
+        self._scheduled = {}  # user_id -> pending delayed flush task
+
+        self.loads = 0
+        self.writes = 0
+        self.conflicts = 0  # writes refused because the ETag had moved
+        self.aborts = 0  # flushes that ran out of retries
+        self.changed_results = 0  # ops that came out differently once replayed on fresh data
+        self.coalesced = 0  # commits that rode along on a flush somebody else already scheduled
+
+    def lock(self, user_id):
+        """Per-user lock. Hold it from the first look at the inventory until commit() returns."""
+        user_id = str(user_id)
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def get(self, user_id):
+        user_id = str(user_id)
+        inventory = self._inventories.get(user_id)
+        if inventory is not None:
+            return inventory
+
+        if user_id in self._loading:
+            return await asyncio.shield(self._loading[user_id])
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        try:
+            items, etag = await self.load(user_id)
+            inventory = UserInventory(user_id, dict(items or {}), etag)
+            self._inventories[user_id] = inventory
+            self.loads += 1
+            future.set_result(inventory)
+            return inventory
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # nobody else might be waiting on it, don't let asyncio complain
+            raise
+        finally:
+            del self._loading[user_id]
+
+    def forget(self, user_id):
+        """For when the whole user node gets overwritten elsewhere, like .initme. Drops anything unwritten."""
+        user_id = str(user_id)
+        self._cancel_scheduled(user_id)
+        self._inventories.pop(user_id, None)
+
+    async def commit(self, user_id):
+        """Call once a message is done editing, still holding the user's lock. Writes now, or schedules the write."""
+        user_id = str(user_id)
+        if self.flush_window <= 0:
+            await self.flush(user_id)
+            return
+        if user_id in self._scheduled:
+            self.coalesced += 1
+            return
+        self._scheduled[user_id] = asyncio.get_running_loop().create_task(self._delayed_flush(user_id))
+
+    async def flush(self, user_id):
+        """Writes the queued operations with compare-and-set, replaying them on fresh data after a conflict. Needs the user's lock."""
+        user_id = str(user_id)
+        inventory = self._inventories.get(user_id)
+        if inventory is None or not inventory.ops:
+            return
+
+        ops, inventory.ops = inventory.ops, []
+        base, etag = inventory.base, inventory.etag
+        try:
+            for attempt in range(self.max_retries + 1):
+                new_items = copy.deepcopy(base)
+                results = [op(new_items, *args) for op, args, _ in ops]
+
+                success, current, current_etag = await self.write_if_unchanged(user_id, etag, new_items)
+                if success:
+                    self.writes += 1
+                    # the bot already replied with the optimistic results. Worth knowing how often a replay changed
+                    # one, e.g. a remove that worked in memory but found nothing left to remove in the fresh data
+                    self.changed_results += sum(1 for (_, _, result), new in zip(ops, results) if result != new)
+                    inventory.rebase(new_items, current_etag)
+                    return
+
+                # somebody else wrote first, their version is the new base
+                self.conflicts += 1
+                base, etag = dict(current or {}), current_etag
+                if attempt < self.max_retries:
+                    await asyncio.sleep(random.uniform(0, self.retry_backoff * 2 ** min(attempt, 6)))
+
+            self.aborts += 1
+            raise TransactionAborted(f"gave up after {self.max_retries} retries")
+        except Exception as e:
+            # put the operations back in front of anything newer so the next flush retries them, on the freshest data we saw
+            log.warning("Error writing inventory, will retry on next flush: %s", e, user_id=user_id)
+            inventory.ops = ops + inventory.ops
+            inventory.rebase(base, etag)
+            raise
+
+    async def flush_all(self):
+        for user_id in list(self._scheduled):
+            self._cancel_scheduled(user_id)
+        for user_id in list(self._inventories):
+            try:
+                async with self.lock(user_id):
+                    await self.flush(user_id)
+            except Exception:
+                pass  # already logged, keep flushing everybody else
+
+    def stats(self):
+        return {
+            'users_cached': len(self._inventories),
+            'loads': self.loads,
+            'writes': self.writes,
+            'conflicts': self.conflicts,
+            'aborts': self.aborts,
+            'changed_results': self.changed_results,
+            'coalesced_commits': self.coalesced,
+            'pending_users': sum(1 for inventory in self._inventories.values() if inventory.ops),
+        }
+
+    async def _delayed_flush(self, user_id):
+        try:
+            await asyncio.sleep(self.flush_window)
+            del self._scheduled[user_id]
+            async with self.lock(user_id):
+                await self.flush(user_id)
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            pass  # flush logs it and keeps the operations queued
+
+    def _cancel_scheduled(self, user_id):
+        task = self._scheduled.pop(user_id, None)
+        if task is not None:
+            task.cancel()
@@ -0,0 +1,139 @@
+from inflection_cache import normalize_phrase
+
+
+# Inventories are keyed by a canonical form of the item: the lowercased singular.
+# The surface forms and the quantity are fields on the item, so finding an item is one dict lookup, and going from 1 to 2 of
+# something is just a field update instead of deleting the singular key and re-creating the item under the plural one.
+#
+#     inventory/
+#         torch: {'singular': 'TORCH', 'plural': 'TORCHES', 'display': 'TORCHES', 'quantity': 3}
+#
+# Older inventories used the surface form itself as the key ({'TORCHES': {'quantity': 3}}), migrate_inventory.py converts them.
+#
+# An item added while the model was unavailable gets its forms from morphology.guess(), which can be wrong (STATUS -> STATU),
+# so its key can be too. Those entries carry 'guessed': True, and the next time the item comes up with real forms
+# apply_rekey moves them under the right key.
+
+# characters firebase won't take in a key, plus % since it's the escape character
+_FORBIDDEN_KEY_CHARS = set('.$#[]/%')
+
+
+def canonical_key(singular_name):
+    """Database key for an item, from its singular form. Forbidden characters are percent-encoded, so J.R.R. still works."""
+    normalized = normalize_phrase(singular_name)
+    return "".join(
+        f"%{ord(char):02X}" if char in _FORBIDDEN_KEY_CHARS or ord(char) < 32 or ord(char) == 127 else char
+        for char in normalized
+    )
+
+
+def display_form(singular_name, plural_name, quantity):
+    return plural_name if quantity > 1 else singular_name
+
+
+def inventory_entry(singular_name, plural_name, quantity, extra=None):
+    """A full item entry. extra keeps any other fields the item already had."""
+    return {
+        **(extra or {}),
+        'singular': singular_name,
+        'plural': plural_name,
+        'display': display_form(singular_name, plural_name, quantity),
+        'quantity': quantity,
+    }
+
+
+def entry_display(key, item_data):
+    # legacy entries don't have a display field, their key was the display form
+    return item_data.get('display', key)
+
+
+def is_legacy_entry(item_data):
+    return 'singular' not in item_data
+
+
+def migrate_items(items, forms):
+    """
+    Converts one user's old-layout inventory to the canonical layout.
+
+    Args:
+        items: the inventory dict as it is in the database
+        forms: dict mapping each legacy key to its (singular, plural) pair
+
+    Returns:
+        The new inventory dict. Entries that were stored under both their singular and plural key get merged.
+    """
+    migrated = {}
+    for key, item_data in items.items():
+        if not is_legacy_entry(item_data):
+            migrated[key] = item_data
+            continue
+
+        singular_name, plural_name = forms[key]
+        new_key = canonical_key(singular_name)
+        extra = {field: value for field, value in item_data.items() if field != 'quantity'}
+        quantity = item_data.get('quantity', 0)
+        if new_key in migrated:
+            quantity += migrated[new_key]['quantity']
+            extra = {**migrated[new_key], **extra}
+        migrated[new_key] = inventory_entry(singular_name, plural_name, quantity, extra)
+    return migrated
+
+
+# The two inventory operations, as pure functions over an items dict. They're kept free of any I/O so a write that lost
+# an optimistic-concurrency race can simply replay them on top of the fresh data, see inventory_cache.py.
+
+def apply_add(items, singular_name, plural_name, quantity_to_add, guessed=False):
+    """
+    Adds to items in place. Returns the name to use in the reply (plural or singular to match quantity_to_add).
+    guessed marks a new entry whose forms came from morphology.guess(), see apply_rekey.
+    """
+    key = canonical_key(singular_name)
+    item_data = items.get(key)
+    if item_data is None:
+        items[key] = inventory_entry(singular_name, plural_name, quantity_to_add, {'guessed': True} if guessed else None)
+    else:
+        # going from 1 to more than 1 just changes the display field, the key stays put
+        new_quantity = item_data['quantity'] + quantity_to_add
+        items[key] = {**item_data, 'quantity': new_quantity, 'display': display_form(singular_name, plural_name, new_quantity)}
+    return display_form(singular_name, plural_name, quantity_to_add)
+
+
+def apply_remove(items, singular_name, plural_name, quantity_to_remove):
+    """Removes from items in place. Returns the name for the reply, or False if there weren't enough to remove."""
+    key = canonical_key(singular_name)
+    item_data = items.get(key)
+    if item_data is None or item_data['quantity'] < quantity_to_remove:
+        return False
+
+    new_quantity = item_data['quantity'] - quantity_to_remove
+    if new_quantity == 0:
+        del items[key]
+    else:
+        items[key] = {**item_data, 'quantity': new_quantity, 'display': display_form(singular_name, plural_name, new_quantity)}
+    return display_form(singular_name, plural_name, quantity_to_remove)
+
+
+def apply_rekey(items, singular_name, plural_name, guess_keys):
+    """
+    Moves guessed entries under the key the real forms give, adding up the quantities. In place, returns how many moved.
+
+    Args:
+        singular_name, plural_name: the item's forms from the cache, the rules or the model
+        guess_keys: keys morphology.guess() could have given the same item
+    """
+    key = canonical_key(singular_name)
+    moved = 0
+    for guess_key in guess_keys:
+        item_data = items.get(guess_key)
+        if guess_key == key or item_data is None or not item_data.get('guessed'):
+            continue
+        del items[guess_key]
+        current = items.get(key, {})
+        extra = {field: value for field, value in {**item_data, **current}.items() if field != 'guessed'}
+        items[key] = inventory_entry(singular_name, plural_name, item_data['quantity'] + current.get('quantity', 0), extra)
+        moved += 1
+    if items.get(key, {}).get('guessed'):
+        # the guess got the key right, just not necessarily the forms
+        extra = {field: value for field, value in items[key].items() if field != 'guessed'}
+        items[key] = inventory_entry(singular_name, plural_name, items[key]['quantity'], extra)
+    return moved
@@ -1,98 +1,176 @@
-import logging
+import asyncio
 import re
 import os
+import time
 import discord
 from dotenv import load_dotenv
-from firebase_admin import credentials, initialize_app, storage, db
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+from bot_logging import add_context, get_logger, message_context, setup_logging
+from firebase_admin import credentials, initialize_app, storage
+from inflection_cache import InflectionCache, normalize_phrase
+from inference_scheduler import InferenceScheduler
+from inference_server import InferenceClient
+from executor_pools import BlockingPool, torch_thread_budget
+from display_name_index import DisplayNameIndex
+from storage import backend as storage_backend, storage_from_env
+from name_matcher import CachedNameMatcher, NameMatch
+from inventory_cache import InventoryCache, TransactionAborted
+from item_parser import parse_items
+from inventory_layout import apply_add, apply_remove, apply_rekey, canonical_key, entry_display
+from instrumentation import Instrumentation
+import inflection_model
+import morphology
 
 
 
-# Load pre-trained T5-small model and tokenizer
-model = T5ForConditionalGeneration.from_pretrained('fine_tuned_t5_complex')
-tokenizer = T5Tokenizer.from_pretrained('fine_tuned_t5_complex')
 load_dotenv() #loads the environment variables
 
-def get_all_display_names():
-    ref = db.reference('users')
-    users_snapshot = ref.get()
-    
-    # Create a dictionary mapping display_names to user_ids
-    display_name_to_id = {}
-    
-    if users_snapshot:
-        for user_id, user_data in users_snapshot.items():
-            if 'display_name' in user_data:
-                display_name_to_id[user_data['display_name']] = user_id
-    
-    return display_name_to_id
+#everything goes to discord.log through a queue (see bot_logging.py). LOG_LEVEL=DEBUG for the per item details, or LOG_TRACE_USERS/LOG_TRACE_CHANNELS/LOG_TRACE_SAMPLE
+#to get them for just some messages. Debug arguments are never even formatted unless the line gets written.
+log = get_logger('inventory_with_llm')
+
+#torch and firebase_admin both block, so they run in pools instead of on the discord event loop.
+#INFERENCE_POOL_KIND can be 'thread' or 'process'. Each worker gets cores // concurrency torch threads unless TORCH_THREADS_PER_WORKER says otherwise.
+INFERENCE_POOL_KIND = os.getenv('INFERENCE_POOL_KIND', 'thread')
+INFERENCE_WORKERS = int(os.getenv('INFERENCE_WORKERS', '1'))
+INFERENCE_MAX_CONCURRENCY = int(os.getenv('INFERENCE_MAX_CONCURRENCY', str(INFERENCE_WORKERS)))
+INFERENCE_THREADS_PER_WORKER = torch_thread_budget(INFERENCE_MAX_CONCURRENCY, os.getenv('TORCH_THREADS_PER_WORKER'))
+inference_pool = BlockingPool(
+    'inference',
+    kind=INFERENCE_POOL_KIND,
+    workers=INFERENCE_WORKERS,
+    max_concurrency=INFERENCE_MAX_CONCURRENCY,
+    initializer=inflection_model.init_worker,
+    initargs=(INFERENCE_THREADS_PER_WORKER,),
+)
+db_pool = BlockingPool(
+    'firebase',
+    workers=int(os.getenv('DB_WORKERS', '8')),
+    max_concurrency=int(os.getenv('DB_MAX_CONCURRENCY', '8')),
+)
+
+#model answers are cached in memory and on disk, pre-seeded from the training data (in the main block, once logging is set up).
+#Set INFLECTION_CACHE_PATH to empty to keep it memory only.
+inflection_cache = InflectionCache(
+    path=os.getenv('INFLECTION_CACHE_PATH', 'inflection_cache.sqlite3') or None,
+    max_entries=int(os.getenv('INFLECTION_CACHE_SIZE', '2048')),
+    max_disk_entries=int(os.getenv('INFLECTION_CACHE_DISK_SIZE', '50000')),
+)
+
+#regular items (SWORD, TORCH, POTION OF HEALING) get inflected by the rules in morphology.py in microseconds, only what they aren't sure about goes to the model.
+#The cache still goes first so items the model already answered keep the same forms (and the same inventory keys). INFLECTION_RULES=0 turns the rules off.
+INFLECTION_RULES = os.getenv('INFLECTION_RULES', '1') == '1'
+
+
+def known_inflection(directive, normalized_phrase):
+    #cache, then rules. None means only the model can answer it
+    cached = inflection_cache.get(directive, normalized_phrase)
+    if cached is not None or not INFLECTION_RULES:
+        return cached
+    ruled = morphology.inflect(directive, normalized_phrase)
+    if ruled is not None:
+        stats.count('rules_hits')
+    return ruled
+
+#per command stage timings for the .stats command. BOT_STATS=0 turns it off, STATS_TRACE_PATH logs every command as a json line.
+#.stats is only for the user ids in BOT_ADMIN_IDS (comma separated).
+stats = Instrumentation(
+    enabled=os.getenv('BOT_STATS', '1') == '1',
+    trace_path=os.getenv('STATS_TRACE_PATH') or None,
+)
+STATS_DUMP_PATH = os.getenv('STATS_DUMP_PATH', 'stats.jsonl')
+BOT_ADMIN_IDS = {admin_id.strip() for admin_id in os.getenv('BOT_ADMIN_IDS', '').split(',') if admin_id.strip()}
+
+
+#users and inventories go through user_storage, firebase or a local sqlite file depending on STORAGE_BACKEND (see storage.py).
+#Created in the main block, once firebase is initialized if that's the one.
+user_storage = None
+
+
+#async wrappers for the storage calls, so a slow round trip only holds up the command that made it
+async def db_read(fn, *args):
+    stats.count('db_round_trips')
+    with stats.stage('db_read'):
+        return await db_pool.run(fn, *args)
+
+
+async def db_write(fn, *args):
+    stats.count('db_round_trips')
+    with stats.stage('db_write'):
+        return await db_pool.run(fn, *args)
+
+
+#each user's inventory is read once and kept in memory, every message's edits go out as one conditional write.
+#The write only lands if the inventory's ETag hasn't moved, otherwise the message's edits get replayed on the fresh data, up to INVENTORY_MAX_RETRIES times.
+#INVENTORY_FLUSH_WINDOW_MS > 0 holds the write that long so rapid-fire edits share it, at the price of losing that window's edits if the bot crashes.
+async def load_inventory(user_id):
+    return await db_read(user_storage.load_inventory, str(user_id))
+
+
+async def write_inventory_if_unchanged(user_id, etag, items):
+    success, current, current_etag = await db_write(user_storage.write_inventory_if_unchanged, str(user_id), etag, items)
+    if not success:
+        stats.count('db_write_conflicts')
+    return success, current, current_etag
+
+
+inventory_cache = InventoryCache(
+    load_inventory,
+    write_inventory_if_unchanged,
+    flush_window_ms=float(os.getenv('INVENTORY_FLUSH_WINDOW_MS', '0')),
+    max_retries=int(os.getenv('INVENTORY_MAX_RETRIES', '5')),
+)
+
+
+async def commit_message(user_id, user_inventory, checkpoint):
+    #one write for the message's edits. If it runs out of retries they're dropped again, so the bot can say it didn't work and mean it
+    try:
+        await inventory_cache.commit(user_id)
+    except TransactionAborted:
+        user_inventory.rollback(checkpoint)
+        stats.count('aborted_writes')
+        raise
+
+
+INVENTORY_BUSY = "your inventory kept changing while I was saving it. Nothing was changed, try again."
+
+
+async def send(channel, content):
+    with stats.stage('send'):
+        return await channel.send(content)
+
+
+#display_name -> user_id lookups come from memory, see display_name_index.py. Created once firebase is initialized in the main block.
+#name_matcher finds "<display name> GAINS/LOSES" in a message and only gets rebuilt when the names change.
+display_name_index = None
+name_matcher = None
 
 
 
 #given the chance to build this entire thing again, I'd probably go full LLM with it, instead of the weird combination of LLM and regex I have right now.
 #It probably wouldn't be the most difficult thing in the world to hook this up to a larger gpt model that can just translate natural dm language into inventory actions. I'm sure somebody has done it by now.
 #On the bright side, this way is cheaper, the pluralization bot was a good first project, and it feels natural enough for me and my friends.
-def parse_natural_language(message_content: str, display_names: dict[str, str]):
+def parse_natural_language(message_content: str, name_match: NameMatch):
     """
     Parse natural language gain/lose messages with multiple items.
     
     Args:
         message_content: The message text to parse
-        display_names: Dictionary mapping user_ids to display_names
+        name_match: The "<display name> gains/loses" match the name matcher found in message_content
     
     Returns:
         Tuple of (user_id, list of (quantity, item_name) tuples) or (None, None) if no match
     """
-
-    print("all display names", display_names)
-    # Pattern to match a display name followed by an inventory action verb. Can easily add or change what those verbs are
-    display_pattern = r"\b(" + "|".join(re.escape(name) for name in display_names) + r")\s+(?:gains|GAINS|loses|LOSES)"
-
-    
-    # Check if we have a valid display name match
-    name_match = re.search(display_pattern, message_content)
-    if not name_match:
+    if name_match is None or not name_match.user_id:
         return None, None
-    
-    # Extract the display name
-    display_name = name_match.group(1).strip()
-    print("Display name:", display_name)
-    
-    # Find user_id from display_name. the display names are the keys actually and the ids the values. If anybody who wants to hire me is looking at this i promise I won't do shit this stupid when somebody's paying me.
-    user_id = display_names.get(display_name)
+    user_id = name_match.user_id
 
-    if not user_id:
-        return None, None
-    print("User ID:", user_id)
-    # Get everything after "GAINS"
-    gains_text = message_content.split(name_match.group(0), 1)[1].strip()
-    print("gains text:", gains_text)
+    # Get everything after "GAINS". The matcher already knows where that is, no need to search for it again
+    gains_text = message_content[name_match.end:].strip()
+    log.debug("DM message for %s (user %s), gains text %r", name_match.display_name, user_id, gains_text)
 
-    
-    # Define pattern for terminal characters
-    # Periods are external if followed by:
-    # 1. A lowercase letter
-    # 2. A space and then a lowercase letter
-    # 3. A space, a capital letter, and then a lowercase letter
-    # 4. A space, a capital letter, a space, and then a lowercase letter
-    terminal_pattern = r'(?:,\s*(?:and\s+)?|\.(?:\s*[a-z]|\s+[A-Z][a-z]|\s+[A-Z]\s+[a-z])|\s+and\s+|(?:\s+(?:for|as|but|though|although|while|when|if|because|since|after|before|during|from|with|by|to|at|in|on|of|that|which|who|whom|whose|where|how|why|what)\b)|$)'
-    
-    # Pattern to find quantities and items (allow periods within item names)
-    # Periods are internal if not matched by the terminal pattern
-    item_pattern = r'(?:(\d+)\s+)?([A-Z][A-Z\s\.]*?(?=' + terminal_pattern + '))'
-    # Find all matches
-    items = []
-    item_matches = re.finditer(item_pattern, gains_text)
-    
-    for match in item_matches:
-        quantity = match.group(1)
-        item_name = match.group(2).strip()
-        
-        # Default quantity to 1 if not specified
-        if not quantity:
-            quantity = "1"
-        
-        items.append((int(quantity), item_name))
+    # quantities, a/an, comma and "and" lists, S.T.A.R.S. style periods and trailing clauses, see item_parser.py.
+    # One pass over the text, so a long all caps message can't stall the event loop the way the old regex could
+    items = parse_items(gains_text)
     
     return user_id, items
 
@@ -118,175 +196,315 @@ def parse_item_string(input_string):
     
     return quantity, item_name
 
-def case_insensitive_get(inventory, key):
-    for item_key in inventory:
-        if item_key.lower() == key.lower():
-            return item_key, inventory[item_key]  # Return the actual key and the data
-    return None, None
-
 
 
 #I only tuned my model on lowercase data, and it was having trouble with the all caps items. It pluralizes and singularlizes normalized text now, and items are always uppercase. Sorry if you don't like uppercase items. Thank god I do I think they are neat.
-def pluralize_phrase(phrase):
-    # Normalize input to lowercase
-    normalized_phrase = phrase.lower()
-    
-    # Prepare input string for the model
-    input_string = f"{'pluralize'}: {normalized_phrase}"
-    inputs = tokenizer(input_string, return_tensors="pt", padding=True, truncation=True, max_length=64)
-    
-    # Generate output
-    outputs = model.generate(inputs['input_ids'])
-    generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    
-    # Convert output to all caps
-    return generated_text.upper()
+inference_scheduler = InferenceScheduler(
+    inflection_model.generate_batch,
+    executor=inference_pool,
+    max_wait_ms=float(os.getenv('INFERENCE_BATCH_WINDOW_MS', '5')),
+    max_batch_size=int(os.getenv('INFERENCE_MAX_BATCH_SIZE', '16')),
+    report_every=int(os.getenv('INFERENCE_REPORT_EVERY', '100')),
+)
+
+#the model loads in the background once the bot starts (see setup_hook), so the bot is online in a second or two and
+#.help/.inventory/.initme never wait on it. Anything that needs the model while it's still loading waits up to
+#INFLECTION_MODEL_WAIT_S, then gets morphology.guess()'s best effort answer instead. Guesses aren't cached, and items added with a guessed
+#singular are marked so they move to the right inventory key once the real forms are known (see apply_rekey in inventory_layout.py).
+INFLECTION_MODEL_WAIT_S = float(os.getenv('INFLECTION_MODEL_WAIT_S', '10'))
+model_ready = None  #future, set once every inference worker has loaded and warmed up the model
+model_loader = None
+
+#INFLECTION_SERVER=<unix socket path> sends inflections to a shared inference_server.py instead of loading the model here, so any number of bots
+#(or shards) on one machine share one copy of it. inference_pool and inference_scheduler then sit unused, the server batches across every bot.
+#A request that takes longer than INFLECTION_SERVER_TIMEOUT_S, or a server that's down, gets morphology.guess() like a model that's still loading.
+#That includes a server that isn't up yet when the bot starts: nothing waits on it while it's unreachable, the bot keeps checking and uses it once it answers.
+#The server's health is checked every INFLECTION_SERVER_HEALTH_S and shows up in .stats.
+INFLECTION_SERVER = os.getenv('INFLECTION_SERVER') or None
+INFLECTION_SERVER_HEALTH_S = float(os.getenv('INFLECTION_SERVER_HEALTH_S', '5'))
+inference_client = InferenceClient(INFLECTION_SERVER, timeout_s=float(os.getenv('INFLECTION_SERVER_TIMEOUT_S', '5'))) if INFLECTION_SERVER else None
+inference_server_health = None  #last health check answer, or {'status': 'unreachable', ...}
+health_monitor = None
+
+
+async def load_inflection_model():
+    if inference_client is not None:
+        return await wait_for_inference_server()
+    start = time.perf_counter()
+    try:
+        #one warm up per worker, so process workers each load their copy now rather than on someone's .add
+        await asyncio.gather(*(inference_pool.run(inflection_model.warm_up) for _ in range(INFERENCE_WORKERS)))
+    except Exception as e:
+        log.error("Failed to load the inflection model, using rule based guesses from now on: %s", e)
+        model_ready.set_exception(e)
+        return
+    log.info("Inflection model (%s) ready after %.1fs", inflection_model.backend(), time.perf_counter() - start)
+    model_ready.set_result(True)
 
 
-def singularize_phrase(phrase):
-    # Normalize input to lowercase
-    normalized_phrase = phrase.lower()
-    
-    # Prepare input string for the model
-    input_string = f"{'singularize'}: {normalized_phrase}"
-    inputs = tokenizer(input_string, return_tensors="pt", padding=True, truncation=True, max_length=64)
-    
-    # Generate output
-    outputs = model.generate(inputs['input_ids'])
-    generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    
-    # Convert output to all caps
-    return generated_text.upper()
+async def check_inference_server():
+    global inference_server_health
+    try:
+        inference_server_health = await inference_client.health(timeout_s=INFLECTION_SERVER_HEALTH_S)
+    except Exception as e:
+        inference_server_health = {'status': 'unreachable', 'error': repr(e)}
+    return inference_server_health
+
+
+async def wait_for_inference_server():
+    #the server may still be starting, or loading its model. Polls until it's ready or says it failed. run_model doesn't wait on this while the server is unreachable
+    start = time.perf_counter()
+    reported = None
+    while True:
+        health = await check_inference_server()
+        if health['status'] == 'ready':
+            log.info("Inflection server at %s (%s) ready after %.1fs", INFLECTION_SERVER, health['backend'], time.perf_counter() - start)
+            model_ready.set_result(True)
+            return
+        if health['status'] == 'failed':
+            log.error("Inflection server at %s failed to load the model, using rule based guesses from now on: %s", INFLECTION_SERVER, health['load_error'])
+            model_ready.set_exception(RuntimeError(health['load_error']))
+            return
+        if health['status'] != reported:
+            log.info("Waiting on the inflection server at %s: %s", INFLECTION_SERVER, health['status'])
+            reported = health['status']
+        await asyncio.sleep(0.5)
+
+
+async def monitor_inference_server():
+    while True:
+        await asyncio.sleep(INFLECTION_SERVER_HEALTH_S)
+        previous = inference_server_health['status'] if inference_server_health else None
+        health = await check_inference_server()
+        if health['status'] != previous:
+            log.warning("Inflection server at %s is now %s", INFLECTION_SERVER, health['status'])
+
 
+def inference_server_unreachable():
+    return inference_client is not None and inference_server_health is not None and inference_server_health['status'] == 'unreachable'
+
+
+async def run_model(jobs):
+    """
+    Inflects (directive, normalized phrase) jobs with the model, or with morphology.guess() if the model isn't loaded
+    within INFLECTION_MODEL_WAIT_S (or failed to load, or the inflection server is unreachable, or inference fails).
+    Returns (the outputs in order, whether they're guesses).
+    """
+    if model_ready is not None and not model_ready.done() and not inference_server_unreachable():
+        with stats.stage('model_wait'):
+            try:
+                await asyncio.wait_for(asyncio.shield(model_ready), INFLECTION_MODEL_WAIT_S)
+            except Exception:
+                pass  #timed out or failed, either way it's the fallback
+    if model_ready is None or not model_ready.done() or model_ready.exception() is not None:
+        stats.count('fallback_jobs', len(jobs))
+        return [morphology.guess(directive, phrase) for directive, phrase in jobs], True
 
-def add_item_to_inventory(item_name, quantity_to_add, user_ref):
     try:
-        # Retrieve current inventory from the database
-        inventory = user_ref.child('inventory').get() or {}
-        
-        # Get the plural form of the item name
-        plural_name = pluralize_phrase(item_name)
-        item_name = singularize_phrase(item_name)
+        with stats.stage('inference'):
+            if inference_client is not None:
+                outputs = await inference_client.generate(jobs)
+            else:
+                outputs = await inference_scheduler.submit_many(jobs)
+    except Exception as e:
+        #a server that's gone, or a local pool that broke (a worker died, init_worker raised): guess rather than leave the command without a reply
+        log.warning("Inflection %s failed, guessing with rules: %r", 'server request' if inference_client is not None else 'model', e)
+        stats.count('server_failures' if inference_client is not None else 'inference_failures')
+        stats.count('fallback_jobs', len(jobs))
+        return [morphology.guess(directive, phrase) for directive, phrase in jobs], True
+    for job, generated_text in zip(jobs, outputs):
+        inflection_cache.put(*job, generated_text)  #also fills in the other direction for free
+    return outputs, False
 
-        # Try to get the item using either singular or plural form, and agnostic to case
-        # Try to get the item (agnostic to case) and retrieve both key and data
-        actual_key, item_data = case_insensitive_get(inventory, item_name)
-        if not actual_key:
-            actual_key, item_data = case_insensitive_get(inventory, plural_name)
 
+#the model only sees the head noun of a phrase whose structure the rules understand (morphology.decompose): "potion" out of "potion of greater healing".
+#The rest of the phrase goes back around its answer untouched, so inputs are a word long and every phrase with that head shares its cache entries.
+#Phrases with clauses or agreement ("blade that cleaves the dusk", "severed hand still wearing its ring"), or an invariant head ("fish in the tank",
+#see morphology.inflects_by_head), still go whole. INFLECTION_HEAD_ONLY=0 sends everything whole.
+INFLECTION_HEAD_ONLY = os.getenv('INFLECTION_HEAD_ONLY', '1') == '1'
 
-        #if there's no item, just add the thing in the quantity        
-        if item_data is None:
-            print(f"Neither {item_name} nor {plural_name} found in inventory.")
-            actual_key = plural_name if quantity_to_add > 1 else item_name
-            
-            user_ref.child('inventory').child(actual_key).set({
-                'quantity': quantity_to_add
-            })
 
-            print(f"Successfully added {quantity_to_add} {actual_key}")
-            print(f"Current inventory: {user_ref.child('inventory').get()}")
-            return actual_key  # Return the actual key for correct messaging
-            
+async def model_inflections(jobs):
+    """
+    Answers for (directive, normalized phrase) jobs the cache and the rules couldn't answer, in order, with one model call.
+    A decomposable phrase only sends its head word, and not even that when the cache or the rules know the word by itself.
+    Returns (answers, the set of jobs whose answer is a morphology.guess() of the whole phrase).
+    """
+    answers = {}
+    heads = {}  #job -> (before, head, after)
+    model_jobs = []
+    for job in jobs:
+        directive, phrase = job
+        parts = morphology.decompose(phrase) if INFLECTION_HEAD_ONLY else None
+        if parts is None or parts[1] == phrase or not morphology.inflects_by_head(parts):
+            model_job = job
+        else:
+            heads[job] = parts
+            model_job = (directive, parts[1])
+            known = known_inflection(*model_job)
+            if known is not None:
+                stats.count('head_hits')
+                answers[model_job] = known
+                continue
+            stats.count('head_jobs')
+        if model_job not in model_jobs:
+            model_jobs.append(model_job)
+
+    guessed = set()
+    if model_jobs:
+        # every job goes in as one group, so the scheduler runs them all in the same batch
+        stats.count('inference_calls')
+        stats.count('inference_jobs', len(model_jobs))
+        outputs, guesses = await run_model(model_jobs)
+        answers.update(zip(model_jobs, outputs))
+        if guesses:
+            guessed.update(model_jobs)
+
+    outputs = []
+    guessed_jobs = set()
+    for job in jobs:
+        model_job = (job[0], heads[job][1]) if job in heads else job
+        if model_job in guessed:
+            #guessed whole, never head-only, so the same name always guesses the same key (see guess_keys)
+            outputs.append(morphology.guess(*job))
+            guessed_jobs.add(job)
+        elif job in heads:
+            before, head, after = heads[job]
+            outputs.append(morphology.join(before, normalize_phrase(answers[model_job]) or head, after))
+        else:
+            outputs.append(answers[job])
+    return outputs, guessed_jobs
 
-        # Calculate new quantity
-        new_quantity = item_data['quantity'] + quantity_to_add
 
-        
-       # Handle pluralization if quantity exceeds 1 (which it will by logic if the item already exists)
-        if new_quantity > 1 and actual_key == item_name:
-            # Remove the singular entry and add pluralized version
-            user_ref.child('inventory').child(actual_key).delete()
-            actual_key = plural_name
-            print(f"Converted {item_name} to plural form {actual_key} due to quantity.")
-
-        # Update the item with the new quantity
-        user_ref.child('inventory').child(actual_key).update({
-            'quantity': new_quantity
-        })
+async def inflect_phrase(directive, phrase):
+    # Normalize input to lowercase
+    normalized_phrase = normalize_phrase(phrase)
+
+    cached = known_inflection(directive, normalized_phrase)
+    if cached is not None:
+        return cached.upper()
+
+    # waits for a batch slot alongside whatever else is being inflected right now
+    (generated_text,), _ = await model_inflections([(directive, normalized_phrase)])
+
+    # Convert output to all caps
+    return generated_text.upper()
+
+
+async def pluralize_phrase(phrase):
+    return await inflect_phrase('pluralize', phrase)
+
 
+async def singularize_phrase(phrase):
+    return await inflect_phrase('singularize', phrase)
 
-        print(f"Successfully added {quantity_to_add} {item_name}")
-        print(f"Current inventory: {user_ref.child('inventory').get()}")
-        return item_name #item name is returned so message sent in parent functionhas correct plural or singular form
+
+async def inflect_items(item_names):
+    """
+    Gets both inflections for every item in a message with (at most) one model forward pass.
+    Returns a list of (singular, plural, guessed) tuples in the same order as item_names. guessed is True when the singular,
+    so the inventory key, is only morphology.guess()'s best effort.
+    """
+    normalized_names = [normalize_phrase(item_name) for item_name in item_names]
+    results = {}
+    missing = []
+    for normalized_name in normalized_names:
+        for directive in ('singularize', 'pluralize'):
+            job = (directive, normalized_name)
+            if job in results or job in missing:
+                continue
+            cached = known_inflection(*job)
+            if cached is None:
+                missing.append(job)
+            else:
+                results[job] = cached
+
+    guessed = set()
+    if missing:
+        outputs, guessed = await model_inflections(missing)
+        for job, generated_text in zip(missing, outputs):
+            results[job] = generated_text
+
+    return [
+        (
+            results[('singularize', normalized_name)].upper(),
+            results[('pluralize', normalized_name)].upper(),
+            ('singularize', normalized_name) in guessed,
+        )
+        for normalized_name in normalized_names
+    ]
+
+
+def guess_keys(item_name, singular_name, plural_name):
+    #every key morphology.guess() could have filed this item under while the model was unavailable, whichever form the player typed
+    return {canonical_key(morphology.guess('singularize', normalize_phrase(name))) for name in (item_name, singular_name, plural_name)}
+
+
+def rekey_guessed(item_name, user_inventory, forms):
+    #real forms for an item that may have been added with guessed ones: move those entries under the right key first
+    singular_name, plural_name, guessed = forms
+    if guessed:
+        return
+    keys = guess_keys(item_name, singular_name, plural_name)
+    if any((user_inventory.get(key) or {}).get('guessed') for key in keys):
+        moved = user_inventory.apply(apply_rekey, singular_name, plural_name, keys)
+        stats.count('rekeyed_items', moved)
+
+
+#forms is the (singular, plural, guessed) triple from inflect_items, worked out for the whole message before any of these run.
+#user_inventory comes from inventory_cache, these only change it in memory. The caller commits once the whole message is done.
+#The actual edits are apply_add/apply_remove in inventory_layout.py, recorded as operations so a conflicting write can replay them.
+def add_item_to_inventory(item_name, quantity_to_add, user_inventory, forms):
+    try:
+        singular_name, plural_name, guessed = forms
+        rekey_guessed(item_name, user_inventory, forms)
+        if user_inventory.get(canonical_key(singular_name)) is None:
+            log.debug("%s not found in inventory, adding it", singular_name)
+
+        formatted_name = user_inventory.apply(apply_add, singular_name, plural_name, quantity_to_add, guessed)
+        log.debug("Added %s %s, inventory now %s", quantity_to_add, singular_name, user_inventory.items)
+        return formatted_name #name is returned so message sent in parent function has correct plural or singular form
         
     except Exception as e:
-        print(f"Error updating inventory: {e}")
+        log.exception("Error updating inventory")
         return False
 
 
 
 
-def remove_item_from_inventory(item_name, quantity_to_remove, user_ref):
+def remove_item_from_inventory(item_name, quantity_to_remove, user_inventory, forms):
     try:
-        # Retrieve current inventory from the database
-        inventory = user_ref.child('inventory').get() or {}
-
         # Get the plural and singular forms of the item name
-        plural_name = pluralize_phrase(item_name)
-        singular_name = singularize_phrase(item_name)
-
-        # Try to get the item using either singular or plural form (returns actual key and data)
-        actual_key, item_data = case_insensitive_get(inventory, singular_name)
-        if not actual_key:
-            actual_key, item_data = case_insensitive_get(inventory, plural_name)
+        singular_name, plural_name, _ = forms
+        rekey_guessed(item_name, user_inventory, forms)
+        item_data = user_inventory.get(canonical_key(singular_name))
 
         if item_data is None:
-            print(f"Neither {singular_name} nor {plural_name} found in inventory.")
+            log.debug("%s not found in inventory", singular_name)
             return False
 
         # Check if enough items are available to remove
         if item_data['quantity'] < quantity_to_remove:
-            print(f"Not enough items to remove. Current quantity: {item_data['quantity']}")
+            log.debug("Not enough %s to remove %s, only have %s", singular_name, quantity_to_remove, item_data['quantity'])
             return False
 
-        # Calculate new quantity after removal
-        new_quantity = item_data['quantity'] - quantity_to_remove
-
-        if new_quantity == 0:
-            user_ref.child('inventory').child(actual_key).delete()
-            print(f"Removed all {actual_key}. Item deleted from inventory.")
-            return True
-
-        # If only one item is left and the current key is plural, change to singular
-        if new_quantity == 1 and actual_key == plural_name:
-            # Delete plural entry and create singular entry
-            user_ref.child('inventory').child(actual_key).delete()
-            user_ref.child('inventory').child(singular_name).set({
-                'quantity': new_quantity,
-                **{k: v for k, v in item_data.items() if k != 'quantity'}
-            })
-            print(f"Reduced {plural_name} to a single {singular_name}.")
-        else:
-            # Update the quantity under the existing key
-            user_ref.child('inventory').child(actual_key).update({'quantity': new_quantity})
-            print(f"Updated {actual_key}: New quantity is {new_quantity}.")
-        #item name is returned so message sent in parent functionhas correct plural or singular form
-        if quantity_to_remove == 1: 
-            return item_name 
-        else:
-            return plural_name
+        #name is returned so message sent in parent function has correct plural or singular form
+        formatted_name = user_inventory.apply(apply_remove, singular_name, plural_name, quantity_to_remove)
+        log.debug("Removed %s %s, inventory now %s", quantity_to_remove, singular_name, user_inventory.items)
+        return formatted_name
 
     except Exception as e:
-        print(f"An error occurred: {e}")
+        log.exception("Error removing from inventory")
         return False
 
 
 
 
-private_key_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
-cred = credentials.Certificate(private_key_path)
-initialize_app(cred, {
-    'storageBucket': 'dylans-discord-bot.appspot.com',
-    'databaseURL': 'https://dylans-discord-bot-default-rtdb.firebaseio.com/'  # Ensure this is correct
-    })
-bucket = storage.bucket()       #creates the cloud storage bucket
 
 
 
 
 
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
 intents = discord.Intents.default()
 intents.message_content = True
 
@@ -297,136 +515,177 @@ client = discord.Client(intents=intents)
 
 
 
+@client.event
+async def setup_hook():
+    #runs once before connecting. The load goes on in the background while the bot logs in
+    global model_ready, model_loader, health_monitor
+    model_ready = asyncio.get_running_loop().create_future()
+    model_loader = asyncio.create_task(load_inflection_model())
+    if inference_client is not None:
+        health_monitor = asyncio.create_task(monitor_inference_server())
+
+
 @client.event
 async def on_ready():
-    print(f'We have logged in as {client.user}')
+    log.info("We have logged in as %s", client.user)
+    if not display_name_index.loaded:  #on_ready fires again after reconnects, only load the first time
+        await db_pool.run(display_name_index.load)
+        if os.getenv('DISPLAY_NAME_LISTENER', '1') == '1':
+            display_name_index.start_listener()
+
+
+#the commands, in the order on_message checks them. Anything else counts as 'chat' until the DM check relabels it.
+COMMANDS = ('help', 'inventory', 'initme', 'add', 'remove', 'stats')
+
+
+def command_name(content):
+    for command in COMMANDS:
+        if re.search(f'^.{command}', content) is not None:
+            return command
+    return 'chat'
+
+
+def model_status():
+    if model_ready is None or not model_ready.done():
+        return "loading"
+    if model_ready.exception() is not None:
+        return f"failed ({model_ready.exception()}), guessing with rules"
+    if inference_client is not None:
+        health = inference_server_health or {}
+        if health.get('status') != 'ready':
+            return f"server {health.get('status')} ({health.get('error') or health.get('load_error')}), guessing with rules"
+        return f"ready ({health['backend']} on {INFLECTION_SERVER}, {health['clients']} bots, {health['rss_mb']:.0f}MB)"
+    return f"ready ({inflection_model.backend()})"
+
+
+async def send_stats(message):
+    if str(message.author.id) not in BOT_ADMIN_IDS:
+        return
+    if message.content.strip().endswith('dump'):
+        stats.dump_jsonl(STATS_DUMP_PATH, extra={
+            'inflection_cache': inflection_cache.stats(),
+            'inference_scheduler': inference_scheduler.stats(),
+            'inference_server': inference_server_health,
+            'inventory_cache': inventory_cache.stats(),
+        })
+        await send(message.channel, f"Stats written to {STATS_DUMP_PATH}")
+        return
+    if message.content.strip().endswith('reset'):
+        stats.reset()
+        await send(message.channel, "Stats reset.")
+        return
+
+    #with a shared server the batching happens over there
+    scheduler_stats = inference_server_health['scheduler'] if inference_server_health and 'scheduler' in inference_server_health else inference_scheduler.stats()
+    cache_stats = inflection_cache.stats()
+    inventory_stats = inventory_cache.stats()
+    report = (
+        stats.format_report()
+        + f"\ninflection cache: {cache_stats['hit_rate']:.1%} hit rate, {cache_stats['memory_size']} in memory, {cache_stats['disk_size']} on disk"
+        + f"\nscheduler: {scheduler_stats['batches']} batches, {scheduler_stats['mean_batch_size']:.2f} jobs/batch, wait p95 {scheduler_stats['wait_ms']['p95']:.1f}ms"
+        + f"\ninventory: {inventory_stats['writes']} writes, {inventory_stats['conflicts']} conflicts, {inventory_stats['aborts']} aborted"
+        + f"\nmodel: {model_status()}"
+    )
+    await send(message.channel, f"```\n{report[:1900]}\n```")  #discord caps messages at 2000 characters
 
 
 @client.event
 
 async def on_message(message):
-    display_names=get_all_display_names() #makes sure display names dict is up to date before doing anything
     if message.author == client.user:  #of course, don't respond to your own messages. thats dumb.
         return
-    
+    command = command_name(message.content)
+    with stats.command(command), message_context(message.author.id, message.channel.id, command=command):
+        await handle_message(message)
+
+
+async def handle_message(message):
+    #Called upon for stats, admins only
+    if re.search('^.stats', message.content) is not None:
+        await send_stats(message)
+        return
+
     #Called upon for help
     if re.search('^.help', message.content) is not None:
-        await message.channel.send("Hi. If you haven't yet, type .initme to init your folder. Then, type .add to add an item to your inventory.")
+        await send(message.channel, "Hi. If you haven't yet, type .initme to init your folder. Then, type .add to add an item to your inventory.")
 
     #Called upon for inventory
     if re.search('^.inventory', message.content) is not None:
-        inventory_ref=db.reference('users').child(str(message.author.id)).child('inventory')
-        inventory=inventory_ref.get()
-        if inventory is None:
-            await message.channel.send("You have no items in your inventory.")
+        inventory=(await inventory_cache.get(message.author.id)).items
+        if not inventory:
+            await send(message.channel, "You have no items in your inventory.")
         else:
             inventory_string=""
             for item in inventory:
-                inventory_string+=f"{item}: {inventory[item]['quantity']}\n"
-            await message.channel.send(inventory_string)
+                inventory_string+=f"{entry_display(item, inventory[item])}: {inventory[item]['quantity']}\n"
+            await send(message.channel, inventory_string)
 
 
     #Called upon for init
     if re.search('^.initme', message.content) is not None: #this inits a new user for the inventory system. It adds a display name to the dictionry, so they can be identified by that as well.
-        print("initme called")
         display_name = message.content.split(".initme ", 1)[1].strip()
         new_username=message.author.name
         new_user_id=message.author.id
-        print("got user data")
+        log.debug("Registering %s as %r", new_username, display_name)
 
 
         try:
-            ref = db.reference('users')
-            print(f"Reference: {ref}")
+            await db_write(user_storage.register_user, str(new_user_id), new_username, display_name)
+            display_name_index.set_user(str(new_user_id), display_name) #so the DM can use the new name right away
+            inventory_cache.forget(new_user_id) #next read picks up the fresh node and its ETag
         except Exception as e:
-            print(f"Error creating reference: {e}")
+            log.exception("Error setting user data")
 
-
-        try:
-            user_ref=ref.child(str(new_user_id)) #refers to the user's node in the database
-            print(f"child ref: {user_ref}")
-            
-        except Exception as e:
-            print(f"Error creating child: {e}")
-
-
-        try:
-            user_ref.set({
-            'username':new_username,
-            'display_name':display_name,
-            'inventory':{}
-            })
-        except Exception as e:
-            print(f"Error setting user data: {e}")
-
-        await message.channel.send(f"Inventory system initialized for {new_username}!")
+        await send(message.channel, f"Inventory system initialized for {new_username}!")
 
 
     #called upon to add an item
     if re.search('^.add', message.content) is not None:  #if .add is called upon, respond. This function is used when the player themselves adds something
         user_id = message.author.id
         addition_string = message.content.split(".add ", 1)[1].strip()
-        item_quantity, item_name = parse_item_string(addition_string)
-        print(f"Addition string: {addition_string}")
-        print(f"Item quantity: {item_quantity}")
-        print(f"Item name: {item_name}")
-        try:
-            ref = db.reference('users') #goes to users
-            print(f"Reference: {ref}")
-        except Exception as e:
-            print(f"Error creating reference: {e}")
-
-
-        try:
-            user_ref=ref.child(str(user_id)) #refers to the user's node in the database
-            print(f"child ref: {user_ref}")
-            
-        except Exception as e:
-            print(f"Error creating child: {e}")
-
-
+        with stats.stage('parse'):
+            item_quantity, item_name = parse_item_string(addition_string)
+        log.debug("Add %r: %s x %s", addition_string, item_quantity, item_name)
         try:
-            item_name=add_item_to_inventory(item_name,item_quantity,user_ref) #add to inventory also returns the name with the correct pluralization, so message can be sent in async parent function
+            forms=(await inflect_items([item_name]))[0]
+            async with inventory_cache.lock(user_id): #one message at a time per user, from reading the inventory to writing it
+                user_inventory=await inventory_cache.get(user_id) #the user's inventory, straight from memory after the first time
+                checkpoint=user_inventory.checkpoint()
+                item_name=add_item_to_inventory(item_name,item_quantity,user_inventory,forms) #add to inventory also returns the name with the correct pluralization, so message can be sent in async parent function
+                await commit_message(user_id,user_inventory,checkpoint)
 
             
+        except TransactionAborted:
+            await send(message.channel, f"Couldn't add {item_quantity} {item_name}, {INVENTORY_BUSY}")
+            return
         except Exception as e:
-            print(f"Error adding item {e}")
+            log.exception("Error adding item")
 
-        await message.channel.send(f"Successfully added {item_quantity} {item_name}")
+        await send(message.channel, f"Successfully added {item_quantity} {item_name}")
         return
     
 
     if re.search('^.remove', message.content) is not None:  #This deletes an item, or multiple
         user_id = message.author.id
         deletion_string = message.content.split(".remove ", 1)[1].strip()
-        item_quantity, item_name = parse_item_string(deletion_string)
-        print(f"Deletion string: {deletion_string}")
-        print(f"Item quantity to delete: {item_quantity}")
-        print(f"Item name: {item_name}")
-
+        with stats.stage('parse'):
+            item_quantity, item_name = parse_item_string(deletion_string)
+        log.debug("Remove %r: %s x %s", deletion_string, item_quantity, item_name)
         try:
-            ref = db.reference('users') #goes to users
-            print(f"Reference: {ref}")
-        except Exception as e:
-            print(f"Error creating reference: {e}")
+            forms=(await inflect_items([item_name]))[0]
+            async with inventory_cache.lock(user_id):
+                user_inventory=await inventory_cache.get(user_id)
+                checkpoint=user_inventory.checkpoint()
+                remove_item_from_inventory(item_name,item_quantity,user_inventory,forms)
+                await commit_message(user_id,user_inventory,checkpoint)
+            await send(message.channel, f"Successfully removed {item_quantity} {item_name}.")
 
 
-        try:
-            user_ref=ref.child(str(user_id)) #refers to the user's node in the database
-            print(f"child ref: {user_ref}")
             
+        except TransactionAborted:
+            await send(message.channel, f"Couldn't remove {item_quantity} {item_name}, {INVENTORY_BUSY}")
         except Exception as e:
-            print(f"Error creating child: {e}")
-
-
-        try:
-            remove_item_from_inventory(item_name,item_quantity,user_ref)
-            await message.channel.send(f"Successfully removed {item_quantity} {item_name}.")
-
-
-            
-        except Exception as e:
-            print(f"Error removing item {e}")
+            log.exception("Error removing item")
         return
 
 
@@ -435,23 +694,33 @@ async def on_message(message):
     #the following functions are equivalent to the above add and remove, but are controlled by a third party, probably the DM. It's really a matter of preference whether you want to use one or the other or both of these systems.
     # It uses display names and regex as identifiers.
     #I would just hook the entire thing up to a cloud llm for this kind of stuff, but I'm stingy and this way works fine.
+    with stats.stage('parse'):
+        name_match = name_matcher.search(message.content) #one pass finds the name and whether it's a gain or a loss
 
-
-    if re.search(r"\b(" + "|".join(re.escape(name) for name in display_names.keys()) + r")\sGAINS|gains", message.content) is not None:
+    if name_match is not None and name_match.action == 'gain':
         
-        print("dm_add_regex called")
-        user_id, items = parse_natural_language(message.content, display_names) #uses the regex function above to produce a clean list of items
+        stats.label('dm_' + name_match.action)
+        add_context(command='dm_' + name_match.action)
+        with stats.stage('parse'):
+            user_id, items = parse_natural_language(message.content, name_match) #uses the parser above to produce a clean list of items
         if not user_id or not items:
             return  # No valid gains found
-        # Reference to the user in the database
-        ref = db.reference('users')
-        user_ref = ref.child(str(user_id))
-        # Process each item
+        # Inflect every item in one go, before taking the user's lock so it's held as briefly as possible
+        all_forms = await inflect_items([item_name for _, item_name in items])
         response_parts = []
-        for quantity, item_name in items:
-            # Add to inventory 
-            formatted_name = add_item_to_inventory(item_name, quantity, user_ref)
-            response_parts.append(f"{quantity} {formatted_name}")
+        try:
+            async with inventory_cache.lock(user_id):
+                # The user's inventory, from memory after the first time
+                user_inventory = await inventory_cache.get(user_id)
+                checkpoint = user_inventory.checkpoint()
+                for (quantity, item_name), forms in zip(items, all_forms):
+                    # Add to inventory 
+                    formatted_name = add_item_to_inventory(item_name, quantity, user_inventory, forms)
+                    response_parts.append(f"{quantity} {formatted_name}")
+                await commit_message(user_id, user_inventory, checkpoint) #one write for every item in the message
+        except TransactionAborted:
+            await send(message.channel, f"Couldn't add those items, {INVENTORY_BUSY}")
+            return
         
         # Create a natural language response
         if len(response_parts) == 1:
@@ -462,24 +731,33 @@ async def on_message(message):
             last_item = response_parts.pop()
             response = f"Successfully added {', '.join(response_parts)}, and {last_item}"
         
-        await message.channel.send(response)
+        await send(message.channel, response)
 
 
-    if re.search(r"\b(" + "|".join(re.escape(name) for name in display_names.keys()) + r")\sLOSES|loses", message.content) is not None:#equivalent function for removing items
+    if name_match is not None and name_match.action == 'lose':#equivalent function for removing items
         
-        print("dm_add_regex called")
-        user_id, items = parse_natural_language(message.content, display_names) #uses the regex function above to produce a clean list of items
+        stats.label('dm_' + name_match.action)
+        add_context(command='dm_' + name_match.action)
+        with stats.stage('parse'):
+            user_id, items = parse_natural_language(message.content, name_match) #uses the parser above to produce a clean list of items
         if not user_id or not items:
             return  # No valid gains found
-        # Reference to the user in the database
-        ref = db.reference('users')
-        user_ref = ref.child(str(user_id))
-        # Process each item
+        # Inflect every item in one go, before taking the user's lock so it's held as briefly as possible
+        all_forms = await inflect_items([item_name for _, item_name in items])
         response_parts = []
-        for quantity, item_name in items:
-            # Add to inventory 
-            formatted_name = remove_item_from_inventory(item_name, quantity, user_ref)
-            response_parts.append(f"{quantity} {formatted_name}")
+        try:
+            async with inventory_cache.lock(user_id):
+                # The user's inventory, from memory after the first time
+                user_inventory = await inventory_cache.get(user_id)
+                checkpoint = user_inventory.checkpoint()
+                for (quantity, item_name), forms in zip(items, all_forms):
+                    # Remove from inventory 
+                    formatted_name = remove_item_from_inventory(item_name, quantity, user_inventory, forms)
+                    response_parts.append(f"{quantity} {formatted_name}")
+                await commit_message(user_id, user_inventory, checkpoint) #one write for every item in the message
+        except TransactionAborted:
+            await send(message.channel, f"Couldn't remove those items, {INVENTORY_BUSY}")
+            return
         
         # Create a natural language response
         if len(response_parts) == 1:
@@ -490,7 +768,7 @@ async def on_message(message):
             last_item = response_parts.pop()
             response = f"Successfully removed {', '.join(response_parts)}, and {last_item}"
         
-        await message.channel.send(response)
+        await send(message.channel, response)
 
 
 
@@ -525,11 +803,11 @@ async def on_message(message):
             file_name = first_file.filename
             print("check check cehck")
             if re.search('mp3$',file_name) is None:  #only mp3 files get in
-                await message.channel.send("Only takes mp3 files at this time")
+                await send(message.channel, "Only takes mp3 files at this time")
                 return
             print("mp3 status checked")
             if first_file.size > 5000000:
-                await message.channel.send("please upload shorter files I'm begging you")
+                await send(message.channel, "please upload shorter files I'm begging you")
                 return
             print("file length checked")
             print("saving file")
@@ -543,13 +821,30 @@ async def on_message(message):
             blob.upload_from_filename(file_to_upload) 
             blob.make_public() #This gives public access from the URL.
             print("your file url", blob.public_url) #and this prints the link in the console
-            await message.channel.send("file saved to database as " + file_name)
+            await send(message.channel, "file saved to database as " + file_name)
             
  """
 
 
-DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
-client.run(DISCORD_TOKEN,log_handler=handler)
+#process pool workers re-import this file when they spawn, so only the real bot process gets to connect to anything
+if __name__ == "__main__":
+    setup_logging('discord.log')  #here and not at import, so load_test.py doesn't wipe the log
+    inflection_cache.seed_from_csvs()
+    if storage_backend() == 'firebase':  #STORAGE_BACKEND=sqlite runs without firebase at all
+        private_key_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+        cred = credentials.Certificate(private_key_path)
+        initialize_app(cred, {
+            'storageBucket': 'dylans-discord-bot.appspot.com',
+            'databaseURL': 'https://dylans-discord-bot-default-rtdb.firebaseio.com/'  # Ensure this is correct
+            })
+        bucket = storage.bucket()       #creates the cloud storage bucket
+    user_storage = storage_from_env()
+    log.info("Storing users in %s", storage_backend())
+    display_name_index = DisplayNameIndex(user_storage)
+    name_matcher = CachedNameMatcher(display_name_index)
+
+    DISCORD_TOKEN = os.getenv('DISCORD_TOKEN')
+    client.run(DISCORD_TOKEN,log_handler=None)  #discord.py's logs already go through setup_logging's queue
 
 
 
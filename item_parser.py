@@ -0,0 +1,125 @@
+import string
+
+from bot_logging import get_logger
+
+
+# Pulls (quantity, ITEM NAME) pairs out of the text after "<name> gains/loses" in a DM message, e.g.
+#   "3 HEALING POTIONS, a ROPE and the S.T.A.R.S. BADGE. you feel lighter"
+#   -> [(3, 'HEALING POTIONS'), (1, 'ROPE'), (1, 'S.T.A.R.S. BADGE')]
+# Same answers as the regex parse_natural_language used to run:
+#   (?:(\d+)\s+)?([A-Z][A-Z\s\.]*?(?=<terminal>))
+# but in one left to right pass. That regex retried the terminal lookahead at every character of every candidate start,
+# so a long all caps message with no terminal in it (DM narration, someone holding shift) took quadratic time.
+# Here every position is looked at a bounded number of times, so the cost is linear in the message length.
+#
+# The grammar, same as before:
+#   item      = [quantity whitespace] UPPERCASE-LETTER {UPPERCASE-LETTER | whitespace | "."}   (shortest that reaches a terminal)
+#   terminal  = "," | "." followed by lowercase text | whitespace "and" whitespace | whitespace clause-word | end of text
+#   where "lowercase text" is a lowercase letter, or one or two capitalized words leading into lowercase
+#   ("... BADGE. You", "... BADGE. I think"), so the periods in S.T.A.R.S. stay part of the name.
+# Anything else (a, an, the, lowercase narration) is skipped over between items.
+
+CLAUSE_WORDS = frozenset({
+    'for', 'as', 'but', 'though', 'although', 'while', 'when', 'if', 'because', 'since', 'after', 'before', 'during',
+    'from', 'with', 'by', 'to', 'at', 'in', 'on', 'of', 'that', 'which', 'who', 'whom', 'whose', 'where', 'how', 'why',
+    'what',
+})
+_LONGEST_CLAUSE_WORD = max(len(word) for word in CLAUSE_WORDS)
+_UPPER = frozenset(string.ascii_uppercase)
+_LOWER = frozenset(string.ascii_lowercase)
+
+# Discord caps messages at 4000 characters (with nitro), anything longer didn't come from a message
+MAX_TEXT_LENGTH = 4000
+
+log = get_logger(__name__)
+
+
+def _is_word_char(char):
+    # what \w matches
+    return char.isalnum() or char == '_'
+
+
+class _Text:
+    """The message plus where each whitespace run ends, so every terminal check is a constant number of lookups."""
+
+    def __init__(self, text):
+        self.text = text
+        self.length = len(text)
+        # skip[i]: first index >= i that isn't whitespace (length if there is none)
+        skip = [self.length] * (self.length + 1)
+        for i in range(self.length - 1, -1, -1):
+            skip[i] = skip[i + 1] if text[i].isspace() else i
+        self.skip = skip
+
+    def char(self, i):
+        return self.text[i] if i < self.length else ''
+
+    def is_terminal(self, i):
+        """Whether an item can end right before index i."""
+        text, char = self.text, self.char(i)
+        if i == self.length or (i == self.length - 1 and char == '\n'):  # $ also matches before a final newline
+            return True
+        if char == ',':
+            return True
+        if char == '.':
+            after = self.skip[i + 1]
+            if self.char(after) in _LOWER:
+                return True
+            if after > i + 1 and self.char(after) in _UPPER:
+                following = self.char(after + 1)
+                if following in _LOWER:
+                    return True
+                if following.isspace() and self.char(self.skip[after + 1]) in _LOWER:
+                    return True
+            return False
+        if char.isspace():
+            word_start = self.skip[i]
+            word_end = word_start
+            while word_end < self.length and word_end - word_start <= _LONGEST_CLAUSE_WORD and _is_word_char(text[word_end]):
+                word_end += 1
+            word = text[word_start:word_end]
+            if word == 'and':
+                return self.char(word_end).isspace()
+            return word in CLAUSE_WORDS
+        return False
+
+
+def _in_name(char):
+    return char in _UPPER or char == '.' or char.isspace()
+
+
+def parse_items(text, max_length=MAX_TEXT_LENGTH):
+    """
+    Returns the list of (quantity, item name) pairs in text, in order. Item names are stripped, quantities default to 1.
+    Text longer than max_length gives no items at all rather than a guess from part of it.
+    """
+    if len(text) > max_length:
+        log.warning("Not parsing items from a %d character message, the limit is %d", len(text), max_length)
+        return []
+    scan = _Text(text)
+    items = []
+    position = 0
+    while position < scan.length:
+        start = position
+        quantity = None
+        digits_end = position
+        while digits_end < scan.length and text[digits_end].isdecimal():
+            digits_end += 1
+        if digits_end > position and scan.char(digits_end).isspace():
+            quantity = text[position:digits_end]
+            start = scan.skip[digits_end]
+
+        if scan.char(start) not in _UPPER:
+            # nothing starts here. Past a number, none of its later digits can start anything either
+            position = max(digits_end, position + 1)
+            continue
+
+        end = start + 1
+        while not scan.is_terminal(end) and end < scan.length and _in_name(text[end]):
+            end += 1
+        if scan.is_terminal(end):
+            items.append((int(quantity) if quantity else 1, text[start:end].strip()))
+        # on a match the next item can start right where this one ended. Without one, every start before end runs into
+        # the same non-name character with no terminal on the way, so they can all be skipped
+        position = end
+    return items
@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+
+from bench_morphology import read_rows
+from bot_logging import setup_logging
+from inference_scheduler import percentile
+
+
+# Load test for the bot's message handler, no Discord and no real database involved.
+# Simulated players send .add / .remove / .inventory and a DM narrates "<Name> GAINS ..." / "<Name> LOSES ...", all through
+# on_message exactly like real messages, with fake channels and authors. Storage is fake_firebase (with --latency-ms per call)
+# or a temporary sqlite file. For each arrival rate it reports:
+#   - throughput: messages finished per second
+#   - latency percentiles from when a message "arrives" to when its handler is done, queueing included,
+#     so the rate where p99 runs away is the bot's capacity
+#   - event loop lag: how late a 10ms timer fires, i.e. how long something blocked the loop (heartbeats stall past a few seconds)
+# Inflection comes from the rules plus morphology.guess() unless --model loads the real one (needs torch).
+# Run with: python load_test.py --rates 50,100,200,400 --messages 2000 --latency-ms 20
+#           python load_test.py --save-corpus corpus.jsonl   then   python load_test.py --corpus corpus.jsonl
+
+DEFAULT_MIX = 'add=0.3,remove=0.15,inventory=0.2,gains=0.25,loses=0.1'
+ITEM_FILES = ['single_word.csv', 'two_to_three_words.csv']
+LAG_INTERVAL_S = 0.01
+
+
+class FakeAuthor:
+    def __init__(self, user_id, name):
+        self.id = user_id
+        self.name = name
+
+
+class FakeChannel:
+    """Stands in for a discord channel, send() just counts (after send_latency_ms, like a real API call)."""
+
+    def __init__(self, send_latency_ms=0):
+        self.id = 1
+        self.send_latency_ms = send_latency_ms
+        self.sent = 0
+
+    async def send(self, content):
+        if self.send_latency_ms:
+            await asyncio.sleep(self.send_latency_ms / 1000)
+        self.sent += 1
+
+
+class FakeMessage:
+    def __init__(self, author, content, channel):
+        self.author = author
+        self.content = content
+        self.channel = channel
+        self.attachments = []
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+def player(index):
+    return 1000 + index, f"player{index}", f"Player{index}"
+
+
+def make_corpus(count, players, mix, seed):
+    """[{author, content}], a mix of player commands and DM narration over items from the training csvs."""
+    rng = random.Random(seed)
+    items = sorted({phrase.upper() for path in ITEM_FILES for directive, phrase, _ in read_rows(path) if directive == 'singularize'})
+    kinds, weights = list(mix), list(mix.values())
+    dm_id = 999
+
+    def item_phrase():
+        quantity = rng.randint(1, 5)
+        name = rng.choice(items)
+        return f"{quantity} {name}" if quantity > 1 or rng.random() < 0.5 else f"a {name}"
+
+    corpus = []
+    for _ in range(count):
+        kind = rng.choices(kinds, weights)[0]
+        user_id, _, display_name = player(rng.randrange(players))
+        if kind == 'add':
+            corpus.append({'author': user_id, 'content': f".add {rng.randint(1, 5)} {rng.choice(items)}"})
+        elif kind == 'remove':
+            corpus.append({'author': user_id, 'content': f".remove 1 {rng.choice(items)}"})
+        elif kind == 'inventory':
+            corpus.append({'author': user_id, 'content': ".inventory"})
+        else:
+            phrases = [item_phrase() for _ in range(rng.randint(1, 3))]
+            listed = phrases[0] if len(phrases) == 1 else ", ".join(phrases[:-1]) + " and " + phrases[-1]
+            verb = 'GAINS' if kind == 'gains' else 'LOSES'
+            corpus.append({'author': dm_id, 'content': f"{display_name} {verb} {listed}. the party cheers"})
+    return corpus
+
+
+def summarize(values):
+    if not values:
+        return {'p50_ms': 0, 'p95_ms': 0, 'p99_ms': 0, 'max_ms': 0}
+    return {
+        'p50_ms': percentile(values, 50) * 1000,
+        'p95_ms': percentile(values, 95) * 1000,
+        'p99_ms': percentile(values, 99) * 1000,
+        'max_ms': max(values) * 1000,
+    }
+
+
+async def watch_loop_lag(samples, stop):
+    # a timer that should fire every 10ms, anything past that is time the loop was busy with something else
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + LAG_INTERVAL_S
+        await asyncio.sleep(LAG_INTERVAL_S)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def run_phase(bot, corpus, rate, concurrency, channel, authors, seed):
+    """Replays corpus at rate messages/s (0: as fast as concurrency allows). Returns the phase's results."""
+    rng = random.Random(seed)
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], []
+    lag_samples = []
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(watch_loop_lag(lag_samples, stop))
+
+    async def handle(entry, arrival):
+        async with semaphore:
+            try:
+                await bot.on_message(FakeMessage(authors[entry['author']], entry['content'], channel))
+            except Exception as e:
+                errors.append(repr(e))
+        latencies.append(loop.time() - arrival)
+
+    replies_before = channel.sent
+    start = loop.time()
+    arrival = start
+    tasks = []
+    for entry in corpus:
+        if rate > 0:
+            arrival += rng.expovariate(rate)  # poisson arrivals
+            delay = arrival - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(handle(entry, arrival if rate > 0 else loop.time())))
+    await asyncio.gather(*tasks)
+    await bot.inventory_cache.flush_all()
+    elapsed = loop.time() - start
+    stop.set()
+    await lag_task
+
+    return {
+        'rate': rate,
+        'messages': len(corpus),
+        'elapsed_s': elapsed,
+        'throughput_per_s': len(corpus) / elapsed,
+        'latency': summarize(latencies),
+        'loop_lag': summarize(lag_samples),
+        'replies': channel.sent - replies_before,
+        'errors': len(errors),
+        'first_errors': errors[:5],
+    }
+
+
+def load_bot(args):
+    # the bot reads its settings at import time: memory only caches, no stats trace, threads for inference
+    os.environ.setdefault('INFLECTION_CACHE_PATH', '')
+    os.environ.setdefault('INFERENCE_POOL_KIND', 'thread')
+    os.environ.pop('STATS_TRACE_PATH', None)
+    import inventory_with_llm as bot
+    bot.inflection_cache.seed_from_csvs()  # the bot's main block does this, and that doesn't run here
+    return bot
+
+
+async def setup(bot, args):
+    from display_name_index import DisplayNameIndex
+    from fake_firebase import FakeDatabase
+    from name_matcher import CachedNameMatcher
+    from storage import FirebaseStorage, SQLiteStorage
+
+    # the same globals the bot's main block sets up, pointed at local storage
+    if args.storage == 'sqlite':
+        work_dir = tempfile.mkdtemp(prefix='load_test_')
+        bot.user_storage = SQLiteStorage(os.path.join(work_dir, 'inventory.sqlite3'))
+    else:
+        bot.user_storage = FirebaseStorage(FakeDatabase(latency_ms=args.latency_ms).reference().child('users'))
+    for index in range(args.players):
+        user_id, name, display_name = player(index)
+        bot.user_storage.register_user(str(user_id), name, display_name)
+    bot.display_name_index = DisplayNameIndex(bot.user_storage)
+    bot.display_name_index.load()
+    bot.name_matcher = CachedNameMatcher(bot.display_name_index)
+
+    bot.model_ready = asyncio.get_running_loop().create_future()
+    if args.model:
+        await bot.load_inflection_model()
+    else:
+        bot.model_ready.set_exception(RuntimeError("load test without the model"))
+        bot.model_ready.exception()  # retrieved, so asyncio doesn't warn about it
+
+
+def print_phase(result):
+    latency, lag = result['latency'], result['loop_lag']
+    print(
+        f"{result['rate'] or 'max':>6} {result['throughput_per_s']:>10.1f} {latency['p50_ms']:>8.1f} {latency['p95_ms']:>8.1f} "
+        f"{latency['p99_ms']:>8.1f} {latency['max_ms']:>9.1f} {lag['p99_ms']:>8.1f} {lag['max_ms']:>8.1f} {result['errors']:>7}"
+    )
+
+
+async def run(args):
+    if args.verbose:
+        setup_logging(path=None)  # console only, LOG_LEVEL=DEBUG for every item
+    bot = load_bot(args)
+    await setup(bot, args)
+
+    if args.corpus:
+        with open(args.corpus, encoding='utf-8') as f:
+            corpus = [json.loads(line) for line in f if line.strip()]
+    else:
+        corpus = make_corpus(args.messages, args.players, parse_mix(args.mix), args.seed)
+    if args.save_corpus:
+        with open(args.save_corpus, 'w', encoding='utf-8') as f:
+            for entry in corpus:
+                f.write(json.dumps(entry) + '\n')
+
+    authors = {entry['author']: FakeAuthor(entry['author'], f"user{entry['author']}") for entry in corpus}
+    channel = FakeChannel(args.send_latency_ms)
+
+    print(f"{len(corpus)} messages per phase, {args.players} players, storage {args.storage}, "
+          f"inflection {'model' if args.model else 'rules'}, concurrency {args.concurrency}")
+    print(f"{'rate':>6} {'msgs/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>9} {'lag p99':>8} {'lag max':>8} {'errors':>7}")
+    results = []
+    for phase, rate in enumerate(float(value) for value in args.rates.split(',')):
+        bot.stats.reset()
+        result = await run_phase(bot, corpus, rate, args.concurrency, channel, authors, args.seed + phase)
+        result['commands'] = bot.stats.snapshot()
+        result['inventory_cache'] = bot.inventory_cache.stats()
+        results.append(result)
+        print_phase(result)
+        for error in result['first_errors']:
+            print(f"    error: {error}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'phases': results}, f, indent=2)
+        print(f"Results written to {args.json}")
+    bot.user_storage.close()
+    return 1 if any(result['errors'] for result in results) else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replays simulated player and DM traffic through on_message and measures it.")
+    parser.add_argument('--rates', default='50,100,200,0', help="arrival rates in messages/s to run one after another, 0 = no pacing")
+    parser.add_argument('--messages', type=int, default=1000, help="messages per rate")
+    parser.add_argument('--concurrency', type=int, default=256, help="messages handled at once, the rest queue")
+    parser.add_argument('--players', type=int, default=50)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="relative weights of add, remove, inventory, gains and loses")
+    parser.add_argument('--storage', choices=('fake', 'sqlite'), default='fake')
+    parser.add_argument('--latency-ms', type=float, default=20, help="fake firebase latency per call")
+    parser.add_argument('--send-latency-ms', type=float, default=0, help="latency of each channel.send")
+    parser.add_argument('--model', action='store_true', help="load the real inflection model (needs torch)")
+    parser.add_argument('--corpus', help="replay this jsonl corpus ({author, content} per line) instead of generating one")
+    parser.add_argument('--save-corpus', help="write the corpus used to this file")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write the results here")
+    parser.add_argument('--verbose', action='store_true', help="log the bot's lines to the console")
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import os
+
+from dotenv import load_dotenv
+from firebase_admin import credentials, initialize_app, db
+
+import inflection_model
+import morphology
+from bot_logging import setup_logging
+from inflection_cache import InflectionCache, normalize_phrase
+from inventory_layout import is_legacy_entry, migrate_items
+
+
+# One-shot migration from the old inventory layout (items keyed by whatever surface form fit their quantity)
+# to the canonical layout in inventory_layout.py. Safe to run more than once, already migrated items are left alone.
+# Run with: python migrate_inventory.py --dry-run   to see what would change, then without it to write.
+
+BATCH_SIZE = 32
+
+
+def inflect_all(names, cache):
+    """Returns {name: (SINGULAR, PLURAL)} for every name, from the cache or the rules where possible and the model in batches otherwise."""
+    results = {}
+    missing = []
+    for name in names:
+        for directive in ('singularize', 'pluralize'):
+            job = (directive, normalize_phrase(name))
+            cached = cache.get(*job)
+            if cached is None:
+                cached = morphology.inflect(*job)
+            if cached is None:
+                missing.append(job)
+            else:
+                results[job] = cached
+
+    missing = list(dict.fromkeys(missing))
+    for start in range(0, len(missing), BATCH_SIZE):
+        batch = missing[start:start + BATCH_SIZE]
+        for job, generated_text in zip(batch, inflection_model.generate_batch(batch)):
+            cache.put(*job, generated_text)
+            results[job] = generated_text
+
+    return {
+        name: (results[('singularize', normalize_phrase(name))].upper(), results[('pluralize', normalize_phrase(name))].upper())
+        for name in names
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rewrite every inventory into the canonical-key layout.")
+    parser.add_argument('--dry-run', action='store_true', help="print the changes without writing anything")
+    args = parser.parse_args()
+
+    setup_logging(path=None)  # console, for the cache seeding lines
+    load_dotenv()
+    cred = credentials.Certificate(os.getenv('GOOGLE_APPLICATION_CREDENTIALS'))
+    initialize_app(cred, {
+        'databaseURL': 'https://dylans-discord-bot-default-rtdb.firebaseio.com/'  # same database as the bot
+    })
+    cache = InflectionCache(path=os.getenv('INFLECTION_CACHE_PATH', 'inflection_cache.sqlite3') or None)
+    cache.seed_from_csvs()
+
+    users_ref = db.reference('users')
+    user_ids = users_ref.get(shallow=True) or {}
+    migrated_users = 0
+    for user_id in user_ids:
+        inventory_ref = users_ref.child(user_id).child('inventory')
+        items = inventory_ref.get() or {}
+        legacy_keys = [key for key, item_data in items.items() if is_legacy_entry(item_data)]
+        if not legacy_keys:
+            continue
+
+        new_items = migrate_items(items, inflect_all(legacy_keys, cache))
+        print(f"User {user_id}: {len(legacy_keys)} legacy items -> {len(new_items)} items")
+        for key, item_data in new_items.items():
+            print(f"    {key}: {item_data}")
+
+        if not args.dry_run:
+            # set, not update: the old keys have to go away in the same write
+            inventory_ref.set(new_items)
+        migrated_users += 1
+
+    verb = "Would migrate" if args.dry_run else "Migrated"
+    print(f"{verb} {migrated_users} of {len(user_ids)} users")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+import csv
+import os
+import re
+import threading
+
+
+# Rule based inflection, so regular items (SWORD -> SWORDS, TORCH -> TORCHES, POTION OF HEALING -> POTIONS OF HEALING)
+# don't need a trip through T5. It's deliberately timid: anything it isn't sure about comes back as None and goes to the model.
+#
+#   1. find the head noun. "X of Y" style phrases (any preposition really) inflect the word before the preposition,
+#      everything else inflects the last word: "potion of healing", "rusty iron sword"
+#   2. work out whether the head is already singular or plural, since pluralizing "torches" should just give "torches"
+#   3. inflect it from the irregular lexicon (single_word_irregular.csv plus a built-in list) or the suffix rules
+#
+# Phrases with clauses ("blanket that gives you amnesia"), pronouns or verbs that have to agree ("against its will"),
+# conjunctions, numbers, participles in head position and the known-ambiguous endings (-f, -o, -us, -is, -man...) are
+# all left to the model.
+
+IRREGULAR_CSV = 'single_word_irregular.csv'
+
+# singular -> plural, on top of whatever the csv has
+BUILTIN_IRREGULARS = {
+    'man': 'men', 'woman': 'women', 'child': 'children', 'person': 'people', 'foot': 'feet', 'tooth': 'teeth',
+    'goose': 'geese', 'mouse': 'mice', 'louse': 'lice', 'ox': 'oxen', 'die': 'dice',
+    'leaf': 'leaves', 'loaf': 'loaves', 'half': 'halves', 'calf': 'calves', 'elf': 'elves', 'shelf': 'shelves',
+    'wolf': 'wolves', 'thief': 'thieves', 'sheaf': 'sheaves', 'self': 'selves', 'scarf': 'scarves', 'dwarf': 'dwarves',
+    'knife': 'knives', 'life': 'lives', 'wife': 'wives', 'staff': 'staffs',
+    'chief': 'chiefs', 'roof': 'roofs', 'belief': 'beliefs', 'proof': 'proofs', 'reef': 'reefs', 'cliff': 'cliffs',
+    'potato': 'potatoes', 'tomato': 'tomatoes', 'hero': 'heroes', 'torpedo': 'torpedoes', 'volcano': 'volcanoes',
+    'echo': 'echoes', 'veto': 'vetoes', 'photo': 'photos', 'piano': 'pianos', 'memo': 'memos', 'kimono': 'kimonos',
+    'bus': 'buses', 'gas': 'gases', 'lens': 'lenses', 'canvas': 'canvases', 'atlas': 'atlases', 'iris': 'irises',
+    'cactus': 'cacti', 'fungus': 'fungi', 'virus': 'viruses', 'bonus': 'bonuses',
+    'crisis': 'crises', 'analysis': 'analyses', 'thesis': 'theses', 'oasis': 'oases',
+    'quiz': 'quizzes', 'criterion': 'criteria', 'phenomenon': 'phenomena', 'datum': 'data', 'medium': 'media',
+    'shoe': 'shoes', 'toe': 'toes', 'glove': 'gloves', 'olive': 'olives', 'sleeve': 'sleeves', 'valve': 'valves',
+    'house': 'houses', 'horse': 'horses', 'cause': 'causes', 'purse': 'purses', 'nurse': 'nurses', 'vase': 'vases',
+    'human': 'humans', 'talisman': 'talismans', 'caiman': 'caimans', 'shaman': 'shamans', 'german': 'germans',
+    'bias': 'biases', 'alias': 'aliases', 'ache': 'aches', 'headache': 'headaches', 'cache': 'caches',
+    'moustache': 'moustaches', 'mustache': 'mustaches', 'niche': 'niches', 'index': 'indices', 'vortex': 'vortices',
+    'matrix': 'matrices', 'appendix': 'appendices', 'passerby': 'passersby',
+    'monarch': 'monarchs', 'matriarch': 'matriarchs', 'patriarch': 'patriarchs', 'oligarch': 'oligarchs',
+    'epoch': 'epochs', 'stomach': 'stomachs', 'triptych': 'triptychs', 'eunuch': 'eunuchs', 'tech': 'techs',
+}
+
+# irregular words that also show up at the end of hyphenated compounds: field-mouse -> field-mice. Run together
+# (dormouse, grandchild) they can't be told apart from pumice or mongoose, so those go to the model
+COMPOUND_IRREGULARS = ('mouse', 'goose', 'tooth', 'foot', 'child', 'woman')
+
+# modifiers that change too when the phrase is pluralized: women doctors, children prodigies
+_INFLECTED_MODIFIERS = {'man', 'woman', 'child', 'gentleman', 'lady'}
+
+# same in both directions
+INVARIANTS = {
+    'sheep', 'fish', 'deer', 'moose', 'series', 'species', 'aircraft', 'spacecraft', 'hovercraft', 'salmon', 'trout',
+    'swine', 'offspring', 'news', 'means', 'headquarters', 'chassis', 'corps', 'starfish',
+}
+
+# words the rules won't answer even on their own, the model decides: plural only ("goggles of night" stays goggles,
+# clothes isn't the plural of clothe), and words that may or may not change (bass, shrimp, bison)
+UNSURE_NUMBER = {
+    'clothes', 'goggles', 'leggings', 'jeggings', 'pajamas', 'pyjamas', 'overalls', 'shears', 'scissors', 'pants',
+    'trousers', 'jeans', 'shorts', 'tongs', 'pliers', 'tweezers', 'tights', 'slacks', 'breeches', 'pantaloons',
+    'suspenders', 'binoculars', 'glasses', 'sunglasses', 'spectacles', 'specs', 'chaps', 'undies', 'knickers',
+    'barracks', 'gallows', 'histrionics', 'thanks', 'riches', 'remains', 'surroundings', 'belongings', 'outskirts',
+    'bass', 'cod', 'shrimp', 'squid', 'carp', 'pike', 'tuna', 'krill', 'elk', 'bison', 'buffalo', 'caribou', 'driftwood',
+    'chaos', 'cosmos', 'ethos', 'pathos', 'fracas', 'rhinoceros', 'mongoose',
+}
+# compounds of invariant and plural only words: jellyfish, reindeer, sweatpants, spectagoggles
+_UNSURE_ENDINGS = ('fish', 'deer', 'sheep', 'pants', 'goggles', 'leggings', 'tights', 'glasses')
+
+# latin, greek and hebrew nouns with a classical plural, instead of or as well as the regular one. Both forms are
+# listed, the rules can't tell which one a player means (data, stigmata, cherubim)
+CLASSICAL = {
+    'data', 'media', 'bacteria', 'criteria', 'phenomena', 'memoranda', 'strata', 'addenda', 'millennia', 'spectra',
+    'consortia', 'stadia', 'dicta', 'ova', 'errata', 'genera', 'corpora', 'opera', 'maxima', 'minima', 'arcana',
+    'foramina', 'horologia', 'automata', 'automaton', 'stigma', 'schema', 'lemma', 'dogma', 'magma', 'alga', 'alumna',
+    'amoeba', 'lacuna', 'minutia', 'nova', 'supernova', 'cherub', 'cherubim', 'seraph', 'seraphim', 'kibbutz',
+    'kibbutzim', 'bases', 'penes', 'testes', 'synopses', 'emphases', 'ellipses', 'octopus', 'octopi',
+}
+# -mata (stigmata, anathemata), -eau/-eaux (bureaus or bureaux), -sis plurals (prognoses, hypotheses, analyses)
+_CLASSICAL_ENDINGS = ('mata', 'eau', 'eaux', 'eses', 'yses')
+
+# adjectives that come after the noun, so the noun before them is the one that inflects: attorneys general,
+# courts-martial, knights-errant. The model gets those
+POSTPOSITIVES = {
+    'general', 'public', 'apparent', 'presumptive', 'major', 'laureate', 'martial', 'errant', 'royal', 'elect',
+    'designate', 'extraordinary', 'plenipotentiary', 'militant',
+}
+
+# singulars ending in -ie, so their -ies plural doesn't turn into -y
+IE_WORDS = {
+    'cookie', 'movie', 'zombie', 'brownie', 'pixie', 'hoodie', 'selfie', 'rookie', 'smoothie', 'calorie', 'genie',
+    'necktie', 'beanie', 'goalie', 'veggie', 'magpie', 'pie', 'tie', 'lie', 'auntie', 'birdie', 'bootie', 'sortie',
+    'prairie', 'eyrie', 'lassie', 'collie', 'hippie', 'yuppie', 'boogie', 'walkie-talkie',
+}
+
+PREPOSITIONS = {
+    'of', 'in', 'on', 'with', 'for', 'from', 'to', 'at', 'by', 'under', 'over', 'about', 'without', 'inside', 'near',
+    'behind', 'above', 'below', 'into', 'onto', 'against', 'between', 'across', 'through', 'around', 'beneath',
+    'within', 'upon', 'beside', 'containing', 'made', 'filled', 'full',
+}
+
+# words that mean there's a clause or something else that may have to agree with the head. The model handles those
+_NEEDS_MODEL = {
+    'that', 'which', 'who', 'whom', 'whose', 'where', 'when', 'while', 'if', 'because', 'and', 'or', 'but', 'nor',
+    'it', 'its', "it's", 'they', 'them', 'their', 'theirs', 'this', 'these', 'those', 'is', 'are', 'was', 'were',
+    'has', 'have', 'does', 'do', 'a', 'an', 'one', 'each', 'every', 'some', 'many', 'several', 'few', 'any', 'all',
+    'dozen', 'dozens', 'nobody', 'somebody', 'anybody', 'everybody', 'someone', 'anyone', 'everyone', 'nothing', 'something',
+    'i', 'you', 'he', 'she', 'we', 'me', 'him', 'her', 'us', 'my', 'your', 'his', 'our', 'not', 'no',
+}
+
+# irregular past participles, for spotting "heart bound in copper" where the word before the preposition is a verb
+_PARTICIPLES = {
+    'bound', 'caught', 'frozen', 'made', 'worn', 'held', 'stuck', 'broken', 'lost', 'found', 'hidden', 'stolen', 'sewn',
+    'woven', 'torn', 'written', 'drawn', 'spun', 'sold', 'left', 'kept', 'built', 'set', 'cut', 'hung', 'sunk', 'shot',
+    'given', 'taken', 'forgotten', 'chosen', 'bitten', 'beaten', 'swollen', 'shaken', 'burnt', 'dug', 'fed', 'led',
+}
+
+_WORD = re.compile(r"^[a-z]+(?:-[a-z]+)*$")
+_LOOSE_WORD = re.compile(r"^[a-z0-9'&.,:-]+$")
+
+_lexicon = None
+_lexicon_lock = threading.Lock()
+
+
+class Lexicon:
+    def __init__(self, to_plural, to_singular, invariants):
+        self.to_plural = to_plural
+        self.to_singular = to_singular
+        self.invariants = invariants
+
+
+def load_lexicon(path=IRREGULAR_CSV):
+    """Built-in irregulars plus the pairs from single_word_irregular.csv that agree in both directions."""
+    to_plural = dict(BUILTIN_IRREGULARS)
+    invariants = set(INVARIANTS)
+    if os.path.exists(path):
+        plural_rows, singular_rows = {}, {}
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                directive = (row.get('directive') or '').strip()
+                source = (row.get('input_text') or '').strip().lower()
+                target = (row.get('output_text') or '').strip().lower()
+                if not source or not target or ' ' in source or ' ' in target:
+                    continue
+                if directive == 'pluralize':
+                    plural_rows[source] = target
+                elif directive == 'singularize':
+                    singular_rows[target] = source  # keyed by the singular, like plural_rows
+        for singular, plural in plural_rows.items():
+            # a pair only counts if the singularize row says the same thing, the csv has the odd typo
+            if singular_rows.get(singular) != plural:
+                continue
+            if singular == plural:
+                invariants.add(singular)
+            else:
+                to_plural[singular] = plural
+    to_singular = {plural: singular for singular, plural in to_plural.items()}
+    return Lexicon(to_plural, to_singular, invariants)
+
+
+def lexicon():
+    global _lexicon
+    if _lexicon is None:
+        with _lexicon_lock:
+            if _lexicon is None:
+                _lexicon = load_lexicon()
+    return _lexicon
+
+
+def _number(word, lex):
+    """'singular', 'plural', 'invariant' or None if the word could be either."""
+    if word in UNSURE_NUMBER or word in CLASSICAL:
+        return None
+    if word in lex.invariants:
+        return 'invariant'
+    if word in lex.to_plural:
+        return 'singular'
+    if word in lex.to_singular:
+        return 'plural'
+    if word.endswith(_UNSURE_ENDINGS + _CLASSICAL_ENDINGS):
+        return None
+    if word.endswith(tuple(_COMPOUND_SINGULARS) + tuple(_COMPOUND_PLURALS)):
+        return None  # dormice or pumice, grandchild or mongoose: only whole words and hyphenated compounds are safe
+    if word.endswith('oses') and len(word) > 5:
+        return None  # prognoses, metamorphoses, but also purposes: the model sorts them out
+    if len(word) < 3 or not any(vowel in word for vowel in 'aeiouy'):
+        return None  # too short to tell, or an abbreviation like vhs
+
+    if word.endswith('s'):
+        if word.endswith(('ss', 'ous')):
+            return 'singular'  # glass, boss, famous
+        if word.endswith(('us', 'is', 'ves', 'oes', 'uses', 'ises', 'axes', 'ixes', 'exes', 'zzes', 'ices')):
+            return None  # bus/cactus, leaves/gloves, potatoes/shoes, houses/buses, axes, quizzes, dice/prices
+        if word.endswith('aches') and not word.endswith(('eaches', 'oaches')):
+            return None  # headaches/stomaches
+        return 'plural'
+
+    if word.endswith(('men', 'i', 'ae', 'ex', 'ix', 'um', 'ula', 'bra', 'nna', 'rva')):
+        return None  # firemen/specimen, fungi/taxi, larvae, index/apex, curricula/drums, formulae/antennae
+    if word.endswith('f') and not word.endswith('ff'):
+        return None  # roofs or leaves, no telling
+    if word.endswith('fe'):
+        return None  # knives but safes
+    if word.endswith('o') and word[-2] not in 'aeiou':
+        return None  # potatoes but pianos
+    if word.endswith('man'):
+        return None  # firemen but humans
+    return 'singular'
+
+
+def _compound(word, table):
+    # table is _COMPOUND_PLURALS for singular compounds, or its inverse for plural ones. Hyphenated only: field-mouse,
+    # never mongoose
+    for suffix, replacement in table.items():
+        if word.endswith('-' + suffix):
+            return word[:-len(suffix)] + replacement
+    return None
+
+
+_COMPOUND_PLURALS = {singular: BUILTIN_IRREGULARS[singular] for singular in COMPOUND_IRREGULARS}
+_COMPOUND_SINGULARS = {plural: singular for singular, plural in _COMPOUND_PLURALS.items()}
+
+
+def _pluralize_word(word, lex):
+    if word in lex.to_plural:
+        return lex.to_plural[word]
+    compound = _compound(word, _COMPOUND_PLURALS)
+    if compound:
+        return compound
+    if word.endswith(('s', 'x', 'z', 'ch', 'sh')):
+        return word + 'es'
+    if word.endswith('y') and word[-2] not in 'aeiou':
+        return word[:-1] + 'ies'
+    return word + 's'
+
+
+def _singularize_word(word, lex):
+    if word in lex.to_singular:
+        return lex.to_singular[word]
+    compound = _compound(word, _COMPOUND_SINGULARS)
+    if compound:
+        return compound
+    if word.endswith('ies'):
+        if word[:-1] in IE_WORDS or len(word) <= 4:
+            return word[:-1]  # cookies, pies
+        return word[:-3] + 'y'
+    if word.endswith(('sses', 'ches', 'shes', 'xes', 'tzes')):
+        return word[:-2]
+    return word[:-1]
+
+
+def inflect_word(directive, word, lex=None):
+    """Inflects a single lowercase word (hyphenated words inflect their last part). Returns None if unsure."""
+    lex = lex or lexicon()
+    if not _WORD.match(word):
+        return None
+    prefix, _, last = word.rpartition('-')
+    if prefix and set(prefix.split('-')) & PREPOSITIONS:
+        return None  # mother-in-law and friends
+    if prefix and last in POSTPOSITIVES:
+        return None  # court-martial
+    number = _number(last, lex)
+    if number is None:
+        return None
+
+    if number == 'invariant':
+        inflected = last
+    elif directive == 'pluralize':
+        inflected = last if number == 'plural' else _pluralize_word(last, lex)
+    elif directive == 'singularize':
+        inflected = last if number == 'singular' else _singularize_word(last, lex)
+    else:
+        return None
+    return f"{prefix}-{inflected}" if prefix else inflected
+
+
+def head_index(words):
+    """Index of the head noun in a list of words, or None if the phrase is too complicated to tell."""
+    if any(word in _NEEDS_MODEL for word in words):
+        return None
+    head = len(words) - 1
+    for index, word in enumerate(words):
+        if word in PREPOSITIONS:
+            head = index - 1
+            break
+    if head < 0:
+        return None
+    modifiers = words[:head]
+    if 'the' in modifiers or "'" in " ".join(modifiers) or _INFLECTED_MODIFIERS.intersection(modifiers):
+        # "ox pulling the heavy cart" (a verb, not modifiers), "fisherman's net", "woman doctor": the model's job
+        return None
+    if any(not _WORD.match(word) for word in modifiers):
+        return None
+    if any(word.endswith('ing') or word in _PARTICIPLES for word in words[1:head + 1]):
+        # "brass spider weaving silver", "clockwork heart bound in copper": probably a verb in there, not a modifier
+        return None
+    return head
+
+
+def decompose(phrase):
+    """
+    Splits a normalized phrase around its head noun: "potion of greater healing" -> ('', 'potion', 'of greater healing').
+    Inflecting the phrase is then inflecting the head on its own and putting the rest back, see join().
+
+    Returns:
+        (before, head, after), or None when the phrase has to be inflected as a whole (clauses, agreement, no clear head).
+    """
+    words = phrase.split()
+    if not words or len(words) > 12:
+        return None
+    if any(not _LOOSE_WORD.match(word) for word in words):
+        return None  # quotes, brackets, emoji, numbers written oddly
+    index = head_index(words)
+    if index is None:
+        return None
+    head = words[index]
+    lex = lexicon()
+    if not _WORD.match(head):
+        return None
+    if index > 0 and head in POSTPOSITIVES:
+        return None  # attorneys general
+    if head.endswith(('ed', 'ly', 'ing')) and head not in lex.to_plural and head not in lex.to_singular:
+        # "iphone charger suspended in amber": the word before the preposition is a participle, not the head
+        # (-ing too: "painting" is a noun but "glowing" isn't, and the rules can't tell them apart)
+        return None
+    return " ".join(words[:index]), head, " ".join(words[index + 1:])
+
+
+def join(before, head, after):
+    return " ".join(part for part in (before, head, after) if part)
+
+
+def inflects_by_head(parts, lex=None):
+    """
+    Whether a decompose()d phrase can be inflected by inflecting its head alone, by the rules or by the model.
+    An invariant head with anything around it can't: the model tends to inflect something else in the phrase instead
+    (fish in the tanks), so the whole phrase has to go to it.
+    """
+    before, head, after = parts
+    lex = lex or lexicon()
+    return not (head in lex.invariants and (before or after))
+
+
+def inflect(directive, phrase):
+    """
+    Inflects a normalized (lowercase) phrase without the model.
+
+    Returns:
+        The inflected phrase, or None when the rules aren't confident and the model should decide.
+    """
+    parts = decompose(phrase)
+    if parts is None:
+        return None
+    lex = lexicon()
+    if not inflects_by_head(parts, lex):
+        return None
+    before, head, after = parts
+
+    inflected = inflect_word(directive, head, lex)
+    if inflected is None:
+        return None
+    return join(before, inflected, after)
+
+
+
+def _clause_start(word):
+    # words that end the noun phrase when guessing: prepositions, clause words, participles, -ing verbs
+    return (word in PREPOSITIONS or word in _NEEDS_MODEL or word in _PARTICIPLES
+            or (len(word) > 4 and word.endswith(('ing', 'ed'))))
+
+
+def guess(directive, phrase):
+    """
+    Best effort inflection that always answers, for when the model isn't available (still loading, or failed to load).
+    Uses inflect() when it's confident, otherwise inflects the word before whatever starts a clause (or the last word)
+    with the plain suffix rules, assuming a word ending in s is plural. Not cached, so the model gets its say later.
+    """
+    confident = inflect(directive, phrase)
+    if confident is not None:
+        return confident
+    words = phrase.split()
+    if not words:
+        return phrase
+    index = next((i - 1 for i, word in enumerate(words) if i > 0 and _clause_start(word)), len(words) - 1)
+    head = words[index]
+    lex = lexicon()
+    if not head.isalpha() or head in lex.invariants:
+        return phrase
+    looks_plural = head in lex.to_singular or (head.endswith('s') and not head.endswith('ss') and head not in lex.to_plural)
+    if directive == 'pluralize' and not looks_plural:
+        head = _pluralize_word(head, lex)
+    elif directive == 'singularize' and looks_plural:
+        head = _singularize_word(head, lex)
+    return " ".join(words[:index] + [head] + words[index + 1:])
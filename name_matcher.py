@@ -0,0 +1,152 @@
+from collections import deque
+
+
+# The DM commands used to build a giant "name1|name2|..." regex out of every display name, three times per message, and compile it every time.
+# This builds an Aho-Corasick automaton over the names once (and again only when the names change),
+# finds "<display name> gains/loses" in one pass over the message, and says which one it was.
+
+ACTION_VERBS = {
+    'gains': 'gain',
+    'GAINS': 'gain',
+    'loses': 'lose',
+    'LOSES': 'lose',
+}
+
+
+def _is_word_char(char):
+    # same idea as \w in re
+    return char.isalnum() or char == '_'
+
+
+class NameMatch:
+    """A display name followed by an action verb. end is where the item list starts."""
+
+    __slots__ = ('display_name', 'user_id', 'action', 'start', 'end')
+
+    def __init__(self, display_name, user_id, action, start, end):
+        self.display_name = display_name
+        self.user_id = user_id
+        self.action = action
+        self.start = start
+        self.end = end
+
+    def __repr__(self):
+        return f"NameMatch({self.display_name!r}, {self.user_id!r}, {self.action!r}, {self.start}, {self.end})"
+
+
+class NameMatcher:
+    """
+    Aho-Corasick automaton over display names.
+
+    Args:
+        display_names: dict mapping display_name -> user_id
+    """
+
+    def __init__(self, display_names):
+        self.display_names = dict(display_names)
+        # node 0 is the root. _goto[node] maps char -> node, _output[node] is the longest name ending at node
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [None]
+        self._dict_link = [0]  # nearest node down the fail chain that ends a name, for overlapping shorter names
+        for display_name in self.display_names:
+            if display_name:
+                self._insert(display_name)
+        self._build_links()
+        self._max_name_length = max((len(name) for name in self.display_names), default=0)
+
+    def _insert(self, display_name):
+        node = 0
+        for char in display_name:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(None)
+                self._dict_link.append(0)
+            node = next_node
+        self._output[node] = display_name
+
+    def _build_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                fail = self._goto[fallback].get(char, 0)
+                self._fail[child] = fail
+                self._dict_link[child] = fail if self._output[fail] is not None else self._dict_link[fail]
+                queue.append(child)
+
+    def search(self, text):
+        """
+        Finds the leftmost "<display name><whitespace><gains|GAINS|loses|LOSES>" in text, or None.
+        When several names match at the same spot, the longest one wins.
+        """
+        best = None
+        node = 0
+        for index, char in enumerate(text):
+            if best is not None and index - best.start >= self._max_name_length:
+                break  # every name that could start at or before the best match has been seen already
+
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+
+            candidate = node if self._output[node] is not None else self._dict_link[node]
+            while candidate:
+                display_name = self._output[candidate]
+                start = index + 1 - len(display_name)
+                if best is None or start < best.start or (start == best.start and len(display_name) > len(best.display_name)):
+                    match = self._match_at(text, display_name, start, index + 1)
+                    if match is not None:
+                        best = match
+                candidate = self._dict_link[candidate]
+        return best
+
+    def _match_at(self, text, display_name, start, end):
+        # \b before the name, like the old regex had
+        if _is_word_char(display_name[0]):
+            if start > 0 and _is_word_char(text[start - 1]):
+                return None
+        elif start == 0 or not _is_word_char(text[start - 1]):
+            return None
+
+        # then at least one whitespace character and the verb
+        position = end
+        while position < len(text) and text[position].isspace():
+            position += 1
+        if position == end:
+            return None
+        verb = text[position:position + 5]
+        action = ACTION_VERBS.get(verb)
+        if action is None:
+            return None
+        return NameMatch(display_name, self.display_names[display_name], action, start, position + len(verb))
+
+
+class CachedNameMatcher:
+    """
+    Keeps one NameMatcher around for a DisplayNameIndex and only rebuilds it when the index version changes.
+    """
+
+    def __init__(self, display_name_index):
+        self.display_name_index = display_name_index
+        self._version = None
+        self._matcher = None
+        self.rebuilds = 0
+
+    def get(self):
+        version = self.display_name_index.version
+        if self._matcher is None or version != self._version:
+            self._matcher = NameMatcher(self.display_name_index.names())
+            self._version = version
+            self.rebuilds += 1
+        return self._matcher
+
+    def search(self, text):
+        return self.get().search(text)
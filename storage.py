@@ -0,0 +1,220 @@
+import json
+import os
+import sqlite3
+import threading
+
+
+# Where users and inventories live. The bot only talks to a Storage, so the database behind it is a setting:
+#   STORAGE_BACKEND=firebase  the realtime database, same layout as always (users/<id>/{username, display_name, inventory})
+#   STORAGE_BACKEND=sqlite    one local file (SQLITE_STORAGE_PATH), WAL mode. No network round trips, so inventory
+#                             operations take well under a millisecond, and the whole bot can run and be load tested offline.
+# All methods block, the bot runs them in db_pool like any other database call.
+#
+# Inventories are read with an ETag and written whole with a compare-and-set on it (see inventory_cache.py). For firebase
+# that's the real ETag, for sqlite it's a version number per user that every write bumps.
+
+
+class Storage:
+    """
+    Interface the bot uses for users and inventories. user_id is always passed as a string.
+    """
+
+    def register_user(self, user_id, username, display_name):
+        """Creates (or resets) a user with an empty inventory."""
+        raise NotImplementedError
+
+    def display_names(self):
+        """{user_id: display_name} for every user that has one."""
+        raise NotImplementedError
+
+    def user_id_for(self, display_name):
+        """The user with this display name, or None."""
+        raise NotImplementedError
+
+    def load_inventory(self, user_id):
+        """(inventory dict or None, etag)"""
+        raise NotImplementedError
+
+    def write_inventory_if_unchanged(self, user_id, etag, items):
+        """
+        Replaces the inventory with items, all at once, only if its etag is still etag.
+        Returns (success, current items, current etag) like firebase_admin's set_if_unchanged.
+        """
+        raise NotImplementedError
+
+    def listen_users(self, callback):
+        """
+        Calls callback with firebase style events (event_type, path, data) for changes made outside this process.
+        Returns something with close(), or None when the backend has no such thing.
+        """
+        return None
+
+    def close(self):
+        pass
+
+
+class FirebaseStorage(Storage):
+    """
+    Args:
+        users_ref: firebase db reference to 'users' (or anything with the same interface, like fake_firebase's)
+    """
+
+    def __init__(self, users_ref):
+        self.users_ref = users_ref
+
+    def register_user(self, user_id, username, display_name):
+        self.users_ref.child(user_id).set({'username': username, 'display_name': display_name, 'inventory': {}})
+
+    def display_names(self):
+        # a shallow query plus one small read per user, never the inventories
+        user_ids = self.users_ref.get(shallow=True) or {}
+        by_user = {}
+        for user_id in user_ids:
+            display_name = self.users_ref.child(user_id).child('display_name').get()
+            if display_name:
+                by_user[str(user_id)] = display_name
+        return by_user
+
+    def user_id_for(self, display_name):
+        # realtime database needs an index rule on display_name for this query, the bot itself uses DisplayNameIndex
+        found = self.users_ref.order_by_child('display_name').equal_to(display_name).limit_to_first(1).get()
+        return next(iter(found), None) if found else None
+
+    def load_inventory(self, user_id):
+        return self.users_ref.child(user_id).child('inventory').get(etag=True)
+
+    def write_inventory_if_unchanged(self, user_id, etag, items):
+        return self.users_ref.child(user_id).child('inventory').set_if_unchanged(etag, items)
+
+    def listen_users(self, callback):
+        return self.users_ref.listen(callback)
+
+
+class SQLiteStorage(Storage):
+    """
+    Users and inventories in a local sqlite file. Each item is its own row, so a write only touches the items that changed.
+    One connection per thread (db_pool has several), WAL mode so reads never wait on a write.
+
+    Args:
+        path: the database file, created if it doesn't exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        connection = self._connection()
+        connection.executescript(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id TEXT PRIMARY KEY, username TEXT, display_name TEXT, version INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS users_display_name ON users (display_name);"
+            "CREATE TABLE IF NOT EXISTS items ("
+            "user_id TEXT NOT NULL, item_key TEXT NOT NULL, quantity INTEGER NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (user_id, item_key)) WITHOUT ROWID;"
+        )
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            # isolation_level=None: no implicit transactions, every write below says BEGIN IMMEDIATE itself
+            connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")  # durable across app crashes, only an OS crash can lose the last commits
+            self._local.connection = connection
+            with self._connections_lock:
+                self._connections.append(connection)
+        return connection
+
+    def register_user(self, user_id, username, display_name):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT INTO users (user_id, username, display_name, version) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, display_name = excluded.display_name, "
+                "version = users.version + 1",
+                (user_id, username, display_name),
+            )
+            connection.execute("DELETE FROM items WHERE user_id = ?", (user_id,))
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def display_names(self):
+        rows = self._connection().execute("SELECT user_id, display_name FROM users WHERE display_name IS NOT NULL AND display_name != ''")
+        return {user_id: display_name for user_id, display_name in rows}
+
+    def user_id_for(self, display_name):
+        row = self._connection().execute("SELECT user_id FROM users WHERE display_name = ? LIMIT 1", (display_name,)).fetchone()
+        return row[0] if row else None
+
+    def _read(self, connection, user_id):
+        # caller is inside a transaction, so the version and the items are from the same snapshot
+        row = connection.execute("SELECT version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        items = {
+            item_key: json.loads(data)
+            for item_key, data in connection.execute("SELECT item_key, data FROM items WHERE user_id = ?", (user_id,))
+        }
+        return items or None, str(row[0] if row else 0)
+
+    def load_inventory(self, user_id):
+        connection = self._connection()
+        connection.execute("BEGIN")
+        try:
+            return self._read(connection, user_id)
+        finally:
+            connection.execute("COMMIT")
+
+    def write_inventory_if_unchanged(self, user_id, etag, items):
+        connection = self._connection()
+        # IMMEDIATE takes the write lock up front, so nothing can sneak in between the version check and the write
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            current, current_etag = self._read(connection, user_id)
+            if current_etag != etag:
+                connection.execute("COMMIT")
+                return False, current, current_etag
+
+            current = current or {}
+            items = items or {}
+            removed = [(user_id, key) for key in current if key not in items]
+            changed = [
+                (user_id, key, int(item_data.get('quantity', 0)), json.dumps(item_data, sort_keys=True))
+                for key, item_data in items.items()
+                if current.get(key) != item_data
+            ]
+            connection.executemany("DELETE FROM items WHERE user_id = ? AND item_key = ?", removed)
+            connection.executemany("INSERT OR REPLACE INTO items (user_id, item_key, quantity, data) VALUES (?, ?, ?, ?)", changed)
+            new_version = int(current_etag) + 1
+            connection.execute(
+                "INSERT INTO users (user_id, version) VALUES (?, ?) ON CONFLICT (user_id) DO UPDATE SET version = excluded.version",
+                (user_id, new_version),
+            )
+            connection.execute("COMMIT")
+            return True, items or None, str(new_version)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._connections_lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+def backend():
+    return os.getenv('STORAGE_BACKEND', 'firebase')
+
+
+def storage_from_env():
+    """The Storage STORAGE_BACKEND asks for. Firebase has to be initialized already when that's the one."""
+    if backend() == 'firebase':
+        from firebase_admin import db
+
+        return FirebaseStorage(db.reference('users'))
+    if backend() == 'sqlite':
+        return SQLiteStorage(os.getenv('SQLITE_STORAGE_PATH', 'inventory.sqlite3'))
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend()!r}, expected 'firebase' or 'sqlite'")
@@ -0,0 +1,131 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_firebase import FakeDatabase
+from storage import FirebaseStorage, SQLiteStorage
+from inventory_cache import InventoryCache
+from inventory_layout import apply_add, apply_remove, canonical_key, inventory_entry
+
+
+# Stress test for concurrent inventory edits, against the in-memory fake database (or with --storage sqlite, a temporary
+# sqlite file with one SQLiteStorage per bot) instead of the real one.
+# Several InventoryCache instances stand in for separate bot processes sharing one database, each firing lots of concurrent
+# add/remove messages at the same handful of users. Every message does what handle_message does: take the user's lock,
+# edit, commit. Afterwards every quantity has to match exactly what was added minus what was removed, a lost update shows up as a mismatch.
+# Run with: python stress_inventory.py --bots 4 --messages 500
+
+ITEMS = [('TORCH', 'TORCHES'), ('ROPE', 'ROPES'), ('ARROW', 'ARROWS'), ('POTION OF HEALING', 'POTIONS OF HEALING')]
+STARTING_QUANTITY = 1_000_000  # big enough that a remove never runs out, so every op's effect is known up front
+
+
+def make_bot(user_storage, executor, max_retries, flush_window_ms):
+    loop = asyncio.get_running_loop()
+
+    async def load(user_id):
+        return await loop.run_in_executor(executor, user_storage.load_inventory, user_id)
+
+    async def write_if_unchanged(user_id, etag, items):
+        return await loop.run_in_executor(executor, user_storage.write_inventory_if_unchanged, user_id, etag, items)
+
+    return InventoryCache(load, write_if_unchanged, flush_window_ms=flush_window_ms, max_retries=max_retries)
+
+
+async def message(cache, user_id, action, forms, quantity, rng):
+    await asyncio.sleep(rng.random() * 0.01)  # messages trickle in instead of all at once
+    async with cache.lock(user_id):
+        inventory = await cache.get(user_id)
+        op = apply_add if action == 'add' else apply_remove
+        result = inventory.apply(op, *forms, quantity)
+        await cache.commit(user_id)
+    return result
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    users = [str(100 + i) for i in range(args.users)]
+    starting_inventory = {canonical_key(s): inventory_entry(s, p, STARTING_QUANTITY) for s, p in ITEMS}
+    database = None
+    if args.storage == 'sqlite':
+        work_dir = tempfile.TemporaryDirectory()
+        path = os.path.join(work_dir.name, 'stress.sqlite3')
+        storages = [SQLiteStorage(path) for _ in range(args.bots)]  # own connections each, like separate processes
+        for user_id in users:
+            storages[0].register_user(user_id, user_id, f"player {user_id}")
+            storages[0].write_inventory_if_unchanged(user_id, storages[0].load_inventory(user_id)[1], starting_inventory)
+    else:
+        database = FakeDatabase({
+            'users': {user_id: {'inventory': starting_inventory} for user_id in users}
+        }, latency_ms=args.latency_ms)
+        storages = [FirebaseStorage(database.reference().child('users'))] * args.bots
+    executor = ThreadPoolExecutor(max_workers=32)
+    bots = [make_bot(user_storage, executor, args.max_retries, args.flush_window_ms) for user_storage in storages]
+
+    expected = {user_id: {canonical_key(s): STARTING_QUANTITY for s, _ in ITEMS} for user_id in users}
+    tasks = []
+    for _ in range(args.messages):
+        user_id = rng.choice(users)
+        forms = rng.choice(ITEMS)
+        quantity = rng.randint(1, 5)
+        action = rng.choice(('add', 'remove'))
+        expected[user_id][canonical_key(forms[0])] += quantity if action == 'add' else -quantity
+        tasks.append(message(rng.choice(bots), user_id, action, forms, quantity, rng))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    for bot in bots:
+        await bot.flush_all()
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+
+    errors = [result for result in results if isinstance(result, Exception)]
+    mismatches = []
+    for user_id in users:
+        stored = storages[0].load_inventory(user_id)[0] or {}
+        for key, quantity in expected[user_id].items():
+            actual = stored.get(key, {}).get('quantity', 0)
+            if actual != quantity:
+                mismatches.append(f"user {user_id} {key}: expected {quantity}, got {actual}")
+
+    totals = {name: sum(bot.stats()[name] for bot in bots) for name in ('writes', 'conflicts', 'aborts', 'loads')}
+    print(f"{args.messages} messages from {args.bots} bots on {args.users} users in {elapsed:.2f}s")
+    print(f"writes {totals['writes']}, conflicts {totals['conflicts']}, aborts {totals['aborts']}, loads {totals['loads']}"
+          + (f", database calls {database.calls}" if database else ""))
+    for user_storage in set(storages):
+        user_storage.close()
+    print(f"conflicts per write: {totals['conflicts'] / max(totals['writes'], 1):.3f}")
+    for error in errors[:5]:
+        print(f"error: {error!r}")
+    for mismatch in mismatches[:20]:
+        print(f"MISMATCH {mismatch}")
+
+    if mismatches or (errors and not totals['aborts']):
+        return 1
+    if totals['aborts']:
+        # an abort is a refused message, not a lost update, but with the default retries it shouldn't happen here
+        print(f"{totals['aborts']} writes gave up, try a higher --max-retries")
+        return 1
+    print("OK, no lost updates")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent add/remove stress test for the inventory cache.")
+    parser.add_argument('--bots', type=int, default=4, help="cache instances sharing the database, like separate processes")
+    parser.add_argument('--users', type=int, default=3)
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--storage', choices=('fake', 'sqlite'), default='fake', help="fake firebase, or sqlite through storage.py")
+    parser.add_argument('--latency-ms', type=float, default=2.0, help="fake firebase only")
+    parser.add_argument('--max-retries', type=int, default=20)
+    parser.add_argument('--flush-window-ms', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    sys.exit(asyncio.run(run(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()